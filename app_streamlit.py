@@ -3,51 +3,178 @@ import sqlite3
 import pandas as pd
 import json
 import os
-import glob
-from scripts.db import get_connection
+import sys
+
+# Pipeline modules import each other as top-level modules (run from scripts/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts'))
+from db import init_db, get_connection, latest_event_seq, fetch_events
+from page_store import PageStore, doc_dir_for, IDX_FILE
+from page_layout import load_layout, LAYOUT_FILE
+from search_index import search
+
+EXTRACTION_DIRS = ['extractions_approved', 'extractions_valid', 'extractions_raw']
+READY_STATUSES = ('needs_review', 'validated_ok')
+EVENT_POLL_SECONDS = 5
+# Pages marked as likely tables (default of images.table_score_threshold)
+TABLE_SCORE_THRESHOLD = 0.4
 
 st.set_page_config(layout="wide")
 st.title("Meta-Analysis Extraction Review")
 
-# Connect to DB
-conn = get_connection()
+# --- Cached loaders ---
+# Reruns happen on every click, so nothing below re-reads a file that hasn't changed
+
+@st.cache_resource
+def init_schema():
+    # Creates doc_events and its triggers on databases from before the change feed
+    init_db()
+
+def get_db():
+    """This session's connection; a commit in one session can't flush another's half-done UPDATE"""
+    init_schema()
+    if 'db' not in st.session_state:
+        # A session's reruns run one at a time, but not always on the same thread
+        st.session_state['db'] = get_connection(check_same_thread=False)
+    return st.session_state['db']
+
+def store_version(doc_id):
+    """Changes whenever pages are appended to the doc's store"""
+    try:
+        st_idx = os.stat(os.path.join(doc_dir_for(doc_id), IDX_FILE))
+    except FileNotFoundError:
+        return None
+    return (st_idx.st_size, st_idx.st_mtime_ns)
+
+@st.cache_data(max_entries=16)
+def store_pages(doc_id, version):
+    """Page numbers in the doc's store"""
+    with PageStore(doc_id) as store:
+        return store.pages()
+
+@st.cache_data(max_entries=64)
+def page_text(doc_id, version, page):
+    # Memory-mapped only while reading, so no handle outlives the rerun and
+    # re-extracted pages (a new version) are read from the new file
+    with PageStore(doc_id) as store:
+        return store.read_page(page)
+
+def layout_version(doc_id):
+    try:
+        st_layout = os.stat(os.path.join(doc_dir_for(doc_id), LAYOUT_FILE))
+    except FileNotFoundError:
+        return None
+    return (st_layout.st_size, st_layout.st_mtime_ns)
+
+@st.cache_data(max_entries=16)
+def layout_summary(doc_id, version):
+    """{page: (table_score, words, lines, rects)} from the layout cache; the words themselves aren't kept"""
+    return {
+        page: (layout['table_score'], len(layout['words']), layout['lines'], layout['rects'])
+        for page, layout in load_layout(doc_id).items()
+    }
+
+def extraction_path(doc_id):
+    """Approved -> valid -> raw"""
+    for directory in EXTRACTION_DIRS:
+        path = os.path.join(directory, f'{doc_id}.json')
+        if os.path.exists(path):
+            return path
+    return None
+
+@st.cache_data(max_entries=64)
+def load_extraction(path, mtime_ns):
+    with open(path, 'r') as f:
+        data = json.load(f)
+    return data, json.dumps(data, indent=2)
+
+def item_label(section, item):
+    for key, value in item.items():
+        if key.endswith('_id') and isinstance(value, str):
+            return value
+    return section
+
+@st.cache_data(max_entries=64)
+def evidence_pages(path, mtime_ns):
+    """{page: [ids of the items citing it]} from every evidence.page in the extraction"""
+    data, _ = load_extraction(path, mtime_ns)
+    pages = {}
+
+    def walk(node, section):
+        if isinstance(node, dict):
+            evidence = node.get('evidence')
+            if isinstance(evidence, dict) and isinstance(evidence.get('page'), int):
+                pages.setdefault(evidence['page'], []).append(item_label(section, node))
+            for key, value in node.items():
+                if key != 'evidence':
+                    walk(value, key if isinstance(value, list) else section)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value, section)
+
+    walk(data, 'extraction')
+    return dict(sorted(pages.items()))
+# ----------------------
+
+conn = get_db()
 c = conn.cursor()
 
 # Sidebar: Filter by status
 status_filter = st.sidebar.selectbox("Status", ["needs_review", "validated_ok", "approved", "extracted_raw"])
 
 # --- Notification Logic ---
-# Initialize known docs in session state if not present
-if 'known_docs' not in st.session_state:
-    st.session_state['known_docs'] = set()
+# Only a cursor into doc_events is kept per session, so a check costs the
+# number of new events rather than the size of any status list
+if 'event_cursor' not in st.session_state:
+    # Start at the end of the feed: no toasts for docs that were already there
+    st.session_state['event_cursor'] = latest_event_seq(c)
+
+def watch_events():
+    # MAX(seq) is a single lookup on the primary key
+    if latest_event_seq(get_db().cursor()) > st.session_state['event_cursor']:
+        st.rerun()
 
 # Refresh button to manually trigger a check
 if st.sidebar.button("🔄 Check for Updates"):
     st.rerun()
 
+ready, failed = set(), set()
+events = fetch_events(c, st.session_state['event_cursor'])
+while events:
+    st.session_state['event_cursor'] = events[-1][0]
+    for _, doc_id, _, new_status, _ in events:
+        if new_status in READY_STATUSES:
+            ready.add(doc_id)
+        elif new_status == 'failed':
+            failed.add(doc_id)
+    events = fetch_events(c, st.session_state['event_cursor'])
+if len(ready) == 1:
+    st.toast(f"📄 New document ready: {next(iter(ready))}", icon="✅")
+elif ready:
+    st.toast(f"✅ {len(ready)} new documents ready for review!", icon="🎉")
+if failed:
+    st.toast(f"{len(failed)} document(s) failed processing", icon="⚠️")
+
+# After the cursor has caught up, so a full run never re-triggers itself
+if st.sidebar.toggle("Auto-refresh", value=True, help=f"Check for status changes every {EVENT_POLL_SECONDS}s"):
+    st.fragment(watch_events, run_every=EVENT_POLL_SECONDS)()
+# --------------------------
+
+# --- Corpus search ---
+search_query = st.sidebar.text_input("🔎 Search corpus", placeholder='e.g. TM52')
+if search_query:
+    hits = search(search_query, limit=100)
+    st.sidebar.caption(f"{len(hits)} matching pages")
+    if hits:
+        st.sidebar.dataframe(
+            pd.DataFrame(hits, columns=['doc_id', 'page', 'score']),
+            hide_index=True
+        )
+# ---------------------
+
 # List docs
 c.execute("SELECT doc_id, status FROM docs WHERE status = ?", (status_filter,))
 docs = c.fetchall()
 
-# Check for new documents (only if looking at extracted_raw or other relevant statuses)
-current_doc_ids = {doc[0] for doc in docs}
-new_docs = current_doc_ids - st.session_state['known_docs']
-
-if new_docs:
-    # If this is the very first run (known_docs empty), just load them without notification
-    # logic to avoid spamming on startup, OR just notify. 
-    # Let's notify only if we already knew some docs, or just simple toast for "Ready"
-    if st.session_state['known_docs']:
-        count = len(new_docs)
-        if count == 1:
-            st.toast(f"📄 New document ready: {list(new_docs)[0]}", icon="✅")
-        else:
-            st.toast(f"✅ {count} new documents ready for review!", icon="🎉")
-    
-    # Update known state
-    st.session_state['known_docs'].update(current_doc_ids)
-# --------------------------
-
 if not docs:
     st.sidebar.warning("No docs found for this status.")
     doc_id = None
@@ -60,42 +187,68 @@ if doc_id:
     
     with col1:
         st.header("PDF / Text")
-        # Load pages text
-        files = sorted(glob.glob(os.path.join('pages_text', doc_id, 'page_*.txt')))
-        text_content = ""
-        for f in files:
-            with open(f, 'r', encoding='utf-8') as tf:
-                text_content += f"--- {os.path.basename(f)} ---\n" + tf.read() + "\n"
-        
-        st.text_area("Full Text Content", text_content, height=800)
-        # Ideally embed PDF here, but for MVP local text is easier
+        current_path = extraction_path(doc_id)
+        mtime_ns = os.stat(current_path).st_mtime_ns if current_path else None
+        cited = evidence_pages(current_path, mtime_ns) if current_path else {}
+
+        version = store_version(doc_id)
+        page_numbers = store_pages(doc_id, version) if version else []
+        layout_ver = layout_version(doc_id)
+        layouts = layout_summary(doc_id, layout_ver) if layout_ver else {}
+        table_like = {p for p, (score, *_) in layouts.items() if score >= TABLE_SCORE_THRESHOLD}
+
+        if not page_numbers:
+            st.warning("No page text for this document.")
+        else:
+            # One page at a time; a new doc opens at its first cited page
+            if st.session_state.get('page_doc') != doc_id or st.session_state.get('page') not in page_numbers:
+                first_cited = next((p for p in cited if p in page_numbers), None)
+                st.session_state['page'] = first_cited if first_cited is not None else page_numbers[0]
+                st.session_state['page_doc'] = doc_id
+
+            def step(delta):
+                i = page_numbers.index(st.session_state['page']) + delta
+                st.session_state['page'] = page_numbers[max(0, min(i, len(page_numbers) - 1))]
+
+            def jump(page):
+                st.session_state['page'] = page
+
+            nav_prev, nav_page, nav_next = st.columns([1, 3, 1])
+            nav_prev.button("◀ Prev", on_click=step, args=(-1,), width="stretch")
+            nav_page.selectbox("Page", page_numbers, key='page',
+                               format_func=lambda p: f"Page {p} / {page_numbers[-1]}" + (" 📌" if p in cited else "")
+                               + (" 📊" if p in table_like else ""),
+                               label_visibility="collapsed")
+            nav_next.button("Next ▶", on_click=step, args=(1,), width="stretch")
+
+            if cited:
+                st.caption("Jump to cited page")
+                jump_cols = st.columns(min(len(cited), 8))
+                for i, page in enumerate(cited):
+                    jump_cols[i % len(jump_cols)].button(
+                        f"p. {page}", key=f"jump_{page}", on_click=jump, args=(page,),
+                        disabled=page not in page_numbers, help=", ".join(cited[page])
+                    )
+
+            page = st.session_state['page']
+            if page in cited:
+                st.info(f"Cited on this page: {', '.join(cited[page])}")
+            if page in layouts:
+                score, words, lines, rects = layouts[page]
+                st.caption(f"{words} words · {lines} lines · {rects} rects · table score {score:.2f}"
+                           + (" (likely table)" if page in table_like else ""))
+            st.text_area(f"Page {page}", page_text(doc_id, version, page), height=700)
 
     with col2:
         st.header("Extraction Data")
         
-        # Load validation or raw
-        # Try approved -> valid -> raw
-        paths = [
-            os.path.join('extractions_approved', f'{doc_id}.json'),
-            os.path.join('extractions_valid', f'{doc_id}.json'),
-            os.path.join('extractions_raw', f'{doc_id}.json')
-        ]
-        
-        current_path = None
-        data = {}
-        for p in paths:
-            if os.path.exists(p):
-                current_path = p
-                with open(p, 'r') as f:
-                    data = json.load(f)
-                break
-        
         if current_path:
             st.info(f"Loaded from: {current_path}")
+            _, data_text = load_extraction(current_path, mtime_ns)
             
             # Form
             with st.form("review_form"):
-                edited_data = st.text_area("JSON Data", json.dumps(data, indent=2), height=600)
+                edited_data = st.text_area("JSON Data", data_text, height=600)
                 
                 submitted = st.form_submit_button("Approve")
                 rejected = st.form_submit_button("Reject")
@@ -122,4 +275,3 @@ if doc_id:
         else:
             st.warning("No extraction file found.")
 
-conn.close()
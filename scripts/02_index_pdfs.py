@@ -1,54 +1,208 @@
 import os
+import json
+import mmap
 import hashlib
+import argparse
 import pandas as pd
 import yaml
+from concurrent.futures import ThreadPoolExecutor
+from telemetry import stage_timer
+
+INDEX_PATH = 'pdf_index.csv'
+CACHE_PATH = 'pdf_index_cache.json'
+HASH_CHUNK_SIZE = 1024 * 1024
+INDEX_COLUMNS = ['doc_id', 'pdf_path', 'file_size', 'sha256', 'extracted_title', 'match_confidence', 'needs_manual_match']
 
 def calculate_sha256(filepath):
     sha256_hash = hashlib.sha256()
     with open(filepath, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
+        if os.fstat(f.fileno()).st_size == 0:
+            return sha256_hash.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            for start in range(0, len(view), HASH_CHUNK_SIZE):
+                sha256_hash.update(view[start:start + HASH_CHUNK_SIZE])
     return sha256_hash.hexdigest()
 
-def index_pdfs():
+def hash_pdf(path):
+    """calculate_sha256 with an 'index' metrics row (doc_id is the hash)"""
+    with stage_timer('index') as metrics:
+        doc_hash = calculate_sha256(path)
+        metrics.doc_id = doc_hash
+        metrics.add(bytes_read=os.path.getsize(path))
+    return doc_hash
+
+def load_hash_cache():
+    """(path, size, mtime) -> sha256 cache persisted between runs"""
+    if not os.path.exists(CACHE_PATH):
+        return {}
+    with open(CACHE_PATH, 'r') as f:
+        return json.load(f)
+
+def save_hash_cache(cache):
+    tmp_path = CACHE_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, CACHE_PATH)
+
+def scan_pdf_dir(pdf_dir):
+    stats = {}
+    for entry in os.scandir(pdf_dir):
+        if entry.is_file() and entry.name.lower().endswith('.pdf'):
+            st = entry.stat()
+            stats[os.path.join(pdf_dir, entry.name)] = (st.st_size, st.st_mtime_ns)
+    return stats
+
+def hash_pdfs(stats, cache, workers):
+    """Returns {path: sha256}, hashing only files whose size or mtime changed"""
+    hashes = {}
+    to_hash = []
+    for path, (size, mtime_ns) in stats.items():
+        entry = cache.get(path)
+        if entry and entry['size'] == size and entry['mtime_ns'] == mtime_ns:
+            hashes[path] = entry['sha256']
+        else:
+            to_hash.append(path)
+
+    if to_hash:
+        print(f"Hashing {len(to_hash)} new or modified PDFs ({len(hashes)} cached)...")
+        # hashlib releases the GIL on large buffers, so threads hash in parallel
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for path, digest in zip(to_hash, pool.map(hash_pdf, to_hash)):
+                hashes[path] = digest
+    return hashes
+
+def new_index_row(path, doc_hash, file_size):
+    return {
+        # For now, we use hash as doc_id
+        'doc_id': doc_hash,
+        'pdf_path': path,
+        'file_size': file_size,
+        'sha256': doc_hash,
+        # Placeholder for extracted title (would use PDF library)
+        'extracted_title': "",
+        'match_confidence': 0.0,
+        'needs_manual_match': True
+    }
+
+def merge_index(old_rows, hashes, stats):
+    """Updates index rows in place, keeping manual columns of unchanged docs"""
+    kept = []
+    dropped = []
+    for row in old_rows:
+        path = row['pdf_path']
+        if hashes.get(path) == row['sha256']:
+            kept.append(row)
+        else:
+            dropped.append(row)
+
+    kept_paths = {row['pdf_path'] for row in kept}
+    dropped_paths = {row['pdf_path'] for row in dropped}
+    # A dropped row whose path is gone but whose bytes reappear elsewhere was moved
+    movable = {row['sha256']: row for row in dropped if row['pdf_path'] not in hashes}
+
+    report = {'added': [], 'removed': [], 'moved': [], 'changed': []}
+    rows = list(kept)
+    for path in sorted(hashes):
+        if path in kept_paths:
+            continue
+        doc_hash = hashes[path]
+        previous = movable.pop(doc_hash, None)
+        if previous is not None:
+            row = dict(previous, pdf_path=path)
+            report['moved'].append((previous['pdf_path'], path))
+        else:
+            row = new_index_row(path, doc_hash, stats[path][0])
+            report['changed' if path in dropped_paths else 'added'].append(path)
+        rows.append(row)
+
+    report['removed'] = [row['pdf_path'] for row in movable.values()]
+    return rows, report
+
+def load_index_rows():
+    if not os.path.exists(INDEX_PATH):
+        return []
+    return pd.read_csv(INDEX_PATH, dtype={'doc_id': str, 'sha256': str}).to_dict('records')
+
+def write_index(rows):
+    columns = INDEX_COLUMNS + [c for c in (rows[0] if rows else {}) if c not in INDEX_COLUMNS]
+    tmp_path = INDEX_PATH + '.tmp'
+    pd.DataFrame(rows, columns=columns).to_csv(tmp_path, index=False)
+    os.replace(tmp_path, INDEX_PATH)
+
+def index_pdf(path):
+    """Indexes one PDF without rescanning pdf_dir; returns (doc_id, change)
+
+    change is 'added', 'changed', 'moved' or None when the file was already
+    indexed with the same content.
+    """
+    st = os.stat(path)
+    cache = load_hash_cache()
+    entry = cache.get(path)
+    if entry and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+        doc_hash = entry['sha256']
+    else:
+        doc_hash = hash_pdf(path)
+        cache[path] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': doc_hash}
+        save_hash_cache(cache)
+
+    old_rows = load_index_rows()
+    # Only this path and rows that may have moved to it are re-examined;
+    # every other row is passed through with its stored hash
+    hashes = {row['pdf_path']: row['sha256'] for row in old_rows
+              if row['pdf_path'] != path and os.path.exists(row['pdf_path'])}
+    hashes[path] = doc_hash
+    stats = {path: (st.st_size, st.st_mtime_ns)}
+    rows, report = merge_index(old_rows, hashes, stats)
+    write_index(rows)
+
+    if report['added']:
+        change = 'added'
+    elif report['changed']:
+        change = 'changed'
+    elif report['moved']:
+        change = 'moved'
+    else:
+        change = None
+    return doc_hash, change
+
+def index_pdfs(workers=None):
     with open('run_config.yaml', 'r') as f:
         config = yaml.safe_load(f)
-    
+
     pdf_dir = config.get('pdf_dir', 'pdfs')
-    
+    if workers is None:
+        workers = config.get('indexing', {}).get('hash_workers', 4)
+
     if not os.path.exists(pdf_dir):
         print(f"Directory {pdf_dir} does not exist.")
         return
 
-    index_data = []
-    
-    for filename in os.listdir(pdf_dir):
-        if filename.lower().endswith('.pdf'):
-            path = os.path.join(pdf_dir, filename)
-            doc_hash = calculate_sha256(path)
-            
-            # For now, we use hash as doc_id
-            doc_id = doc_hash
-            
-            # Placeholder for extracted title (would use PDF library)
-            extracted_title = "" 
-            
-            # Simple filename matching (fallback)
-            # In a real scenario we would fuzzy match with manifest title
-            
-            index_data.append({
-                'doc_id': doc_id,
-                'pdf_path': path,
-                'file_size': os.path.getsize(path),
-                'sha256': doc_hash,
-                'extracted_title': extracted_title,
-                'match_confidence': 0.0,
-                'needs_manual_match': True
-            })
-    
-    df = pd.DataFrame(index_data)
-    df.to_csv('pdf_index.csv', index=False)
-    print(f"Indexed {len(df)} PDFs to pdf_index.csv")
+    stats = scan_pdf_dir(pdf_dir)
+    hashes = hash_pdfs(stats, load_hash_cache(), workers)
+    save_hash_cache({
+        path: {'size': size, 'mtime_ns': mtime_ns, 'sha256': hashes[path]}
+        for path, (size, mtime_ns) in stats.items()
+    })
+
+    rows, report = merge_index(load_index_rows(), hashes, stats)
+    write_index(rows)
+
+    for path in report['added']:
+        print(f"  + {path}")
+    for path in report['changed']:
+        print(f"  ~ {path} (content changed, new doc_id)")
+    for old_path, new_path in report['moved']:
+        print(f"  > {old_path} -> {new_path}")
+    for path in report['removed']:
+        print(f"  - {path}")
+    print(f"Indexed {len(rows)} PDFs to {INDEX_PATH} "
+          f"({len(report['added'])} added, {len(report['changed'])} changed, "
+          f"{len(report['moved'])} moved, {len(report['removed'])} removed)")
+    return report
 
 if __name__ == "__main__":
-    index_pdfs()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, help="Hashing threads (overrides indexing.hash_workers)")
+    args = parser.parse_args()
+
+    index_pdfs(workers=args.workers)
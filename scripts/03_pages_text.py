@@ -1,61 +1,255 @@
 import os
 import json
+import random
+import difflib
+import argparse
 import pandas as pd
-import pdfplumber
 import yaml
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import page_store
+import page_layout
+import search_index
+import text_backends
+from telemetry import stage_timer
 
-def extract_pages_text():
+PAGES_TEXT_DIR = page_store.PAGES_TEXT_DIR
+
+def load_config():
     with open('run_config.yaml', 'r') as f:
-        config = yaml.safe_load(f)
-    
+        return yaml.safe_load(f)
+
+def count_pages(pdf_path):
+    return text_backends.page_count(pdf_path)
+
+def backend_settings(backend=None):
+    """(backend, plumber_table_score) from paging config; backend overrides the configured one"""
+    paging_config = load_config().get('paging', {})
+    return backend or paging_config.get('text_backend', 'tiered'), paging_config.get('plumber_table_score', 0.4)
+
+def load_done_pages(doc_dir):
+    """Returns the page numbers already checkpointed in the doc's page store"""
+    page_store.migrate_legacy(doc_dir)
+    return set(page_store.read_index(doc_dir))
+
+def extract_page_range(doc_id, pdf_path, page_numbers, backend=None):
+    """Extracts the given pages of one PDF, checkpointing each finished page.
+
+    Pages go through text_backends (tiered by default: pdfium, pdfplumber
+    for table-like or broken pages). The words and table signals parsed
+    along with the text go to the layout cache (page_layout.py), so nothing
+    later reopens the PDF.
+    """
+    backend, table_threshold = backend_settings(backend)
+    doc_dir = os.path.join(PAGES_TEXT_DIR, doc_id)
+    # Chunks of one doc are separate rows; the report sums them per doc
+    with stage_timer('pages', doc_id) as metrics, text_backends.PdfSource(pdf_path) as source:
+        metrics.add(bytes_read=os.path.getsize(pdf_path))
+        for i in page_numbers:
+            text, layout = text_backends.extract_page(source, i, backend, table_threshold)
+            # Before the text: the text index is the page's checkpoint
+            page_layout.append_layout(doc_dir, layout)
+            page_store.append_page(doc_dir, i, text)
+            metrics.add(pages=1)
+    return len(page_numbers)
+
+def plan_page_chunks(doc_id, num_pages, pages_per_task):
+    """Splits the pages not yet checkpointed into chunks of at most pages_per_task"""
+    done = load_done_pages(os.path.join(PAGES_TEXT_DIR, doc_id))
+    todo = [i for i in range(num_pages) if i not in done]
+    return [todo[k:k + pages_per_task] for k in range(0, len(todo), pages_per_task)]
+
+def finalize_doc(doc_id, num_pages, backend=None):
+    doc_dir = os.path.join(PAGES_TEXT_DIR, doc_id)
+    # Per page from the layout cache, so pages done by an earlier,
+    # interrupted run are reported as they were actually extracted
+    layouts = page_layout.load_layout(doc_id)
+    meta = {
+        'num_pages': num_pages,
+        'tool': backend_settings(backend)[0],
+        'tool_versions': text_backends.tool_versions(),
+        'page_backends': {str(page): layouts[page].get('backend', 'pdfplumber') for page in sorted(layouts)},
+        'pdfplumber_reasons': {str(page): layouts[page]['reason'] for page in sorted(layouts) if 'reason' in layouts[page]},
+        'store': page_store.STORE_FORMAT,
+        'layout': page_layout.LAYOUT_FILE,
+        'timestamp': time.time()
+    }
+    with open(os.path.join(doc_dir, 'pages_meta.json'), 'w') as f_meta:
+        json.dump(meta, f_meta, indent=2)
+
+def extract_doc_pages(doc_id, pdf_path, backend=None):
+    """Pages one doc in this process, resuming from its checkpointed pages"""
+    os.makedirs(os.path.join(PAGES_TEXT_DIR, doc_id), exist_ok=True)
+    num_pages = count_pages(pdf_path)
+    for chunk in plan_page_chunks(doc_id, num_pages, max(num_pages, 1)):
+        extract_page_range(doc_id, pdf_path, chunk, backend)
+    finalize_doc(doc_id, num_pages, backend)
+    return num_pages
+
+def extract_sequential(pending, backend=None):
+    for doc_id, pdf_path in pending:
+        print(f"Extracting {pdf_path}...")
+        try:
+            extract_doc_pages(doc_id, pdf_path, backend)
+        except Exception as e:
+            print(f"Error extraction {doc_id}: {e}")
+
+def extract_parallel(pending, workers, pages_per_task, backend=None):
+    """Spreads docs, and the pages of long docs, across a process pool"""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        count_futures = {pool.submit(count_pages, pdf_path): (doc_id, pdf_path) for doc_id, pdf_path in pending}
+        chunk_futures = {}
+        num_pages_by_doc = {}
+        outstanding = {}
+        failed = set()
+
+        for future in as_completed(count_futures):
+            doc_id, pdf_path = count_futures[future]
+            try:
+                num_pages = future.result()
+            except Exception as e:
+                print(f"Error extraction {doc_id}: {e}")
+                continue
+
+            chunks = plan_page_chunks(doc_id, num_pages, pages_per_task)
+            num_pages_by_doc[doc_id] = num_pages
+            outstanding[doc_id] = len(chunks)
+            if not chunks:
+                finalize_doc(doc_id, num_pages, backend)
+                continue
+
+            print(f"Extracting {pdf_path} ({num_pages} pages, {len(chunks)} tasks)...")
+            for chunk in chunks:
+                chunk_futures[pool.submit(extract_page_range, doc_id, pdf_path, chunk, backend)] = doc_id
+
+        for future in as_completed(chunk_futures):
+            doc_id = chunk_futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error extraction {doc_id}: {e}")
+                failed.add(doc_id)
+
+            outstanding[doc_id] -= 1
+            if outstanding[doc_id] == 0 and doc_id not in failed:
+                finalize_doc(doc_id, num_pages_by_doc[doc_id], backend)
+                print(f"  Done {doc_id}")
+
+def extract_pages_text(workers=None, backend=None):
+    config = load_config()
+
     # Load index to get doc_ids
     if not os.path.exists('pdf_index.csv'):
         print("pdf_index.csv not found. Run 02_index_pdfs.py first.")
         return
-        
+
     df = pd.read_csv('pdf_index.csv')
-    
-    pages_text_dir = 'pages_text'
-    os.makedirs(pages_text_dir, exist_ok=True)
-    
+
+    paging_config = config.get('paging', {})
+    if workers is None:
+        workers = paging_config.get('workers', 1)
+    pages_per_task = paging_config.get('pages_per_task', 25)
+
+    os.makedirs(PAGES_TEXT_DIR, exist_ok=True)
+
+    pending = []
     for _, row in df.iterrows():
         doc_id = row['doc_id']
         pdf_path = row['pdf_path']
-        
-        doc_dir = os.path.join(pages_text_dir, doc_id)
+
+        doc_dir = os.path.join(PAGES_TEXT_DIR, doc_id)
         os.makedirs(doc_dir, exist_ok=True)
-        
+
         # Check if already processed (simple idempotency)
         if os.path.exists(os.path.join(doc_dir, 'pages_meta.json')):
+            if page_store.migrate_legacy(doc_dir):
+                print(f"Migrated {doc_id} to packed page store")
             print(f"Skipping {doc_id} (already extracted)")
             continue
-            
-        print(f"Extracting {pdf_path}...")
-        
+
+        pending.append((doc_id, pdf_path))
+
+    if not pending:
+        return
+
+    if workers > 1:
+        extract_parallel(pending, workers, pages_per_task, backend)
+    else:
+        extract_sequential(pending, backend)
+
+    updated = search_index.update_index([doc_id for doc_id, _ in pending])
+    print(f"Search index updated for {updated} docs.")
+
+def normalize_text(text):
+    return " ".join(text.split())
+
+def compare_backends(sample=50, seed=0, show=10):
+    """Runs pdfium and pdfplumber on a random sample of indexed pages and reports where they differ"""
+    if not os.path.exists('pdf_index.csv'):
+        print("pdf_index.csv not found. Run 02_index_pdfs.py first.")
+        return
+    _, table_threshold = backend_settings()
+    df = pd.read_csv('pdf_index.csv')
+    all_pages = []
+    for pdf_path in df['pdf_path']:
         try:
-            with pdfplumber.open(pdf_path) as pdf:
-                num_pages = len(pdf.pages)
-                
-                for i, page in enumerate(pdf.pages):
-                    text = page.extract_text() or ""
-                    
-                    # Save page text
-                    page_filename = f"page_{i:03d}.txt"
-                    with open(os.path.join(doc_dir, page_filename), 'w', encoding='utf-8') as f_text:
-                        f_text.write(text)
-                
-                # Save metadata
-                meta = {
-                    'num_pages': num_pages,
-                    'tool': 'pdfplumber',
-                    'timestamp': time.time()
-                }
-                with open(os.path.join(doc_dir, 'pages_meta.json'), 'w') as f_meta:
-                    json.dump(meta, f_meta, indent=2)
-                    
+            all_pages += [(pdf_path, i) for i in range(count_pages(pdf_path))]
         except Exception as e:
-            print(f"Error extraction {doc_id}: {e}")
+            print(f"Skipping {pdf_path}: {e}")
+    rng = random.Random(seed)
+    pages = sorted(rng.sample(all_pages, min(sample, len(all_pages))))
+    print(f"Comparing backends on {len(pages)} of {len(all_pages)} pages...")
+
+    rows = []
+    for pdf_path, i in pages:
+        with text_backends.PdfSource(pdf_path) as source:
+            started = time.perf_counter()
+            fast_text, fast_layout, text_objects = text_backends.pdfium_page(source.pdfium(), i)
+            fast_s = time.perf_counter() - started
+            started = time.perf_counter()
+            plumber_text, plumber_layout = text_backends.plumber_page(source.plumber(), i)
+            plumber_s = time.perf_counter() - started
+        reason = text_backends.broken_reason(fast_text, fast_layout['words'], text_objects)
+        if reason is None and fast_layout['table_score'] >= table_threshold:
+            reason = 'table'
+        fast_norm, plumber_norm = normalize_text(fast_text), normalize_text(plumber_text)
+        rows.append({
+            'pdf': os.path.basename(pdf_path), 'page': i,
+            'similarity': difflib.SequenceMatcher(None, fast_norm, plumber_norm, autojunk=False).ratio(),
+            'chars_pdfium': len(fast_norm), 'chars_pdfplumber': len(plumber_norm),
+            'words_pdfium': len(fast_layout['words']), 'words_pdfplumber': len(plumber_layout['words']),
+            'table_pdfium': fast_layout['table_score'], 'table_pdfplumber': plumber_layout['table_score'],
+            'tiered': f"pdfplumber ({reason})" if reason else 'pdfium',
+            'pdfium_s': fast_s, 'pdfplumber_s': plumber_s,
+        })
+    if not rows:
+        print("No pages to compare.")
+        return
+    result = pd.DataFrame(rows)
+    routed = result['tiered'] != 'pdfium'
+    tiered_s = result['pdfium_s'].sum() + result.loc[routed, 'pdfplumber_s'].sum()
+    print(f"pdfium:     {result['pdfium_s'].mean() * 1000:.1f} ms/page")
+    print(f"pdfplumber: {result['pdfplumber_s'].mean() * 1000:.1f} ms/page")
+    print(f"tiered:     {tiered_s / len(result) * 1000:.1f} ms/page ({int(routed.sum())} of {len(result)} pages sent to pdfplumber)")
+    print(f"Text similarity (whitespace-normalized): mean {result['similarity'].mean():.3f}, "
+          f"min {result['similarity'].min():.3f}, {int((result['similarity'] < 0.95).sum())} pages below 0.95")
+    print(f"\nLeast similar {min(show, len(result))} pages:")
+    columns = ['pdf', 'page', 'similarity', 'chars_pdfium', 'chars_pdfplumber', 'words_pdfium', 'words_pdfplumber',
+               'table_pdfium', 'table_pdfplumber', 'tiered']
+    print(result.nsmallest(show, 'similarity')[columns].to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+    return result
 
 if __name__ == "__main__":
-    extract_pages_text()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, help="Process pool size (overrides paging.workers)")
+    parser.add_argument('--backend', choices=text_backends.BACKENDS, help="Overrides paging.text_backend")
+    parser.add_argument('--compare-backends', action='store_true',
+                        help="Compare pdfium and pdfplumber output on a sample of pages instead of extracting")
+    parser.add_argument('--sample', type=int, default=50, help="Pages to compare (--compare-backends)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.compare_backends:
+        compare_backends(sample=args.sample, seed=args.seed)
+    else:
+        extract_pages_text(workers=args.workers, backend=args.backend)
@@ -1,72 +1,143 @@
 import os
 import re
+import json
 import yaml
 import sqlite3
-import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from db import get_connection, init_db, sync_from_index
+from page_store import PageStore
+from telemetry import stage_timer
 
 # Regex patterns
 INTERVENTION_REGEX = r"retrofit|renovat|refurbish|adaptation|passive cooling|shading|cool roof|PCM|green roof|insulation|natural ventilation"
 OUTCOME_REGEX = r"overheating|discomfort hours|degree-hours|operative temperature|indoor temperature|TM52|ASHRAE|EN 16798"
 
-def load_doc_text(doc_id):
-    files = glob.glob(os.path.join('pages_text', doc_id, 'page_*.txt'))
-    full_text = ""
-    for f in files:
-        with open(f, 'r', encoding='utf-8') as tf:
-            full_text += tf.read() + "\n"
-    return full_text
+# Compiled once per process (each pool worker compiles on import)
+SIGNAL_PATTERNS = {
+    'intervention': re.compile(INTERVENTION_REGEX, re.IGNORECASE),
+    'outcome': re.compile(OUTCOME_REGEX, re.IGNORECASE),
+}
 
-def apply_heuristic(text):
-    has_intervention = re.search(INTERVENTION_REGEX, text, re.IGNORECASE)
-    has_outcome = re.search(OUTCOME_REGEX, text, re.IGNORECASE)
-    
-    if has_intervention and has_outcome:
+TRIAGE_REPORTS_DIR = 'triage_reports'
+
+def scan_doc(doc_id):
+    """Streams a doc page by page until every signal class has matched.
+
+    Returns (signals, pages_scanned) where signals maps each matched class
+    to the first page and term that matched, or None if the doc has no text.
+    """
+    signals = {}
+    pages_scanned = 0
+    with stage_timer('triage', doc_id) as metrics, PageStore(doc_id) as store:
+        pages = store.pages()
+        if not pages:
+            return None, 0
+        for page in pages:
+            text = store.read_page(page)
+            pages_scanned += 1
+            metrics.add(pages=1, bytes_read=store.index[page][1])
+            for name, pattern in SIGNAL_PATTERNS.items():
+                if name in signals:
+                    continue
+                match = pattern.search(text)
+                if match:
+                    signals[name] = {'page': page, 'term': match.group(0)}
+            if len(signals) == len(SIGNAL_PATTERNS):
+                break
+    return signals, pages_scanned
+
+def label_from_signals(signals):
+    if 'intervention' in signals and 'outcome' in signals:
         return 'extractable'
-    elif has_intervention:
+    elif 'intervention' in signals:
         return 'maybe'
     else:
         return 'no-data'
 
-def run_triage():
+def apply_heuristic(text):
+    signals = {name: True for name, pattern in SIGNAL_PATTERNS.items() if pattern.search(text)}
+    return label_from_signals(signals)
+
+def save_triage_report(doc_id, label, signals, pages_scanned):
+    os.makedirs(TRIAGE_REPORTS_DIR, exist_ok=True)
+    with open(os.path.join(TRIAGE_REPORTS_DIR, f'{doc_id}.json'), 'w') as f:
+        json.dump({
+            'doc_id': doc_id,
+            'label': label,
+            'signals': signals,
+            'pages_scanned': pages_scanned
+        }, f, indent=2)
+
+def status_for_label(label):
+    # Mapping label to status
+    return f"triaged_{label.replace('-', '_')}"
+
+def triage_doc(doc_id):
+    """Triages one doc in-process; returns (label, new_status) or None without text"""
+    signals, pages_scanned = scan_doc(doc_id)
+    if signals is None:
+        return None
+    label = label_from_signals(signals)
+    save_triage_report(doc_id, label, signals, pages_scanned)
+    return label, status_for_label(label)
+
+def run_triage(workers=None):
     # Ensure DB is ready
     if not os.path.exists('state.sqlite'):
         init_db()
         sync_from_index()
-    
+
+    if workers is None:
+        with open('run_config.yaml', 'r') as f:
+            config = yaml.safe_load(f)
+        workers = config.get('triage', {}).get('workers', 1)
+
     conn = get_connection()
     c = conn.cursor()
-    
+
     # Select docs that need triage
     # pending, indexed, or paged (assuming paged is done if text exists)
     # We'll just look for 'indexed' or 'paged' or NULL status if specific flow
     # But for now, let's process 'indexed' docs
-    
+
     c.execute("SELECT doc_id, status FROM docs WHERE status IN ('indexed', 'paged')")
     docs = c.fetchall()
-    
+    doc_ids = [doc_id for doc_id, _ in docs]
+
     print(f"Found {len(docs)} docs to triage.")
-    
-    for doc_id, status in docs:
-        text = load_doc_text(doc_id)
-        if not text:
+
+    # Scanning is CPU-bound and runs in the pool; DB writes stay here
+    if workers > 1 and len(doc_ids) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(scan_doc, doc_ids, chunksize=16))
+    else:
+        results = [scan_doc(doc_id) for doc_id in doc_ids]
+
+    for doc_id, (signals, pages_scanned) in zip(doc_ids, results):
+        if signals is None:
             print(f"No text for {doc_id}, skipping.")
             continue
-            
-        label = apply_heuristic(text)
-        print(f"Doc {doc_id[:8]}... -> {label}")
-        
-        # Mapping label to status
-        new_status = f"triaged_{label.replace('-', '_')}"
-        
+
+        label = label_from_signals(signals)
+        matched = ", ".join(f"{name}='{s['term']}'@p{s['page']}" for name, s in signals.items())
+        print(f"Doc {doc_id[:8]}... -> {label} ({matched or 'no signals'}; {pages_scanned} pages scanned)")
+        save_triage_report(doc_id, label, signals, pages_scanned)
+
+        new_status = status_for_label(label)
+
         # If 'maybe', we might want AI. But for MVP step 1, we just label.
         # If AI is enabled and key is present, we would refine 'maybe'.
-        
+
         c.execute("UPDATE docs SET triage_label = ?, status = ? WHERE doc_id = ?",
                   (label, new_status, doc_id))
-        
+
     conn.commit()
     conn.close()
 
 if __name__ == "__main__":
-    run_triage()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, help="Process pool size (overrides triage.workers)")
+    args = parser.parse_args()
+
+    run_triage(workers=args.workers)
@@ -4,14 +4,18 @@ import yaml
 import sqlite3
 import argparse
 import time
+import importlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from retriever import retrieve_pages
+from context_packer import pack_context, save_prompt_stats, estimate_tokens
 from db import get_connection
+from llm_client import GeminiClient, strip_fences
+from llm_cache import ResponseCache
+from repair import repair_doc
+import staged_extract
+from telemetry import stage_timer
 
-# Placeholder for Gemini import
-try:
-    import google.generativeai as genai
-except ImportError:
-    genai = None
+validator = importlib.import_module('06_validate')
 
 def load_config():
     with open('run_config.yaml', 'r') as f:
@@ -105,17 +109,7 @@ def get_mock_extraction(doc_id):
         ]
     }
 
-def run_extract(mock=False):
-    config = load_config()
-    conn = get_connection()
-    c = conn.cursor()
-    
-    # Select docs ready for extraction
-    c.execute("SELECT doc_id FROM docs WHERE status = 'triaged_extractable'")
-    docs = c.fetchall()
-    
-    print(f"Found {len(docs)} extractable docs.")
-    
+def load_api_key():
     api_key = os.environ.get('GEMINI_API_KEY')
     if not api_key:
         try:
@@ -124,33 +118,10 @@ def run_extract(mock=False):
             api_key = os.getenv('GEMINI_API_KEY')
         except:
             pass
-            
-    if not api_key and not mock:
-        print("WARNING: GEMINI_API_KEY not found. Using MOCK mode.")
-        mock = True
-    
-    if not mock and genai:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel(config['extraction']['model'])
-        
-    for (doc_id,) in docs:
-        print(f"Processing {doc_id}...")
-        
-        # 1. Retrieve pages
-        pages = retrieve_pages(doc_id, config)
-        context_text = "\n---\n".join([f"Page {p['page']}:\n{p['text']}" for p in pages])
-        
-        extraction_result = None
-        
-        if mock:
-            print("  [MOCK] Generating extractions...")
-            extraction_result = get_mock_extraction(doc_id)
-            time.sleep(1) # Simulate delay
-        else:
-            print("  [AI] Calling Gemini...")
-            # Construct prompt (Simplified for MVP)
-            schema = load_schema('core_extraction.schema.json')
-            prompt = f"""
+    return api_key
+
+def build_prompt(context_text, schema):
+    return f"""
             You are a scientific data extractor. Extract data from the following text based on the provided JSON schema.
             
             CRITICAL VALIDATION RULES (Preflight):
@@ -168,32 +139,157 @@ def run_extract(mock=False):
             
             Return ONLY valid JSON.
             """
+
+def parse_model_json(text):
+    return json.loads(strip_fences(text))
+
+def mock_server_url(config):
+    server = config.get('mock_server', {})
+    return f"http://{server.get('host', '127.0.0.1')}:{server.get('port', 8765)}"
+
+def is_parseable_json(text):
+    try:
+        parse_model_json(text)
+        return True
+    except ValueError:
+        return False
+
+def extract_doc(doc_id, config, client, schema):
+    """Runs retrieval and one model call for a doc; safe to call from worker threads"""
+    with stage_timer('extract', doc_id) as metrics:
+        # 1. Retrieve pages
+        pages = retrieve_pages(doc_id, config)
+        context_text, stats = pack_context(doc_id, pages, config)
+        # Long docs: skeleton from these pages, then measurements per comparison group
+        staged = client is not None and staged_extract.use_staged(doc_id, config)
+        if staged:
+            prompt = staged_extract.build_skeleton_prompt(context_text, schema)
+        else:
+            prompt = build_prompt(context_text, schema)
+        stats.update(prompt_chars=len(prompt), prompt_tokens_est=estimate_tokens(prompt), staged=staged)
+        save_prompt_stats(doc_id, stats)
+        # Page text handed to the packer (characters, ~bytes)
+        metrics.add(pages=len(stats['pages_packed']), bytes_read=stats['raw_chars'])
+
+        if client is None:
+            print(f"  [MOCK] Generating extractions for {doc_id}...")
+            time.sleep(1) # Simulate delay
+            return get_mock_extraction(doc_id)
+
+        print(f"  [AI] Calling Gemini for {doc_id} ({len(stats['pages_packed'])} pages, ~{stats['prompt_tokens_est']} tokens)...")
+        if not staged:
+            return parse_model_json(client.generate(prompt, schema=schema, accept=is_parseable_json))
+        skeleton = staged_extract.parse_skeleton(client.generate(
+            prompt, schema=staged_extract.skeleton_schema(schema), accept=staged_extract.is_parseable_skeleton))
+        return staged_extract.extract_staged(doc_id, skeleton, pages, config, client)
+
+def extract_and_validate(doc_id, config, client, schema):
+    """extract_doc, validated in memory; a failing result gets targeted repair (repair.py) when a model is available"""
+    result = extract_doc(doc_id, config, client, schema)
+    valid, errors = validator.validate_data(result)
+    if not valid and client is not None and config['extraction'].get('max_retries_fix', 1) > 0:
+        result, valid, errors = repair_doc(doc_id, result, errors, config, client)
+    return result, valid, errors
+
+def save_raw_extraction(doc_id, extraction_result):
+    os.makedirs('extractions_raw', exist_ok=True)
+    raw_path = os.path.join('extractions_raw', f'{doc_id}.json')
+    # Written aside and renamed: extractions_valid/ may hold a hardlink to
+    # the previous version, which must not change under it
+    tmp_path = f"{raw_path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(extraction_result, f, indent=2)
+    os.replace(tmp_path, raw_path)
+
+def run_extract(mock=False, concurrency=None, no_cache=False, validate=False, mock_server=None, staged=None):
+    config = load_config()
+    if staged:
+        config['extraction']['staged'] = staged
+    conn = get_connection()
+    c = conn.cursor()
+    
+    # Select docs ready for extraction
+    c.execute("SELECT doc_id FROM docs WHERE status = 'triaged_extractable'")
+    docs = c.fetchall()
+    
+    print(f"Found {len(docs)} extractable docs.")
+    
+    api_key = load_api_key()
+    if mock_server:
+        # Real client against the local stand-in: no key needed, and no
+        # cache, so every doc makes requests and mock answers never land
+        # next to real ones
+        mock = False
+        api_key = 'mock-server'
+        print(f"Using mock Gemini server at {mock_server}")
+    elif not api_key and not mock:
+        print("WARNING: GEMINI_API_KEY not found. Using MOCK mode.")
+        mock = True
+
+    rate_limits = config.get('rate_limits', {})
+    if concurrency is None:
+        concurrency = rate_limits.get('max_concurrent_requests', 2)
+    # The client caps requests in flight, staged measurement requests included
+    rate_limits = dict(rate_limits, max_concurrent_requests=concurrency)
+
+    client = None
+    cache = None
+    if mock_server:
+        client = GeminiClient(config['extraction']['model'], api_key, rate_limits, api_endpoint=mock_server)
+    elif not mock:
+        cache = ResponseCache.from_config(config, bypass=no_cache)
+        client = GeminiClient(config['extraction']['model'], api_key, rate_limits, cache=cache)
+    schema = load_schema('core_extraction.schema.json')
+
+    # Requests run in worker threads (network-bound); results and DB
+    # updates are handled here, on the thread that owns the connection.
+    # Fused mode validates (and repairs) in the worker thread, right after the response
+    work = extract_and_validate if validate else extract_doc
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {pool.submit(work, doc_id, config, client, schema): doc_id for (doc_id,) in docs}
+        for future in as_completed(futures):
+            doc_id = futures[future]
             try:
-                response = model.generate_content(prompt)
-                # Naive cleanup, ideally use structured output mode if available or robust parser
-                json_str = response.text.strip()
-                if json_str.startswith('```json'):
-                    json_str = json_str[7:-3]
-                extraction_result = json.loads(json_str)
+                result = future.result()
             except Exception as e:
-                print(f"  Error calling AI: {e}")
+                print(f"  Error calling AI for {doc_id}: {e}")
                 continue
+            extraction_result, valid, errors = result if validate else (result, None, None)
+
+            # Save raw result
+            save_raw_extraction(doc_id, extraction_result)
+            new_status = 'extracted_raw'
+            if validate:
+                # Valid copy hardlinked to the raw file
+                new_status = validator.store_validation_result(doc_id, valid, errors)
+
+            # Update DB
+            c.execute("UPDATE docs SET status = ? WHERE doc_id = ?", (new_status, doc_id))
+            conn.commit()
+            print(f"  Saved to extractions_raw/{doc_id}.json ({new_status})")
         
-        # Save raw result
-        os.makedirs('extractions_raw', exist_ok=True)
-        with open(os.path.join('extractions_raw', f'{doc_id}.json'), 'w') as f:
-            json.dump(extraction_result, f, indent=2)
-            
-        # Update DB
-        c.execute("UPDATE docs SET status = 'extracted_raw' WHERE doc_id = ?", (doc_id,))
-        print(f"  Saved to extractions_raw/{doc_id}.json")
-        
-    conn.commit()
     conn.close()
 
+    if cache:
+        evicted = cache.evict()
+        if evicted:
+            print(f"Evicted {evicted} entries from {cache.cache_dir}/")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--mock', action='store_true')
+    parser.add_argument('--concurrency', type=int, help="Requests in flight (overrides rate_limits.max_concurrent_requests)")
+    parser.add_argument('--no-cache', action='store_true', help="Skip cached responses (fresh responses still refresh the cache)")
+    parser.add_argument('--validate', action='store_true',
+                        help="Validate (and repair, see repair.py) each response as it arrives (no separate 06_validate.py pass)")
+    parser.add_argument('--mock-server', nargs='?', const='', metavar='URL',
+                        help="Send requests to scripts/mock_gemini_server.py (default URL from mock_server in run_config.yaml)")
+    parser.add_argument('--staged', choices=staged_extract.STAGED_MODES,
+                        help="Skeleton first, then measurements per comparison group in parallel (overrides extraction.staged)")
     args = parser.parse_args()
-    
-    run_extract(mock=args.mock)
+
+    mock_server = None
+    if args.mock_server is not None:
+        mock_server = args.mock_server or mock_server_url(load_config())
+    run_extract(mock=args.mock, concurrency=args.concurrency, no_cache=args.no_cache, validate=args.validate,
+                mock_server=mock_server, staged=args.staged)
@@ -1,138 +1,238 @@
 import os
 import json
+import yaml
+import shutil
+import argparse
 import jsonschema
+from concurrent.futures import ProcessPoolExecutor
+from referencing import Registry, Resource
+from referencing.jsonschema import DRAFT202012
 from db import get_connection
+from telemetry import stage_timer
 
 def load_schema(name):
     with open(os.path.join('schemas', name), 'r') as f:
         return json.load(f)
 
-def check_structural_integrity(data):
+ENTITIES = ["units", "scenarios", "conditions", "comparisons", "measurements"]
+SUPPORTED_VERSIONS = ["1.0.0", "1.1.0"]
+
+# Compiled once per process (pool workers compile on first use)
+_validators = {}
+
+def get_validator(name='core_extraction.schema.json'):
+    """Cached validator for a schema in schemas/, resolving $refs between them"""
+    if name not in _validators:
+        schemas = {}
+        for filename in sorted(os.listdir('schemas')):
+            if filename.endswith('.schema.json'):
+                schema = load_schema(filename)
+                schemas[schema.get('$id', filename)] = schema
+        registry = Registry().with_resources(
+            (uri, Resource.from_contents(schema, default_specification=DRAFT202012))
+            for uri, schema in schemas.items()
+        )
+        schema = schemas[name]
+        validator_cls = jsonschema.validators.validator_for(schema)
+        validator_cls.check_schema(schema)
+        _validators[name] = validator_cls(schema, registry=registry)
+    return _validators[name]
+
+def format_path(path):
+    """['measurements', 0, 'unit'] -> measurements[0].unit"""
+    out = ""
+    for part in path:
+        if isinstance(part, int):
+            out += f"[{part}]"
+        else:
+            out += f".{part}" if out else str(part)
+    return out or "$"
+
+def schema_errors(data):
     errors = []
-    
+    for error in get_validator().iter_errors(data):
+        for e in closest_branch_errors(error):
+            message = e.message if len(e.message) <= 200 else e.message[:197] + "..."
+            errors.append(f"BLOCKER | SCHEMA_{e.validator.upper()} | {format_path(e.absolute_path)} | {message}")
+    return errors
+
+def closest_branch_errors(error):
+    """For oneOf/anyOf (Outcome A vs B), the errors of the branch that failed least"""
+    if not error.context:
+        return [error]
+    branches = {}
+    for sub_error in error.context:
+        branches.setdefault(sub_error.schema_path[0], []).append(sub_error)
+    best = min(branches.values(), key=len)
+    return [e for sub_error in best for e in closest_branch_errors(sub_error)]
+
+def check_integrity(data):
+    """Version, uniqueness, referential and evidence checks in one pass.
+
+    Entities are visited in dependency order, so every ID a reference can
+    point to has been collected by the time the reference is checked.
+    """
+    errors = []
+
     # 2.1 Schema Version (Basic check)
-    if data.get("schema_version") not in ["1.0.0", "1.1.0"]:
+    if data.get("schema_version") not in SUPPORTED_VERSIONS:
         errors.append(f"BLOCKER | INVALID_VERSION | schema_version | Version {data.get('schema_version')} not supported")
 
-    # 2.2 Uniqueness
     ids = set()
-    for entity in ["units", "scenarios", "conditions", "comparisons"]:
-        if entity in data:
-            for i, item in enumerate(data[entity]):
-                item_id = item.get(f"{entity[:-1]}_id") # unit_id, scenario_id...
+    ids_by_entity = {entity: set() for entity in ENTITIES}
+    for entity in ENTITIES:
+        items = data.get(entity)
+        if not isinstance(items, list):
+            continue
+        id_key = f"{entity[:-1]}_id" # unit_id, scenario_id...
+        for i, item in enumerate(items):
+            if not isinstance(item, dict):
+                continue
+
+            # 2.2 Uniqueness
+            if entity != "measurements":
+                item_id = item.get(id_key)
                 if item_id in ids:
                     errors.append(f"BLOCKER | DUPLICATE_ID | {entity}[{i}] | ID {item_id} is duplicated")
                 else:
                     ids.add(item_id)
-    
-    # 2.3 & 3. Referential Integrity
-    unit_ids = {u["unit_id"] for u in data.get("units", [])}
-    scenario_ids = {s["scenario_id"] for s in data.get("scenarios", [])}
-    condition_ids = {c["condition_id"] for c in data.get("conditions", [])}
-    comparison_ids = {k["comparison_id"] for k in data.get("comparisons", [])}
-    
-    # Check Comparisons
-    if "comparisons" in data:
-        for i, k in enumerate(data["comparisons"]):
-            if k.get("unit_id") not in unit_ids:
-                errors.append(f"BLOCKER | MISSING_REF | comparisons[{i}].unit_id | {k.get('unit_id')} not found in units")
-            if k.get("scenario_id") not in scenario_ids:
-                errors.append(f"BLOCKER | MISSING_REF | comparisons[{i}].scenario_id | {k.get('scenario_id')} not found in scenarios")
-            if k.get("baseline_condition_id") not in condition_ids:
-                errors.append(f"BLOCKER | MISSING_REF | comparisons[{i}].baseline_condition_id | {k.get('baseline_condition_id')} not found in conditions")
-            if k.get("retrofit_condition_id") not in condition_ids:
-                errors.append(f"BLOCKER | MISSING_REF | comparisons[{i}].retrofit_condition_id | {k.get('retrofit_condition_id')} not found in conditions")
-
-    # Check Measurements
-    if "measurements" in data:
-        for i, m in enumerate(data["measurements"]):
-            if m.get("comparison_id") not in comparison_ids:
-                errors.append(f"BLOCKER | MISSING_REF | measurements[{i}].comparison_id | {m.get('comparison_id')} not found in comparisons")
+                ids_by_entity[entity].add(item_id)
 
-    return errors
+            # 2.3 & 3. Referential Integrity
+            if entity == "comparisons":
+                for field, target in [("unit_id", "units"), ("scenario_id", "scenarios"),
+                                      ("baseline_condition_id", "conditions"), ("retrofit_condition_id", "conditions")]:
+                    if item.get(field) not in ids_by_entity[target]:
+                        errors.append(f"BLOCKER | MISSING_REF | comparisons[{i}].{field} | {item.get(field)} not found in {target}")
+            elif entity == "measurements":
+                if item.get("comparison_id") not in ids_by_entity["comparisons"]:
+                    errors.append(f"BLOCKER | MISSING_REF | measurements[{i}].comparison_id | {item.get('comparison_id')} not found in comparisons")
+
+            # 2.5 Evidence
+            if "evidence" not in item:
+                # Comparisons might not need evidence in some schemas, but usually yes
+                if entity != "comparisons":
+                    errors.append(f"BLOCKER | MISSING_EVIDENCE | {entity}[{i}] | Missing evidence object")
+            elif not isinstance(item["evidence"], dict) or "page" not in item["evidence"]:
+                errors.append(f"BLOCKER | MISSING_PAGE | {entity}[{i}].evidence | Missing page number")
 
-def check_logic_rules(data):
-    errors = []
-    
-    # 2.4 Roles
-    if "conditions" in data:
-        for i, c in enumerate(data["conditions"]):
-            role = c.get("condition_role")
-            cid = c.get("condition_id")
-            # We can't easily cross-check baseline/retrofit without map, but we can check if used correctly in comparison
-            # But simpler: just ensure role is valid enum (handled by schema), 
-            # and maybe check if specific IDs labeled 'baseline' are actually used as baseline? 
-            # For now, relying on schema enums.
-            pass
-
-    # 2.5 Evidence
-    for entity in ["units", "scenarios", "conditions", "comparisons", "measurements"]:
-        if entity in data:
-            for i, item in enumerate(data[entity]):
-                if "evidence" not in item:
-                     # Comparisons might not need evidence in some schemas, but usually yes
-                     if entity != "comparisons": 
-                        errors.append(f"BLOCKER | MISSING_EVIDENCE | {entity}[{i}] | Missing evidence object")
-                elif "page" not in item["evidence"]:
-                     errors.append(f"BLOCKER | MISSING_PAGE | {entity}[{i}].evidence | Missing page number")
-    
     return errors
 
+def validate_data(data):
+    """Returns (valid, errors) for an extraction already in memory"""
+    if not isinstance(data, dict):
+        # Valid JSON, but a list or scalar: nothing below can walk it
+        return False, ["BLOCKER | SCHEMA_TYPE | $ | root must be an object"]
+    with stage_timer('validate', data.get('doc_id')):
+        errors = schema_errors(data) + check_integrity(data)
+    return not errors, errors
+
 def validate_doc(doc_id):
+    """Pool entry point: never raises, so one bad doc can't stop the batch"""
+    try:
+        return _validate_doc(doc_id)
+    except Exception as e:
+        return False, [f"BLOCKER | VALIDATION_ERROR | $ | {type(e).__name__}: {e}"]
+
+def _validate_doc(doc_id):
     raw_path = os.path.join('extractions_raw', f'{doc_id}.json')
     if not os.path.exists(raw_path):
         return False, ["File not found"]
         
-    with open(raw_path, 'r') as f:
-        data = json.load(f)
-        
-    errors = []
-    
-    # 1. Structural Integrity
-    errors.extend(check_structural_integrity(data))
-    
-    # 2. Logic Rules
-    errors.extend(check_logic_rules(data))
+    with stage_timer('validate', doc_id) as metrics:
+        metrics.add(bytes_read=os.path.getsize(raw_path))
+        try:
+            with open(raw_path, 'r') as f:
+                data = json.load(f)
+        except ValueError as e:
+            return False, [f"BLOCKER | INVALID_JSON | $ | {e}"]
+            
+        return validate_data(data)
 
-    if errors:
-        return False, errors
-    return True, []
+def publish_valid(doc_id):
+    """Makes extractions_valid/{doc_id}.json the same bytes as the raw file.
+
+    A hardlink costs no copy or re-serialization; the swap is an atomic
+    rename, and raw files are only ever replaced (never rewritten in place),
+    so the two names can't drift apart afterwards.
+    """
+    raw_path = os.path.join('extractions_raw', f'{doc_id}.json')
+    valid_path = os.path.join('extractions_valid', f'{doc_id}.json')
+    os.makedirs('extractions_valid', exist_ok=True)
+    # Already linked (re-validation); rename() between two links of one
+    # file is a no-op, so there is nothing to swap
+    if os.path.exists(valid_path) and os.path.samefile(raw_path, valid_path):
+        return
+    tmp_path = f"{valid_path}.tmp{os.getpid()}"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(raw_path, tmp_path)
+    except OSError:
+        # Filesystems without hardlinks still get a byte copy
+        shutil.copyfile(raw_path, tmp_path)
+    os.replace(tmp_path, valid_path)
+
+def store_validation_result(doc_id, valid, errors):
+    """Writes the valid copy or the report for a doc; returns its new status"""
+    valid_path = os.path.join('extractions_valid', f'{doc_id}.json')
+    report_path = os.path.join('validation_reports', f'{doc_id}.json')
+    if valid:
+        publish_valid(doc_id)
+        # A report from an earlier schema version no longer applies
+        if os.path.exists(report_path):
+            os.remove(report_path)
+        return 'validated_ok'
+
+    # Report
+    os.makedirs('validation_reports', exist_ok=True)
+    with open(report_path, 'w') as f:
+        json.dump({'errors': errors}, f, indent=2)
+    if os.path.exists(valid_path):
+        os.remove(valid_path)
+    return 'needs_review'
+
+def run_validate(workers=None, revalidate=False):
+    if workers is None:
+        with open('run_config.yaml', 'r') as f:
+            config = yaml.safe_load(f)
+        workers = config.get('validation', {}).get('workers', 1)
 
-def run_validate():
     conn = get_connection()
     c = conn.cursor()
     
-    c.execute("SELECT doc_id FROM docs WHERE status = 'extracted_raw'")
-    docs = c.fetchall()
+    # After a schema change, re-check validated docs too (validated_ok and needs_review);
+    # approved docs were signed off by a reviewer and are left alone
+    statuses = ('extracted_raw', 'validated_ok', 'needs_review') if revalidate else ('extracted_raw',)
+    c.execute(f"SELECT doc_id FROM docs WHERE status IN ({','.join('?' * len(statuses))})", statuses)
+    doc_ids = [doc_id for (doc_id,) in c.fetchall()]
     
-    print(f"Found {len(docs)} docs to validate.")
+    print(f"Found {len(doc_ids)} docs to validate.")
     
-    for (doc_id,) in docs:
+    # Validation is CPU-bound and runs in the pool; file and DB writes stay here
+    if workers > 1 and len(doc_ids) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(validate_doc, doc_ids, chunksize=16))
+    else:
+        results = [validate_doc(doc_id) for doc_id in doc_ids]
+
+    for doc_id, (valid, errors) in zip(doc_ids, results):
         print(f"Validating {doc_id}...")
-        valid, errors = validate_doc(doc_id)
+        new_status = store_validation_result(doc_id, valid, errors)
+        c.execute("UPDATE docs SET status = ? WHERE doc_id = ?", (new_status, doc_id))
         
         if valid:
-            # Copy to valid
-            with open(os.path.join('extractions_raw', f'{doc_id}.json'), 'r') as f:
-                data = json.load(f)
-            
-            os.makedirs('extractions_valid', exist_ok=True)
-            with open(os.path.join('extractions_valid', f'{doc_id}.json'), 'w') as f:
-                json.dump(data, f, indent=2)
-                
-            c.execute("UPDATE docs SET status = 'validated_ok' WHERE doc_id = ?", (doc_id,))
             print("  OK.")
         else:
-            # Report
-            os.makedirs('validation_reports', exist_ok=True)
-            with open(os.path.join('validation_reports', f'{doc_id}.json'), 'w') as f:
-                json.dump({'errors': errors}, f, indent=2)
-                
-            c.execute("UPDATE docs SET status = 'needs_review' WHERE doc_id = ?", (doc_id,))
             print(f"  Failed: {errors}")
             
     conn.commit()
     conn.close()
 
 if __name__ == "__main__":
-    run_validate()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, help="Process pool size (overrides validation.workers)")
+    parser.add_argument('--revalidate', action='store_true', help="Also re-check validated_ok and needs_review docs (e.g. after a schema change)")
+    args = parser.parse_args()
+
+    run_validate(workers=args.workers, revalidate=args.revalidate)
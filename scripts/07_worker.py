@@ -0,0 +1,177 @@
+"""Long-running pipeline worker (PRD 5.2).
+
+Each worker process repeatedly leases the oldest doc whose status it
+handles, runs the next stage for that doc and moves it on:
+
+    indexed             -> paging + search index      -> paged
+    paged               -> triage                     -> triaged_*
+    triaged_extractable -> extraction + validation    -> validated_ok / needs_review
+    extracted_raw       -> validation                 -> validated_ok / needs_review
+
+CPU workers take paging, triage and validation; LLM workers take
+extraction, so page parsing overlaps with requests waiting on the API.
+Leases are renewed by a heartbeat while a stage runs; a crashed worker's
+doc becomes claimable again once its lease expires. Failed stages keep the
+lease (so the retry waits one lease period) and after worker.max_attempts
+the doc is parked as 'failed' with the error in notes.
+"""
+import os
+import time
+import socket
+import argparse
+import importlib
+import threading
+import multiprocessing
+import yaml
+import search_index
+from db import init_db, sync_from_index, claim_next_doc, renew_lease, complete_lease, fail_lease, count_docs
+from llm_client import GeminiClient
+from llm_cache import ResponseCache
+
+pages_text = importlib.import_module('03_pages_text')
+triage = importlib.import_module('04_triage')
+extract = importlib.import_module('05_extract')
+validate = importlib.import_module('06_validate')
+
+CPU_STATUSES = ('indexed', 'paged', 'extracted_raw')
+LLM_STATUSES = ('triaged_extractable',)
+
+def load_config():
+    with open('run_config.yaml', 'r') as f:
+        return yaml.safe_load(f)
+
+def run_paging(doc_id, pdf_path):
+    num_pages = pages_text.extract_doc_pages(doc_id, pdf_path)
+    search_index.update_index([doc_id])
+    return 'paged', {}, f"{num_pages} pages"
+
+def run_triage(doc_id, pdf_path):
+    result = triage.triage_doc(doc_id)
+    if result is None:
+        raise RuntimeError("no page text")
+    label, new_status = result
+    return new_status, {'triage_label': label}, label
+
+def run_validation(doc_id, pdf_path):
+    valid, errors = validate.validate_doc(doc_id)
+    new_status = validate.store_validation_result(doc_id, valid, errors)
+    return new_status, {}, f"{len(errors)} errors"
+
+class ExtractionStage:
+    """Holds one model client per LLM worker process"""
+
+    def __init__(self, config, mock, llm_workers):
+        self.config = config
+        self.schema = extract.load_schema('core_extraction.schema.json')
+        self.client = None
+        self.cache = None
+        api_key = extract.load_api_key()
+        if not mock and not api_key:
+            print("WARNING: GEMINI_API_KEY not found. Using MOCK mode.")
+        elif not mock:
+            # The soft rate limit and the in-flight cap apply to the whole
+            # pipeline, so each LLM worker process gets an equal share of them
+            rate_limits = dict(config.get('rate_limits', {}))
+            rate_limits['requests_per_minute_soft'] = rate_limits.get('requests_per_minute_soft', 30) / llm_workers
+            rate_limits['max_concurrent_requests'] = max(1, rate_limits.get('max_concurrent_requests', 2) // llm_workers)
+            self.cache = ResponseCache.from_config(config)
+            self.client = GeminiClient(config['extraction']['model'], api_key, rate_limits, cache=self.cache)
+
+    def __call__(self, doc_id, pdf_path):
+        # Validated (and repaired) in memory right away; extracted_raw is
+        # left only for docs extracted by other means
+        result, valid, errors = extract.extract_and_validate(doc_id, self.config, self.client, self.schema)
+        extract.save_raw_extraction(doc_id, result)
+        new_status = validate.store_validation_result(doc_id, valid, errors)
+        return new_status, {}, f"{len(errors)} errors"
+
+def heartbeat(doc_id, owner, interval, stop):
+    while not stop.wait(interval):
+        if not renew_lease(doc_id, owner):
+            print(f"[{owner}] lost lease on {doc_id}")
+            return
+
+def work(kind, index, mock, drain, llm_workers):
+    config = load_config()
+    worker_config = config.get('worker', {})
+    lease_seconds = worker_config.get('lease_seconds', 300)
+    poll_interval = worker_config.get('poll_interval', 5)
+    max_attempts = worker_config.get('max_attempts', 3)
+    owner = f"{socket.gethostname()}:{os.getpid()}:{kind}{index}"
+
+    if kind == 'llm':
+        statuses = LLM_STATUSES
+        stages = {'triaged_extractable': ExtractionStage(config, mock, llm_workers)}
+    else:
+        statuses = CPU_STATUSES
+        stages = {'indexed': run_paging, 'paged': run_triage, 'extracted_raw': run_validation}
+
+    print(f"[{owner}] started ({', '.join(statuses)})")
+    try:
+        while True:
+            claimed = claim_next_doc(owner, statuses, lease_seconds)
+            if claimed is None:
+                # Docs still upstream of this worker may arrive later
+                if drain and count_docs(CPU_STATUSES + LLM_STATUSES) == 0:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            doc_id, pdf_path, status = claimed
+            stop = threading.Event()
+            beat = threading.Thread(target=heartbeat, args=(doc_id, owner, lease_seconds / 3, stop), daemon=True)
+            beat.start()
+            started = time.perf_counter()
+            try:
+                new_status, fields, summary = stages[status](doc_id, pdf_path)
+            except Exception as e:
+                stop.set()
+                beat.join()
+                parked = fail_lease(doc_id, owner, f"{status}: {e}", max_attempts)
+                print(f"[{owner}] {doc_id[:8]}... {status} failed: {e}" + (" (parked as failed)" if parked else ""))
+                continue
+            stop.set()
+            beat.join()
+            if complete_lease(doc_id, owner, status=new_status, **fields):
+                print(f"[{owner}] {doc_id[:8]}... {status} -> {new_status} ({summary}, {time.perf_counter() - started:.1f}s)")
+            else:
+                print(f"[{owner}] {doc_id[:8]}... lease expired before {status} finished; result discarded")
+    except KeyboardInterrupt:
+        pass
+
+    cache = getattr(stages.get('triaged_extractable'), 'cache', None)
+    if cache:
+        cache.evict()
+    print(f"[{owner}] stopped")
+
+def run_workers(cpu_workers=None, llm_workers=None, mock=False, drain=False):
+    init_db()
+    sync_from_index()
+
+    worker_config = load_config().get('worker', {})
+    if cpu_workers is None:
+        cpu_workers = worker_config.get('cpu_workers', 1)
+    if llm_workers is None:
+        llm_workers = worker_config.get('llm_workers', 1)
+
+    processes = [multiprocessing.Process(target=work, args=('cpu', i, mock, drain, llm_workers)) for i in range(cpu_workers)]
+    processes += [multiprocessing.Process(target=work, args=('llm', i, mock, drain, llm_workers)) for i in range(llm_workers)]
+    for p in processes:
+        p.start()
+    try:
+        for p in processes:
+            p.join()
+    except KeyboardInterrupt:
+        # Workers get the same SIGINT; in-flight leases expire on their own
+        for p in processes:
+            p.join()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run pipeline stages continuously with leased docs")
+    parser.add_argument('--cpu-workers', type=int, help="Paging/triage/validation processes (overrides worker.cpu_workers)")
+    parser.add_argument('--llm-workers', type=int, help="Extraction processes (overrides worker.llm_workers)")
+    parser.add_argument('--mock', action='store_true')
+    parser.add_argument('--drain', action='store_true', help="Exit once no doc is waiting for any stage")
+    args = parser.parse_args()
+
+    run_workers(cpu_workers=args.cpu_workers, llm_workers=args.llm_workers, mock=args.mock, drain=args.drain)
@@ -1,63 +1,310 @@
 import os
 import json
+import hashlib
+import argparse
 import pandas as pd
-import glob
+import yaml
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 from db import get_connection
+from export_tables import TABLES, doc_tables
+from telemetry import stage_timer
 
-def run_export():
-    conn = get_connection()
-    c = conn.cursor()
-    
+EXPORT_DIR = 'exports'
+# Per-table Arrow copies of the last export plus the source hash of every doc in it
+CACHE_DIR = os.path.join(EXPORT_DIR, '.cache')
+MANIFEST_PATH = os.path.join(CACHE_DIR, 'manifest.json')
+FORMATS = ('parquet', 'arrow', 'csv')
+
+def load_config():
+    with open('run_config.yaml', 'r') as f:
+        return yaml.safe_load(f)
+
+def load_index_rows():
+    """pdf_index.csv rows by doc_id (pdf_path, match columns for references)"""
+    if not os.path.exists('pdf_index.csv'):
+        return {}
+    df = pd.read_csv('pdf_index.csv', dtype={'doc_id': str})
+    return {row['doc_id']: {k: (None if pd.isna(v) else v) for k, v in row.items()} for row in df.to_dict('records')}
+
+def load_reference_metadata():
+    """Manifest metadata by reference_id (the WoS/Scopus UT) from 01_manifest_wizard.py"""
+    if not os.path.exists('references_filtered.csv'):
+        return {}
+    df = pd.read_csv('references_filtered.csv')
+    if 'UT' not in df.columns:
+        return {}
+    columns = {'TI': 'title', 'PY': 'year', 'DI': 'doi', 'DT': 'doc_type', 'DB': 'source_db'}
+    references = {}
+    for row in df.to_dict('records'):
+        references[str(row['UT'])] = {
+            name: (None if pd.isna(row.get(col)) else row.get(col))
+            for col, name in columns.items() if col in row
+        }
+    return references
+
+def export_sources(c):
+    """(doc_id, path) of every exportable doc, ordered by doc_id"""
     # Priority: Approved > Valid
-    # We select all docs that have valid data
-    c.execute("SELECT doc_id FROM docs WHERE status IN ('approved', 'validated_ok')")
-    docs = c.fetchall()
-    
-    unified_rows = []
-    
-    for (doc_id,) in docs:
+    c.execute("SELECT doc_id FROM docs WHERE status IN ('approved', 'validated_ok') ORDER BY doc_id")
+    sources = []
+    for (doc_id,) in c.fetchall():
         path = os.path.join('extractions_approved', f'{doc_id}.json')
         if not os.path.exists(path):
             path = os.path.join('extractions_valid', f'{doc_id}.json')
-            
-        if not os.path.exists(path):
-            continue
-            
+        if os.path.exists(path):
+            sources.append((doc_id, path))
+    return sources
+
+def sha256_file(path):
+    sha256_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256_hash.update(block)
+    return sha256_hash.hexdigest()
+
+def schema_fingerprint():
+    """Changes whenever a table's columns or types change; invalidates the row cache"""
+    return hashlib.sha256("\n".join(f"{name}:{schema}" for name, schema in TABLES.items()).encode('utf-8')).hexdigest()
+
+def references_fingerprint(references):
+    return hashlib.sha256(json.dumps(references, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def load_manifest(references):
+    """Last export's manifest, or None if the cached rows can't be reused"""
+    if not os.path.exists(MANIFEST_PATH):
+        return None
+    with open(MANIFEST_PATH, 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('schema') != schema_fingerprint():
+        return None
+    # references_filtered.csv feeds every doc's references row
+    if manifest.get('references') != references_fingerprint(references):
+        return None
+    if not all(os.path.exists(cache_path(name)) for name in TABLES):
+        return None
+    return manifest
+
+def save_manifest(docs, references):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = MANIFEST_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'schema': schema_fingerprint(), 'references': references_fingerprint(references), 'docs': docs}, f)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+def cache_path(name):
+    return os.path.join(CACHE_DIR, f"{name}.arrow")
+
+def source_entries(sources, index_rows, previous):
+    """Manifest entry per doc: source file hash plus its pdf_index.csv row"""
+    entries = {}
+    for doc_id, path in sources:
+        st = os.stat(path)
+        old = previous.get(doc_id)
+        # Unchanged size and mtime: reuse the hash instead of re-reading the file
+        if old and old['path'] == path and old['size'] == st.st_size and old['mtime_ns'] == st.st_mtime_ns:
+            sha256 = old['sha256']
+        else:
+            sha256 = sha256_file(path)
+        entries[doc_id] = {'path': path, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': sha256}
+
+    # The doc's references row also depends on its pdf_index.csv row
+    for doc_id, entry in entries.items():
+        side = json.dumps(index_rows.get(doc_id), sort_keys=True, default=str)
+        entry['key'] = hashlib.sha256(f"{entry['sha256']}\n{side}".encode('utf-8')).hexdigest()
+    return entries
+
+def load_doc_tables(doc_id, path, index_rows, references):
+    """Typed tables for one doc, or None if a value doesn't fit its column"""
+    with stage_timer('export', doc_id) as metrics:
+        metrics.add(bytes_read=os.path.getsize(path))
         with open(path, 'r') as f:
             data = json.load(f)
-            
-        # Flatten structure for unified_outcomes
-        if 'measurements' in data and data['measurements']:
-            for m in data['measurements']:
-                row = {
-                    'project_id': data.get('project_id'),
-                    'reference_id': data.get('reference_id'),
-                    'doc_id': doc_id,
-                    'study_type': data.get('study', {}).get('study_type'),
-                    'building_type': data.get('building', {}).get('building_type'),
-                    'comparison_id': m.get('comparison_id'),
-                    'outcome_family': m.get('outcome_family'),
-                    'baseline_value': m.get('baseline_value'),
-                    'retrofit_value': m.get('retrofit_value'),
-                    'unit': m.get('unit'),
-                }
-                
-                # Calculate diff
-                if row['baseline_value'] is not None and row['retrofit_value'] is not None:
-                    row['raw_diff'] = row['retrofit_value'] - row['baseline_value']
+        try:
+            return doc_tables(doc_id, data, index_rows.get(doc_id), references.get(str(data.get('reference_id'))))
+        except (TypeError, ValueError) as e:
+            # A value that doesn't fit its column (e.g. a hand-edited number as text)
+            print(f"  Skipping {doc_id}: {e}")
+            return None
+
+class TableWriters:
+    """One streaming writer per table and format; files appear atomically on close"""
+
+    def __init__(self, formats):
+        self.writers = []
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        for name, schema in TABLES.items():
+            # The Arrow copy in the cache is what incremental runs merge into
+            targets = [(os.path.join(EXPORT_DIR, f"{name}.{fmt}"), fmt) for fmt in formats]
+            targets.append((cache_path(name), 'arrow'))
+            for path, fmt in targets:
+                tmp_path = path + '.tmp'
+                if fmt == 'parquet':
+                    writer = pq.ParquetWriter(tmp_path, schema)
+                elif fmt == 'arrow':
+                    writer = pa.ipc.new_file(tmp_path, schema)
                 else:
-                    row['raw_diff'] = None
-                    
-                unified_rows.append(row)
-
-    os.makedirs('exports', exist_ok=True)
-    
-    if unified_rows:
-        df = pd.DataFrame(unified_rows)
-        df.to_csv('exports/unified_outcomes.csv', index=False)
-        print(f"Exported {len(df)} rows to exports/unified_outcomes.csv")
+                    writer = pa_csv.CSVWriter(tmp_path, schema)
+                self.writers.append((name, writer, tmp_path, path))
+        self.row_counts = {name: 0 for name in TABLES}
+
+    def write(self, batch):
+        """batch: {table name: [pa.Table]} for a group of docs"""
+        for name, tables in batch.items():
+            table = pa.concat_tables(tables) if tables else TABLES[name].empty_table()
+            if table.num_rows == 0:
+                continue
+            # One record batch / row group per write rather than one per doc
+            table = table.combine_chunks()
+            self.row_counts[name] += table.num_rows
+            for table_name, writer, _, _ in self.writers:
+                if table_name == name:
+                    writer.write_table(table)
+
+    def close(self):
+        for _, writer, tmp_path, path in self.writers:
+            writer.close()
+            os.replace(tmp_path, path)
+
+    def abort(self):
+        # Previous exports stay in place
+        for _, writer, tmp_path, _ in self.writers:
+            writer.close()
+            os.remove(tmp_path)
+
+def write_tables(writers, batches):
+    try:
+        for batch in batches:
+            writers.write(batch)
+    except BaseException:
+        writers.abort()
+        raise
+    writers.close()
+    return writers.row_counts
+
+def full_export(sources, formats, batch_docs, index_rows, references):
+    """Flattens every doc, streaming batch_docs docs at a time"""
+    def batches():
+        # Memory stays bounded by batch_docs rather than by corpus size
+        batch = {name: [] for name in TABLES}
+        for i, (doc_id, path) in enumerate(sources, 1):
+            tables = load_doc_tables(doc_id, path, index_rows, references)
+            if tables is not None:
+                for name, table in tables.items():
+                    batch[name].append(table)
+            if i % batch_docs == 0:
+                yield batch
+                batch = {name: [] for name in TABLES}
+        yield batch
+
+    return write_tables(TableWriters(formats), batches())
+
+def merged_batches(name, stale, new_tables):
+    """One table's cached rows minus stale docs, with new_tables [(doc_id, table)] slotted in by doc_id.
+
+    Reads the cache one record batch at a time (memory-mapped), so memory
+    follows the batch size and the changed docs, not the corpus.
+    """
+    pending = sorted(new_tables, key=lambda item: item[0])
+    with pa.memory_map(cache_path(name), 'r') as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            kept = batch.filter(pc.invert(pc.is_in(batch.column('doc_id'), value_set=stale)))
+            pieces = []
+            start = 0
+            # Cached rows are sorted by doc_id: a new doc goes before the first larger one
+            while pending and kept.num_rows and pending[0][0] < kept.column('doc_id')[-1].as_py():
+                split = pc.sum(pc.less(kept.column('doc_id'), pending[0][0])).as_py() or 0
+                pieces.append(pa.Table.from_batches([kept.slice(start, split - start)], schema=TABLES[name]))
+                pieces.append(pending.pop(0)[1])
+                start = split
+            pieces.append(pa.Table.from_batches([kept.slice(start)], schema=TABLES[name]))
+            table = pa.concat_tables(pieces)
+            if table.num_rows:
+                # One write per cached batch, so the cache doesn't fragment run after run
+                yield {name: [table]}
+    if pending:
+        yield {name: [table for _, table in pending]}
+
+def incremental_export(entries, previous, formats, index_rows, references):
+    """Re-flattens only changed docs and merges them into the cached tables.
+
+    The cached tables are streamed batch by batch through the TableWriters;
+    rows stay ordered by doc_id (each doc's rows keep their order), so the
+    result equals a full rebuild.
+    """
+    changed = [doc_id for doc_id, entry in entries.items()
+               if doc_id not in previous or previous[doc_id]['key'] != entry['key']]
+    removed = [doc_id for doc_id in previous if doc_id not in entries]
+    if not changed and not removed:
+        return None, changed, removed
+
+    new_tables = {name: [] for name in TABLES}
+    for doc_id in changed:
+        tables = load_doc_tables(doc_id, entries[doc_id]['path'], index_rows, references)
+        if tables is not None:
+            for name, table in tables.items():
+                if table.num_rows:
+                    new_tables[name].append((doc_id, table))
+
+    stale = pa.array(changed + removed, pa.string())
+
+    def batches():
+        for name in TABLES:
+            yield from merged_batches(name, stale, new_tables[name])
+
+    return write_tables(TableWriters(formats), batches()), changed, removed
+
+def run_export(formats=None, batch_docs=None, full=False):
+    export_config = load_config().get('export', {})
+    formats = formats or export_config.get('formats', ['parquet', 'csv'])
+    batch_docs = batch_docs or export_config.get('batch_docs', 500)
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        raise ValueError(f"Unknown export formats: {sorted(unknown)}")
+
+    conn = get_connection()
+    c = conn.cursor()
+    sources = export_sources(c)
+    conn.close()
+
+    index_rows = load_index_rows()
+    references = load_reference_metadata()
+
+    manifest = None if full else load_manifest(references)
+    previous = manifest['docs'] if manifest else {}
+    entries = source_entries(sources, index_rows, previous)
+    # Outputs in a newly requested format don't exist yet
+    missing_output = any(not os.path.exists(os.path.join(EXPORT_DIR, f"{name}.{fmt}"))
+                         for name in TABLES for fmt in formats)
+
+    if manifest is None or missing_output:
+        row_counts = full_export(sources, formats, batch_docs, index_rows, references)
+        print(f"Full export of {len(sources)} docs.")
     else:
+        row_counts, changed, removed = incremental_export(entries, previous, formats, index_rows, references)
+        if row_counts is None:
+            print("Exports up to date.")
+            return None
+        print(f"Incremental export: {len(changed)} changed, {len(removed)} removed docs.")
+    save_manifest(entries, references)
+
+    if not sources:
         print("No data to export.")
+    for name, count in row_counts.items():
+        print(f"Exported {count} rows to {EXPORT_DIR}/{name}.{{{','.join(formats)}}}")
+    return row_counts
 
 if __name__ == "__main__":
-    run_export()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--format', dest='formats', action='append', choices=FORMATS,
+                        help="Output format, repeatable (overrides export.formats)")
+    parser.add_argument('--batch-docs', type=int, help="Docs flattened per write (overrides export.batch_docs)")
+    parser.add_argument('--full', action='store_true', help="Re-flatten every doc instead of only changed ones")
+    args = parser.parse_args()
+
+    run_export(formats=args.formats, batch_docs=args.batch_docs, full=args.full)
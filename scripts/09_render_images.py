@@ -0,0 +1,207 @@
+"""RF-08 image fallback: renders selected pages to pages_img/{doc_id}/page_XXX.png.
+
+Only triggered pages are rendered, at most images.max_pages_per_doc per doc:
+- trigger_if_null_critical: evidence pages of measurements whose baseline,
+  retrofit value or unit came back null (rendered first)
+- trigger_if_table_figure_signal: pages whose text mentions a Table or
+  Figure, or whose layout cache table_score reaches images.table_score_threshold
+
+Docs with any triggered page get needs_images = 1. Each PNG has a
+page_XXX.meta.json with {dpi, width, height, created_at}; a page already
+rendered at the configured DPI is not rendered again. Docs are spread over
+a process pool, each worker capped at images.worker_memory_mb of address
+space so one huge page can't take the machine down.
+"""
+import os
+import re
+import json
+import time
+import yaml
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pypdfium2 as pdfium
+from db import get_connection
+from page_store import PageStore
+import page_layout
+from telemetry import stage_timer
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PAGES_IMG_DIR = 'pages_img'
+EXTRACTION_DIRS = ['extractions_valid', 'extractions_raw']
+# Docs past triage: their page text exists and, after 05, an extraction may
+CANDIDATE_STATUSES = ('triaged_extractable', 'triaged_maybe', 'extracted_raw', 'needs_review', 'validated_ok')
+TABLE_FIGURE_PATTERN = re.compile(r"\bTable\s*\d|\bFig(?:ure|\.)\s*\d", re.IGNORECASE)
+CRITICAL_FIELDS = ('baseline_value', 'retrofit_value', 'unit')
+
+def load_config():
+    with open('run_config.yaml', 'r') as f:
+        return yaml.safe_load(f)
+
+def image_paths(doc_id, page):
+    base = os.path.join(PAGES_IMG_DIR, doc_id, f'page_{page:03d}')
+    return f'{base}.png', f'{base}.meta.json'
+
+def is_cached(doc_id, page, dpi):
+    png_path, meta_path = image_paths(doc_id, page)
+    if not os.path.exists(png_path) or not os.path.exists(meta_path):
+        return False
+    try:
+        with open(meta_path, 'r') as f:
+            return json.load(f).get('dpi') == dpi
+    except ValueError:
+        return False
+
+def load_extraction(doc_id):
+    for directory in EXTRACTION_DIRS:
+        path = os.path.join(directory, f'{doc_id}.json')
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    return json.load(f)
+            except ValueError:
+                return None
+    return None
+
+def null_critical_pages(extraction):
+    """Evidence pages of measurements missing a baseline, retrofit value or unit"""
+    pages = []
+    for measurement in (extraction or {}).get('measurements', []) or []:
+        if not isinstance(measurement, dict):
+            continue
+        if all(measurement.get(field) is not None for field in CRITICAL_FIELDS):
+            continue
+        evidence = measurement.get('evidence')
+        if isinstance(evidence, dict) and isinstance(evidence.get('page'), int):
+            pages.append(evidence['page'])
+    return pages
+
+def table_figure_pages(doc_id, threshold):
+    with PageStore(doc_id) as store:
+        pages = {page for page in store.pages() if TABLE_FIGURE_PATTERN.search(store.read_page(page))}
+    # Tables without a caption in the text still show in the layout
+    pages.update(page_layout.table_pages(doc_id, threshold))
+    return sorted(pages)
+
+def select_pages(doc_id, images_config):
+    """Triggered pages for a doc, most useful first, capped at max_pages_per_doc"""
+    with PageStore(doc_id) as store:
+        known_pages = set(store.index)
+    selected = []
+    if images_config.get('trigger_if_null_critical', True):
+        selected += null_critical_pages(load_extraction(doc_id))
+    if images_config.get('trigger_if_table_figure_signal', True):
+        selected += table_figure_pages(doc_id, images_config.get('table_score_threshold', 0.4))
+    # Evidence pages the model made up don't exist in the PDF
+    selected = [page for page in dict.fromkeys(selected) if page in known_pages]
+    return selected[:images_config.get('max_pages_per_doc', 6)]
+
+def limit_memory(memory_mb):
+    """Pool initializer: caps each worker's address space"""
+    if resource is not None and memory_mb:
+        limit = memory_mb * 1024 * 1024
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+def render_page(pdf, page, dpi, png_path):
+    """Renders one page to PNG; returns (width, height) in pixels"""
+    bitmap = pdf[page].render(scale=dpi / 72)
+    image = bitmap.to_pil()
+    tmp_path = f"{png_path}.tmp{os.getpid()}"
+    image.save(tmp_path, format='PNG')
+    os.replace(tmp_path, png_path)
+    return image.size
+
+def render_doc(doc_id, pdf_path, pages, dpi):
+    """Renders the given pages of one PDF; returns {page: error or None}"""
+    os.makedirs(os.path.join(PAGES_IMG_DIR, doc_id), exist_ok=True)
+    results = {}
+    with stage_timer('images', doc_id) as metrics:
+        metrics.add(bytes_read=os.path.getsize(pdf_path))
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            for page in pages:
+                png_path, meta_path = image_paths(doc_id, page)
+                try:
+                    width, height = render_page(pdf, page, dpi, png_path)
+                except MemoryError:
+                    results[page] = f"over images.worker_memory_mb at {dpi} DPI"
+                    continue
+                # Meta last: a page counts as rendered once its meta exists
+                with open(meta_path, 'w') as f:
+                    json.dump({'dpi': dpi, 'width': width, 'height': height, 'created_at': time.time()}, f, indent=2)
+                metrics.add(pages=1)
+                results[page] = None
+        finally:
+            pdf.close()
+    return results
+
+def run_render(doc_ids=None, workers=None, dpi=None, dry_run=False):
+    config = load_config()
+    images_config = config.get('images', {})
+    if not images_config.get('enable_fallback', True):
+        print("Image fallback disabled (images.enable_fallback).")
+        return
+    dpi = dpi or images_config.get('dpi', 350)
+    if workers is None:
+        workers = images_config.get('workers', 1)
+
+    conn = get_connection()
+    c = conn.cursor()
+    if doc_ids:
+        c.execute(f"SELECT doc_id, pdf_path FROM docs WHERE doc_id IN ({','.join('?' * len(doc_ids))})", doc_ids)
+    else:
+        c.execute(f"SELECT doc_id, pdf_path FROM docs WHERE needs_images = 1 OR status IN ({','.join('?' * len(CANDIDATE_STATUSES))})",
+                  CANDIDATE_STATUSES)
+    docs = c.fetchall()
+
+    # Selection reads page text and the layout cache and is cheap; rendering is not
+    tasks = []
+    for doc_id, pdf_path in docs:
+        pages = select_pages(doc_id, images_config)
+        if not pages:
+            continue
+        todo = [page for page in pages if not is_cached(doc_id, page, dpi)]
+        print(f"Doc {doc_id[:8]}...: pages {pages} triggered, {len(todo)} to render at {dpi} DPI")
+        c.execute("UPDATE docs SET needs_images = 1 WHERE doc_id = ?", (doc_id,))
+        if todo:
+            tasks.append((doc_id, pdf_path, todo))
+    conn.commit()
+    conn.close()
+
+    if dry_run or not tasks:
+        print(f"{len(tasks)} docs to render.")
+        return
+
+    rendered = failed = 0
+    with ProcessPoolExecutor(max_workers=max(1, workers), initializer=limit_memory,
+                             initargs=(images_config.get('worker_memory_mb', 1024),)) as pool:
+        futures = {pool.submit(render_doc, doc_id, pdf_path, pages, dpi): doc_id for doc_id, pdf_path, pages in tasks}
+        for future in as_completed(futures):
+            doc_id = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                print(f"Error rendering {doc_id}: {e}")
+                failed += 1
+                continue
+            for page, error in results.items():
+                if error:
+                    print(f"  {doc_id[:8]}... page {page}: {error}")
+            rendered += sum(1 for error in results.values() if error is None)
+    print(f"Rendered {rendered} pages into {PAGES_IMG_DIR}/ ({failed} docs failed).")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render triggered pages to PNG for the image fallback")
+    parser.add_argument('--doc', action='append', help="Only this doc_id (repeatable)")
+    parser.add_argument('--workers', type=int, help="Process pool size (overrides images.workers)")
+    parser.add_argument('--dpi', type=int, help="Overrides images.dpi")
+    parser.add_argument('--dry-run', action='store_true', help="List triggered pages without rendering")
+    args = parser.parse_args()
+
+    run_render(doc_ids=args.doc, workers=args.workers, dpi=args.dpi, dry_run=args.dry_run)
@@ -0,0 +1,255 @@
+"""End-to-end stage benchmark over a synthetic corpus.
+
+Generates a corpus with generate_mock_data.generate_corpus (reused while
+its parameters don't change) in a scratch workspace, then runs 02 index,
+03 page text, 04 triage, retrieval (retrieve_pages + pack_context, with a
+mock extraction saved per doc instead of a model call), 06 validation and
+08 export against it, each from a clean state. Per stage it records wall
+and CPU time, docs and pages, plus p50/p95 per-doc latency from
+stage_metrics. Results go to {workspace}/results/{run_id}.json.
+
+With --baseline, stages slower than the baseline by more than --tolerance
+(and by more than --min-delta seconds, to ignore noise on fast stages) are
+flagged and the command exits with status 1. --save-baseline writes this
+run's results as the new baseline.
+
+    python scripts/benchmark.py --docs 200 --pages 4-40 --baseline benchmarks/baseline.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import importlib
+import contextlib
+import yaml
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKSPACE_MARKER = '.benchmark_workspace'
+# Kept between runs; everything else in the workspace is pipeline output
+KEEP = {WORKSPACE_MARKER, 'pdfs', 'corpus.json', 'results', 'run_config.yaml', 'schemas', 'stages.log'}
+STAGES = ['index', 'pages', 'triage', 'retrieve', 'validate', 'export']
+
+def prepare_workspace(workspace, corpus_params, workers):
+    """Creates or resets the workspace; regenerates the corpus only if its parameters changed"""
+    marker = os.path.join(workspace, WORKSPACE_MARKER)
+    if os.path.exists(workspace) and os.listdir(workspace) and not os.path.exists(marker):
+        raise SystemExit(f"{workspace} exists and is not a benchmark workspace; refusing to clear it")
+    os.makedirs(workspace, exist_ok=True)
+    open(marker, 'a').close()
+
+    for name in os.listdir(workspace):
+        if name not in KEEP:
+            path = os.path.join(workspace, name)
+            shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+
+    with open(os.path.join(REPO_DIR, 'run_config.yaml'), 'r') as f:
+        config = yaml.safe_load(f)
+    config['pdf_dir'] = 'pdfs'
+    for section in ('indexing', 'paging', 'triage', 'validation'):
+        config.setdefault(section, {})
+    config['indexing']['hash_workers'] = workers
+    config['paging']['workers'] = workers
+    config['triage']['workers'] = workers
+    config['validation']['workers'] = workers
+    with open(os.path.join(workspace, 'run_config.yaml'), 'w') as f:
+        yaml.safe_dump(config, f, sort_keys=False)
+    schemas_dir = os.path.join(workspace, 'schemas')
+    if os.path.exists(schemas_dir):
+        shutil.rmtree(schemas_dir)
+    shutil.copytree(os.path.join(REPO_DIR, 'schemas'), schemas_dir)
+
+    corpus_path = os.path.join(workspace, 'corpus.json')
+    if os.path.exists(corpus_path):
+        with open(corpus_path, 'r') as f:
+            corpus = json.load(f)
+        if {k: corpus.get(k) for k in corpus_params} == corpus_params:
+            print(f"Reusing corpus in {workspace}/pdfs ({corpus['docs']} docs, {corpus['total_pages']} pages)")
+            return corpus
+
+    generator = importlib.import_module('generate_mock_data')
+    pdf_dir = os.path.join(workspace, 'pdfs')
+    if os.path.exists(pdf_dir):
+        shutil.rmtree(pdf_dir)
+    print(f"Generating corpus: {corpus_params}")
+    started = time.perf_counter()
+    corpus = generator.generate_corpus(pdf_dir, **corpus_params)
+    print(f"  {corpus['docs']} docs, {corpus['total_pages']} pages in {time.perf_counter() - started:.1f}s")
+    with open(corpus_path, 'w') as f:
+        json.dump(corpus, f, indent=2)
+    return corpus
+
+def cpu_seconds():
+    # Pool workers are reaped before a stage returns, so children's time is included
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def run_retrieval(config):
+    """Retrieval and context packing per extractable doc, then a mock extraction in place of the model call"""
+    retriever = importlib.import_module('retriever')
+    context_packer = importlib.import_module('context_packer')
+    telemetry = importlib.import_module('telemetry')
+    db = importlib.import_module('db')
+    # Imported up front by stage_runners, so its import time isn't counted
+    extract = importlib.import_module('05_extract')
+
+    conn = db.get_connection()
+    c = conn.cursor()
+    c.execute("SELECT doc_id FROM docs WHERE status = 'triaged_extractable' ORDER BY doc_id")
+    doc_ids = [doc_id for (doc_id,) in c.fetchall()]
+    for doc_id in doc_ids:
+        with telemetry.stage_timer('retrieve', doc_id) as metrics:
+            pages = retriever.retrieve_pages(doc_id, config)
+            _, stats = context_packer.pack_context(doc_id, pages, config)
+            metrics.add(pages=len(stats['pages_packed']), bytes_read=stats['raw_chars'])
+        extract.save_raw_extraction(doc_id, extract.get_mock_extraction(doc_id))
+        c.execute("UPDATE docs SET status = 'extracted_raw' WHERE doc_id = ?", (doc_id,))
+        conn.commit()
+    conn.close()
+
+def stage_runners():
+    index = importlib.import_module('02_index_pdfs')
+    pages_text = importlib.import_module('03_pages_text')
+    triage = importlib.import_module('04_triage')
+    validate = importlib.import_module('06_validate')
+    export = importlib.import_module('08_export')
+    importlib.import_module('05_extract')
+    db = importlib.import_module('db')
+
+    def run_index():
+        index.index_pdfs()
+        db.init_db()
+        db.sync_from_index()
+
+    def load_config():
+        with open('run_config.yaml', 'r') as f:
+            return yaml.safe_load(f)
+
+    return {
+        'index': run_index,
+        'pages': pages_text.extract_pages_text,
+        'triage': triage.run_triage,
+        'retrieve': lambda: run_retrieval(load_config()),
+        'validate': validate.run_validate,
+        'export': lambda: export.run_export(full=True),
+    }
+
+def stage_latencies(run_id):
+    """p50/p95 per-doc wall time per stage from stage_metrics"""
+    telemetry = importlib.import_module('telemetry')
+    df = telemetry.load_metrics(run_id)
+    if df.empty:
+        return {}
+    docs = telemetry.per_doc(df.fillna({name: 0 for name in telemetry.COUNTERS}))
+    return {
+        stage: {'docs': len(group), 'pages': int(group['pages'].sum()),
+                'p50_s': float(group['wall_s'].quantile(0.5)), 'p95_s': float(group['wall_s'].quantile(0.95))}
+        for stage, group in docs.groupby('stage')
+    }
+
+def run_benchmark(workspace, corpus_params, workers):
+    corpus = prepare_workspace(workspace, corpus_params, workers)
+    workspace = os.path.abspath(workspace)
+    log_path = os.path.join(workspace, 'stages.log')
+    original_cwd = os.getcwd()
+    os.chdir(workspace)
+    try:
+        telemetry = importlib.import_module('telemetry')
+        runners = stage_runners()
+        stages = {}
+        with open(log_path, 'w') as log:
+            for stage in STAGES:
+                print(f"  {stage}...", end=' ', flush=True)
+                wall_start = time.perf_counter()
+                cpu_start = cpu_seconds()
+                # Stage output goes to stages.log so it doesn't drown the summary
+                with contextlib.redirect_stdout(log):
+                    runners[stage]()
+                    log.flush()
+                stages[stage] = {'wall_s': time.perf_counter() - wall_start, 'cpu_s': cpu_seconds() - cpu_start}
+                print(f"{stages[stage]['wall_s']:.2f}s")
+        telemetry.flush(timeout=30)
+        for stage, latency in stage_latencies(telemetry.RUN_ID).items():
+            if stage in stages:
+                stages[stage].update(latency)
+    finally:
+        os.chdir(original_cwd)
+
+    for result in stages.values():
+        if result.get('docs'):
+            result['docs_per_s'] = result['docs'] / result['wall_s']
+    return {
+        'run_id': telemetry.RUN_ID,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': {'cpus': os.cpu_count(), 'python': sys.version.split()[0]},
+        'workers': workers,
+        'corpus': corpus,
+        'stages': stages,
+    }
+
+def compare(results, baseline, tolerance, min_delta):
+    """Returns the stages that got slower than the baseline"""
+    if baseline['corpus'] != results['corpus'] or baseline.get('workers') != results.get('workers'):
+        print("WARNING: baseline was recorded with a different corpus or worker count; comparison is indicative only")
+    regressions = []
+    print(f"\n{'stage':<10}{'baseline_s':>12}{'now_s':>10}{'change':>10}")
+    for stage in STAGES:
+        now = results['stages'].get(stage, {}).get('wall_s')
+        before = baseline['stages'].get(stage, {}).get('wall_s')
+        if now is None or before is None:
+            continue
+        change = (now - before) / before if before > 0 else 0.0
+        regressed = now > before * (1 + tolerance) and now - before > min_delta
+        if regressed:
+            regressions.append(stage)
+        print(f"{stage:<10}{before:>12.2f}{now:>10.2f}{change:>+10.0%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Benchmark pipeline stages on a synthetic corpus")
+    parser.add_argument('--workspace', default='bench_workspace', help="Scratch directory (created; cleared on each run)")
+    parser.add_argument('--docs', type=int, default=100)
+    parser.add_argument('--pages', default='4-40', help="Page count range MIN-MAX")
+    parser.add_argument('--page-dist', choices=['skewed', 'uniform'], default='skewed')
+    parser.add_argument('--tables-per-page', type=float, default=0.3)
+    parser.add_argument('--keyword-density', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Pool size for every parallel stage")
+    parser.add_argument('--baseline', help="Baseline results JSON to compare against")
+    parser.add_argument('--save-baseline', help="Also write this run's results to this path")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed slowdown before flagging (0.2 = 20%%)")
+    parser.add_argument('--min-delta', type=float, default=0.25, help="Ignore slowdowns smaller than this many seconds")
+    args = parser.parse_args()
+
+    pages_min, pages_max = (int(x) for x in args.pages.split('-'))
+    corpus_params = {
+        'docs': args.docs, 'pages_min': pages_min, 'pages_max': pages_max, 'page_distribution': args.page_dist,
+        'tables_per_page': args.tables_per_page, 'keyword_density': args.keyword_density, 'seed': args.seed
+    }
+    results = run_benchmark(args.workspace, corpus_params, args.workers)
+
+    results_dir = os.path.join(args.workspace, 'results')
+    os.makedirs(results_dir, exist_ok=True)
+    results_path = os.path.join(results_dir, f"{results['run_id']}.json")
+    with open(results_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results: {results_path}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta)
+        if regressions:
+            print(f"\nRegressions: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nNo regressions.")
@@ -0,0 +1,91 @@
+"""Vectorized BM25 scoring of all query templates against one document.
+
+The page-term matrix (pages x query vocabulary) is read from the corpus
+index in one query, turned into BM25 term weights, and multiplied by the
+query matrix (queries x vocabulary) so every template is scored at once.
+
+Equivalence with the per-query scalar path (search_index.score_pages):
+unigram weights are identical, so with phrase_weight=0 every page score
+matches to within 1e-9 relative error (float summation order only) and the
+selected pages are the same. With phrase_weight > 0, pages containing a
+template's words as an adjacent phrase ("EN 16798") gain that phrase's
+bigram score on top, which can only reorder pages in favour of exact
+phrase matches. `python scripts/retriever.py --verify` checks this.
+"""
+import numpy as np
+import search_index
+
+def build_query_matrix(queries, phrase_weight):
+    """Returns (vocab, Q) where Q[q, t] weights term t in query q"""
+    vocab = {}
+    entries = []
+    for q, query in enumerate(queries):
+        tokens = search_index.tokenize(query)
+        for term in set(tokens):
+            entries.append((q, vocab.setdefault(term, len(vocab)), 1.0))
+        if phrase_weight:
+            for term in set(search_index.bigrams(tokens)):
+                entries.append((q, vocab.setdefault(term, len(vocab)), phrase_weight))
+
+    Q = np.zeros((len(queries), len(vocab)))
+    for q, t, weight in entries:
+        Q[q, t] = weight
+    return list(vocab), Q
+
+def load_weight_matrix(conn, doc_id, pages, vocab):
+    """BM25 term weights W[page, term] for the given page numbers and vocab"""
+    W = np.zeros((len(pages), len(vocab)))
+    if not vocab or not pages:
+        return W
+    c = conn.cursor()
+    n_pages, avgdl = search_index.corpus_stats(c)
+    row_of = {page: i for i, page in enumerate(pages)}
+    col_of = {term: j for j, term in enumerate(vocab)}
+    placeholders = ",".join("?" * len(vocab))
+
+    idf = np.zeros(len(vocab))
+    c.execute(f"SELECT term, df FROM terms WHERE term IN ({placeholders})", vocab)
+    for term, df in c.fetchall():
+        idf[col_of[term]] = search_index.idf(n_pages, df)
+
+    lengths = np.zeros(len(pages))
+    c.execute("SELECT page, length FROM pages WHERE doc_id = ?", (doc_id,))
+    for page, length in c.fetchall():
+        if page in row_of:
+            lengths[row_of[page]] = length
+
+    TF = np.zeros((len(pages), len(vocab)))
+    c.execute(f"SELECT term, page, tf FROM postings WHERE term IN ({placeholders}) AND doc_id = ?",
+              vocab + [doc_id])
+    for term, page, tf in c.fetchall():
+        if page in row_of:
+            TF[row_of[page], col_of[term]] = tf
+
+    k1, b = search_index.BM25_K1, search_index.BM25_B
+    norm = k1 * (1 - b + b * lengths / avgdl) if avgdl else np.full(len(pages), k1)
+    W = idf * TF * (k1 + 1) / (TF + norm[:, None])
+    return W
+
+def score_queries(conn, doc_id, pages, queries, phrase_weight=1.0):
+    """Returns S[page, query]: every query template scored against every page"""
+    vocab, Q = build_query_matrix(queries, phrase_weight)
+    W = load_weight_matrix(conn, doc_id, pages, vocab)
+    return W @ Q.T
+
+def top_k_indices(scores, k):
+    """Indices of the k best scores, best first; ties resolved by lowest index.
+
+    Matches a stable descending sort, but only partitions instead of sorting
+    every page.
+    """
+    n = len(scores)
+    if n == 0 or k <= 0:
+        return np.array([], dtype=int)
+    if k >= n:
+        chosen = np.arange(n)
+    else:
+        threshold = scores[np.argpartition(-scores, k - 1)[:k]].min()
+        above = np.flatnonzero(scores > threshold)
+        ties = np.flatnonzero(scores == threshold)[:k - len(above)]
+        chosen = np.concatenate([above, ties])
+    return chosen[np.lexsort((chosen, -scores[chosen]))]
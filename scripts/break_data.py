@@ -11,8 +11,10 @@ def break_data():
     if data['measurements']:
         data['measurements'][0]['comparison_id'] = "INVALID_ID_999"
         
-    with open(path, 'w') as f:
+    # Replace rather than rewrite: a validated copy may be a hardlink to this file
+    with open(path + '.tmp', 'w') as f:
         json.dump(data, f)
+    os.replace(path + '.tmp', path)
         
     # Reset status so validator picks it up
     conn = sqlite3.connect('state.sqlite')
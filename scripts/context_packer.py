@@ -0,0 +1,129 @@
+"""Packs retrieved pages into the extraction prompt's context.
+
+Header and footer lines repeated on many pages of a doc (running titles,
+journal banners, author lines; page numbers ignored) and copyright lines
+are stripped, whitespace is collapsed and reference lists are dropped. The
+best-scoring pages are then added until extraction.context_token_budget is
+used, within rag.min_pages and the lower of rag.max_pages and
+extraction.max_input_pages. Packed pages are emitted in reading order.
+"""
+import os
+import re
+import json
+import time
+from collections import Counter
+from page_store import load_pages
+
+CHARS_PER_TOKEN = 4
+# Only the first/last lines of a page can be running headers or footers, so
+# repeated table rows or captions in the body are never stripped
+EDGE_LINES = 3
+
+DIGITS_RE = re.compile(r"\d+")
+SPACES_RE = re.compile(r"[ \t ]+")
+COPYRIGHT_RE = re.compile(r"©|\(c\)\s*\d{4}|copyright|all rights reserved", re.IGNORECASE)
+REFERENCES_HEADING_RE = re.compile(r"^\s*(\d+\.?\s*)?(references|bibliography|literature cited)\s*$", re.IGNORECASE)
+CITATION_LINE_RE = re.compile(r"^\s*(\[\d+\]|\d+\.\s)|et al\.|doi\.org|doi:", re.IGNORECASE)
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def normalize_line(line):
+    """Comparison key for a line: page numbers and spacing don't matter"""
+    return DIGITS_RE.sub('#', SPACES_RE.sub(' ', line.strip().lower()))
+
+def find_boilerplate(pages, min_fraction=0.5, min_pages=3):
+    """Normalized lines that occur on at least min_fraction of the doc's pages"""
+    if len(pages) < min_pages:
+        return set()
+    counts = Counter()
+    for p in pages:
+        lines = [line for line in p['text'].splitlines() if line.strip()]
+        edges = lines[:EDGE_LINES] + lines[-EDGE_LINES:]
+        counts.update({normalize_line(line) for line in edges})
+    threshold = max(min_pages, min_fraction * len(pages))
+    return {line for line, n in counts.items() if n >= threshold and sum(ch.isalpha() for ch in line) >= 4}
+
+def clean_page(text, boilerplate):
+    lines = [SPACES_RE.sub(' ', line).strip() for line in text.splitlines()]
+    lines = [line for line in lines if line]
+    kept = []
+    for i, line in enumerate(lines):
+        at_edge = i < EDGE_LINES or i >= len(lines) - EDGE_LINES
+        if at_edge and normalize_line(line) in boilerplate:
+            continue
+        if len(line) < 200 and COPYRIGHT_RE.search(line):
+            continue
+        kept.append(line)
+    return "\n".join(kept)
+
+def strip_references(text):
+    """Returns (text before a references heading, whether the rest is a reference list)"""
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        if REFERENCES_HEADING_RE.match(line):
+            return "\n".join(lines[:i]), True
+    if len(lines) >= 5 and sum(1 for line in lines if CITATION_LINE_RE.search(line)) >= 0.6 * len(lines):
+        return "", True
+    return text, False
+
+def pack_context(doc_id, scored_pages, config):
+    """Returns (context_text, stats) for the pages retrieve_pages selected"""
+    rag_config = config.get('rag', {})
+    extraction_config = config.get('extraction', {})
+    budget = extraction_config.get('context_token_budget', 12000)
+    min_pages = rag_config.get('min_pages', 1)
+    max_pages = min(rag_config.get('max_pages', 20), extraction_config.get('max_input_pages', 20))
+
+    all_pages = load_pages(doc_id)
+    boilerplate = find_boilerplate(all_pages)
+    raw_chars = sum(len(p['text']) for p in scored_pages)
+
+    # Best first; unscored pages of the doc only top up to min_pages
+    candidates = sorted(scored_pages, key=lambda p: -p.get('score', 0.0))
+    chosen_numbers = {p['page'] for p in candidates}
+    candidates += [p for p in all_pages if p['page'] not in chosen_numbers]
+
+    packed = []
+    used = 0
+    reference_pages = []
+    for i, p in enumerate(candidates):
+        if len(packed) >= max_pages:
+            break
+        if i >= len(scored_pages) and len(packed) >= min_pages:
+            break
+        text, is_references = strip_references(clean_page(p['text'], boilerplate))
+        if is_references:
+            reference_pages.append(p['page'])
+        if not text:
+            continue
+        tokens = estimate_tokens(text)
+        if used + tokens > budget:
+            if len(packed) >= min_pages or used >= budget:
+                continue
+            # Below min_pages: keep the head of the page rather than nothing
+            text = text[:(budget - used) * CHARS_PER_TOKEN]
+            tokens = estimate_tokens(text)
+        packed.append({'page': p['page'], 'text': text, 'score': p.get('score', 0.0)})
+        used += tokens
+
+    packed.sort(key=lambda p: p['page'])
+    context_text = "\n---\n".join(f"Page {p['page']}:\n{p['text']}" for p in packed)
+    stats = {
+        'doc_id': doc_id,
+        'pages_retrieved': len(scored_pages),
+        'pages_packed': [p['page'] for p in packed],
+        'reference_pages': reference_pages,
+        'boilerplate_lines': len(boilerplate),
+        'raw_chars': raw_chars,
+        'context_chars': len(context_text),
+        'context_tokens_est': estimate_tokens(context_text),
+        'token_budget': budget
+    }
+    return context_text, stats
+
+def save_prompt_stats(doc_id, stats):
+    snippets_dir = os.path.join('snippets', doc_id)
+    os.makedirs(snippets_dir, exist_ok=True)
+    with open(os.path.join(snippets_dir, 'prompt_stats.json'), 'w') as f:
+        json.dump(dict(stats, timestamp=time.time()), f, indent=2)
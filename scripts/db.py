@@ -4,12 +4,15 @@ import pandas as pd
 
 DB_PATH = 'state.sqlite'
 
-def get_connection():
-    return sqlite3.connect(DB_PATH)
+def get_connection(check_same_thread=True):
+    # Several pipeline workers and the UI share the file; wait out short write locks
+    return sqlite3.connect(DB_PATH, timeout=30, check_same_thread=check_same_thread)
 
 def init_db():
     conn = get_connection()
     c = conn.cursor()
+    # WAL lets readers (UI, other workers) proceed while one process writes
+    c.execute("PRAGMA journal_mode=WAL")
     # Table docs based on Section 5.1
     c.execute('''
         CREATE TABLE IF NOT EXISTS docs (
@@ -22,9 +25,41 @@ def init_db():
             triage_label TEXT,
             needs_images INTEGER DEFAULT 0,
             lock_owner TEXT,
-            lock_ts DATETIME
+            lock_ts DATETIME,
+            attempts INTEGER DEFAULT 0
         )
     ''')
+    # Databases created before the worker existed lack the retry counter
+    c.execute("PRAGMA table_info(docs)")
+    if 'attempts' not in [row[1] for row in c.fetchall()]:
+        c.execute("ALTER TABLE docs ADD COLUMN attempts INTEGER DEFAULT 0")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_docs_status ON docs(status)")
+
+    # Append-only change feed. Triggers log every status transition whichever
+    # script makes it; SQLite has one writer at a time, so events commit in
+    # seq order and a reader only needs the last seq it has seen
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS doc_events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            doc_id TEXT NOT NULL,
+            old_status TEXT,
+            new_status TEXT,
+            ts DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS docs_status_inserted AFTER INSERT ON docs
+        BEGIN
+            INSERT INTO doc_events (doc_id, old_status, new_status) VALUES (NEW.doc_id, NULL, NEW.status);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS docs_status_updated AFTER UPDATE OF status ON docs
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            INSERT INTO doc_events (doc_id, old_status, new_status) VALUES (NEW.doc_id, OLD.status, NEW.status);
+        END
+    ''')
     conn.commit()
     conn.close()
 
@@ -38,18 +73,136 @@ def sync_from_index():
     c = conn.cursor()
     
     for _, row in df.iterrows():
-        doc_id = row['doc_id']
-        path = row['pdf_path']
-        
-        # Check if exists
-        c.execute("SELECT doc_id FROM docs WHERE doc_id = ?", (doc_id,))
-        if not c.fetchone():
-            c.execute("INSERT INTO docs (doc_id, pdf_path, status) VALUES (?, ?, ?)", 
-                      (doc_id, path, 'indexed'))
+        sync_doc(c, row['doc_id'], row['pdf_path'])
     
     conn.commit()
     conn.close()
 
+def sync_doc(c, doc_id, path):
+    """Inserts one indexed doc, or follows it to its new path; returns its status"""
+    # Check if exists
+    c.execute("SELECT pdf_path, status FROM docs WHERE doc_id = ?", (doc_id,))
+    existing = c.fetchone()
+    if not existing:
+        c.execute("INSERT INTO docs (doc_id, pdf_path, status) VALUES (?, ?, ?)", 
+                  (doc_id, path, 'indexed'))
+        return 'indexed'
+    if existing[0] != path:
+        # File was moved or renamed; content (and doc_id) unchanged
+        c.execute("UPDATE docs SET pdf_path = ? WHERE doc_id = ?", (path, doc_id))
+    return existing[1]
+
+def claim_next_doc(owner, statuses, lease_seconds, doc_id=None):
+    """Atomically leases the oldest doc in one of statuses (or doc_id only).
+
+    A doc is claimable when unlocked or when its lease is older than
+    lease_seconds (its worker died or stalled). Returns (doc_id, pdf_path,
+    status) or None.
+    """
+    conn = get_connection()
+    conn.isolation_level = None
+    c = conn.cursor()
+    placeholders = ",".join("?" * len(statuses))
+    doc_filter = "AND doc_id = ?" if doc_id else ""
+    params = (*statuses, f"-{int(lease_seconds)} seconds") + ((doc_id,) if doc_id else ())
+    try:
+        # IMMEDIATE takes the write lock up front, so two workers can never
+        # select the same row before either has marked it
+        c.execute("BEGIN IMMEDIATE")
+        c.execute(f'''
+            SELECT doc_id, pdf_path, status FROM docs
+            WHERE status IN ({placeholders})
+              AND (lock_owner IS NULL OR lock_ts < datetime('now', ?))
+              {doc_filter}
+            ORDER BY updated_at, doc_id
+            LIMIT 1
+        ''', params)
+        row = c.fetchone()
+        if row:
+            c.execute("UPDATE docs SET lock_owner = ?, lock_ts = CURRENT_TIMESTAMP WHERE doc_id = ?",
+                      (owner, row[0]))
+        c.execute("COMMIT")
+    except Exception:
+        c.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return row
+
+def renew_lease(doc_id, owner):
+    """Extends a held lease; returns False if the lease was lost"""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("UPDATE docs SET lock_ts = CURRENT_TIMESTAMP WHERE doc_id = ? AND lock_owner = ?",
+              (doc_id, owner))
+    conn.commit()
+    conn.close()
+    return c.rowcount == 1
+
+def complete_lease(doc_id, owner, status=None, notes=None, **fields):
+    """Releases a lease, optionally moving the doc to status.
+
+    Only applies if owner still holds the lease; returns False otherwise.
+    """
+    assignments = ["lock_owner = NULL", "lock_ts = NULL", "attempts = 0", "updated_at = CURRENT_TIMESTAMP"]
+    values = []
+    if status is not None:
+        assignments.append("status = ?")
+        values.append(status)
+    if notes is not None:
+        assignments.append("notes = ?")
+        values.append(notes)
+    for column, value in fields.items():
+        assignments.append(f"{column} = ?")
+        values.append(value)
+
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(f"UPDATE docs SET {', '.join(assignments)} WHERE doc_id = ? AND lock_owner = ?",
+              (*values, doc_id, owner))
+    conn.commit()
+    conn.close()
+    return c.rowcount == 1
+
+def fail_lease(doc_id, owner, notes, max_attempts, failed_status='failed'):
+    """Records a failed attempt on a leased doc.
+
+    The lease is kept, so the doc is retried only after it expires. Once
+    max_attempts is reached the doc is parked in failed_status instead.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        UPDATE docs SET attempts = COALESCE(attempts, 0) + 1, notes = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE doc_id = ? AND lock_owner = ?
+    ''', (notes, doc_id, owner))
+    c.execute('''
+        UPDATE docs SET status = ?, lock_owner = NULL, lock_ts = NULL
+        WHERE doc_id = ? AND lock_owner = ? AND attempts >= ?
+    ''', (failed_status, doc_id, owner, max_attempts))
+    parked = c.rowcount == 1
+    conn.commit()
+    conn.close()
+    return parked
+
+def count_docs(statuses):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(f"SELECT COUNT(*) FROM docs WHERE status IN ({','.join('?' * len(statuses))})", tuple(statuses))
+    count = c.fetchone()[0]
+    conn.close()
+    return count
+
+def latest_event_seq(c):
+    c.execute("SELECT COALESCE(MAX(seq), 0) FROM doc_events")
+    return c.fetchone()[0]
+
+def fetch_events(c, after_seq, limit=1000):
+    """Status transitions after after_seq, oldest first: [(seq, doc_id, old_status, new_status, ts)]"""
+    c.execute("SELECT seq, doc_id, old_status, new_status, ts FROM doc_events WHERE seq > ? ORDER BY seq LIMIT ?",
+              (after_seq, limit))
+    return c.fetchall()
+
 if __name__ == "__main__":
     init_db()
     sync_from_index()
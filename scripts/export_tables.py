@@ -0,0 +1,263 @@
+"""Typed export tables (PRD RF-10, annex B) and per-doc flattening.
+
+TABLES maps each export table to its Arrow schema; flatten_doc turns one
+extraction into rows for every table, applying the derivation rules of
+annex B.1 (raw_diff, eligible_primary, time_window_priority_rank,
+variance defaults) and B.4 (delta_u_W_m2K).
+"""
+import json
+import pyarrow as pa
+
+ELIGIBLE_COMPARATORS = {'controlled_simulation_same_model', 'before_after_same_building_controlled'}
+ELIGIBLE_BOUNDARY_LEVELS = {'high', 'medium'}
+TIME_WINDOW_PRIORITY = {'heatwave_window': 1, 'seasonal_summer': 2, 'annual': 3, 'other': 4}
+
+IDS = [('project_id', pa.string()), ('reference_id', pa.string()), ('doc_id', pa.string())]
+EVIDENCE = [('evidence_page', pa.int64()), ('evidence_quote', pa.string()), ('evidence_bbox_json', pa.string())]
+STUDY_BUILDING = [
+    ('study_type', pa.string()), ('study_design', pa.string()),
+    ('building_type', pa.string()), ('building_subtype', pa.string()),
+    ('location_country', pa.string()), ('location_city', pa.string()),
+    ('climate_class', pa.string()), ('hvac_status', pa.string()),
+]
+SCENARIO = [
+    ('scenario_label', pa.string()), ('heat_context', pa.string()),
+    ('weather_source', pa.string()), ('year_context', pa.string()),
+    ('time_window_type', pa.string()), ('time_window_definition', pa.string()),
+    ('occupied_hours_rule', pa.string()),
+]
+CONDITION = [('condition_id', pa.string()), ('condition_role', pa.string()), ('package_label', pa.string())]
+OPERATION_PROFILE = [
+    ('ventilation_type', pa.string()), ('ventilation_rate', pa.float64()),
+    ('ventilation_rate_unit', pa.string()), ('infiltration_rate_ach', pa.float64()),
+    ('setpoint_cooling_C', pa.float64()), ('window_opening_rule', pa.string()),
+    ('internal_gains', pa.float64()), ('internal_gains_unit', pa.string()),
+    ('occupancy_profile', pa.string()),
+]
+
+TABLES = {
+    'unified_outcomes': pa.schema(IDS + [
+        ('unit_id', pa.string()), ('scenario_id', pa.string()),
+        ('baseline_condition_id', pa.string()), ('retrofit_condition_id', pa.string()),
+        ('comparison_id', pa.string()),
+    ] + STUDY_BUILDING + [('zone_definition', pa.string())] + SCENARIO + [
+        ('time_window_priority_rank', pa.int64()),
+        ('comparator_type', pa.string()), ('boundary_match_level', pa.string()),
+        ('eligible_primary', pa.bool_()),
+        ('outcome_family', pa.string()), ('aggregation_period', pa.string()),
+        ('baseline_value', pa.float64()), ('retrofit_value', pa.float64()),
+        ('unit', pa.string()), ('raw_diff', pa.float64()),
+        ('variance_type', pa.string()), ('variance_value', pa.float64()), ('variance_n', pa.int64()),
+        ('numeric_source_quality', pa.string()), ('is_primary', pa.bool_()),
+        ('primary_rule_applied', pa.string()),
+        ('metric_A', pa.string()), ('comfort_standard', pa.string()), ('threshold_definition', pa.string()),
+        ('temp_metric', pa.string()), ('statistic', pa.string()),
+    ] + EVIDENCE),
+    'comparisons': pa.schema(IDS + [
+        ('comparison_id', pa.string()), ('unit_id', pa.string()), ('scenario_id', pa.string()),
+        ('baseline_condition_id', pa.string()), ('retrofit_condition_id', pa.string()),
+    ] + STUDY_BUILDING + SCENARIO + [
+        ('comparator_type', pa.string()), ('boundary_match_level', pa.string()),
+        ('boundary_notes', pa.string()), ('eligible_primary', pa.bool_()),
+    ]),
+    'references': pa.schema(IDS + [
+        ('title', pa.string()), ('year', pa.int64()), ('doi', pa.string()),
+        ('doc_type', pa.string()), ('source_db', pa.string()), ('pdf_path', pa.string()),
+        ('match_confidence', pa.float64()), ('needs_manual_match', pa.bool_()),
+    ]),
+    'envelope_components': pa.schema(IDS + CONDITION + [
+        ('component_type', pa.string()), ('u_value_W_m2K', pa.float64()),
+        ('shgc_or_g_value', pa.float64()), ('wwr', pa.float64()), ('notes', pa.string()),
+    ] + EVIDENCE + [('delta_u_W_m2K', pa.float64())]),
+    'operation_profiles': pa.schema(IDS + CONDITION + OPERATION_PROFILE + EVIDENCE),
+}
+
+def evidence_columns(evidence):
+    evidence = evidence or {}
+    bbox = evidence.get('bbox')
+    return {
+        'evidence_page': evidence.get('page'),
+        'evidence_quote': evidence.get('quote'),
+        'evidence_bbox_json': json.dumps(bbox, sort_keys=True) if bbox else None,
+    }
+
+def study_building_columns(data):
+    study = data.get('study', {})
+    building = data.get('building', {})
+    return {
+        'study_type': study.get('study_type'),
+        'study_design': study.get('study_design'),
+        'building_type': building.get('building_type'),
+        'building_subtype': building.get('building_subtype'),
+        'location_country': building.get('location_country'),
+        'location_city': building.get('location_city'),
+        'climate_class': building.get('climate_class'),
+        'hvac_status': building.get('hvac_status'),
+    }
+
+def scenario_columns(scenario):
+    window = scenario.get('time_window', {})
+    return {
+        'scenario_label': scenario.get('scenario_label'),
+        'heat_context': scenario.get('heat_context'),
+        'weather_source': scenario.get('weather_source'),
+        'year_context': scenario.get('year_context'),
+        'time_window_type': window.get('time_window_type'),
+        'time_window_definition': window.get('definition'),
+        'occupied_hours_rule': window.get('occupied_hours_rule'),
+    }
+
+def eligible_primary(comparison):
+    # B.1.1
+    return (comparison.get('comparator_type') in ELIGIBLE_COMPARATORS
+            and comparison.get('boundary_match_level') in ELIGIBLE_BOUNDARY_LEVELS)
+
+def raw_diff(baseline_value, retrofit_value):
+    # B.1.2: negative = improvement
+    if baseline_value is None or retrofit_value is None:
+        return None
+    return retrofit_value - baseline_value
+
+def delta_u_by_component(data, conditions):
+    """{(retrofit condition_id, component_type): u_retrofit - u_baseline} (B.4)
+
+    Pairs come from comparisons[]; a component type is only matched when
+    each side has exactly one component of that type with a U-value, and a
+    retrofit condition compared against several baselines gets no delta.
+    """
+    def u_values(condition_id):
+        by_type = {}
+        for component in conditions.get(condition_id, {}).get('envelope_components', []):
+            by_type.setdefault(component.get('component_type'), []).append(component.get('u_value_W_m2K'))
+        return {t: values[0] for t, values in by_type.items() if len(values) == 1 and values[0] is not None}
+
+    baselines = {}
+    for comparison in data.get('comparisons', []):
+        baselines.setdefault(comparison.get('retrofit_condition_id'), set()).add(comparison.get('baseline_condition_id'))
+
+    deltas = {}
+    for retrofit_id, baseline_ids in baselines.items():
+        if len(baseline_ids) != 1:
+            continue
+        baseline_u = u_values(next(iter(baseline_ids)))
+        for component_type, u in u_values(retrofit_id).items():
+            if component_type in baseline_u:
+                deltas[(retrofit_id, component_type)] = u - baseline_u[component_type]
+    return deltas
+
+def flatten_doc(doc_id, data, index_row=None, reference=None):
+    """Returns {table name: [row dict]} for one extraction"""
+    ids = {'project_id': data.get('project_id'), 'reference_id': data.get('reference_id'), 'doc_id': doc_id}
+    study_building = study_building_columns(data)
+    scenarios = {s.get('scenario_id'): s for s in data.get('scenarios', [])}
+    conditions = {c.get('condition_id'): c for c in data.get('conditions', [])}
+    comparisons = {k.get('comparison_id'): k for k in data.get('comparisons', [])}
+    rows = {name: [] for name in TABLES}
+
+    for k in data.get('comparisons', []):
+        rows['comparisons'].append({
+            **ids,
+            'comparison_id': k.get('comparison_id'),
+            'unit_id': k.get('unit_id'),
+            'scenario_id': k.get('scenario_id'),
+            'baseline_condition_id': k.get('baseline_condition_id'),
+            'retrofit_condition_id': k.get('retrofit_condition_id'),
+            **study_building,
+            **scenario_columns(scenarios.get(k.get('scenario_id'), {})),
+            'comparator_type': k.get('comparator_type'),
+            'boundary_match_level': k.get('boundary_match_level'),
+            'boundary_notes': k.get('boundary_notes'),
+            'eligible_primary': eligible_primary(k),
+        })
+
+    for m in data.get('measurements', []):
+        k = comparisons.get(m.get('comparison_id'), {})
+        scenario = scenarios.get(k.get('scenario_id'), {})
+        window_type = scenario.get('time_window', {}).get('time_window_type')
+        variance = m.get('variance') or {}
+        variance_type = variance.get('type') or 'none'
+        family = m.get('outcome_family')
+        rows['unified_outcomes'].append({
+            **ids,
+            'unit_id': k.get('unit_id'),
+            'scenario_id': k.get('scenario_id'),
+            'baseline_condition_id': k.get('baseline_condition_id'),
+            'retrofit_condition_id': k.get('retrofit_condition_id'),
+            'comparison_id': m.get('comparison_id'),
+            **study_building,
+            'zone_definition': m.get('zone_definition') or data.get('building', {}).get('zone_definition'),
+            **scenario_columns(scenario),
+            'time_window_priority_rank': TIME_WINDOW_PRIORITY.get(window_type),
+            'comparator_type': k.get('comparator_type'),
+            'boundary_match_level': k.get('boundary_match_level'),
+            'eligible_primary': eligible_primary(k),
+            'outcome_family': family,
+            'aggregation_period': m.get('aggregation_period'),
+            'baseline_value': m.get('baseline_value'),
+            'retrofit_value': m.get('retrofit_value'),
+            'unit': m.get('unit'),
+            'raw_diff': raw_diff(m.get('baseline_value'), m.get('retrofit_value')),
+            # B.1.3: never impute
+            'variance_type': variance_type,
+            'variance_value': variance.get('value') if variance_type != 'none' else None,
+            'variance_n': variance.get('n'),
+            'numeric_source_quality': m.get('numeric_source_quality'),
+            'is_primary': m.get('is_primary'),
+            'primary_rule_applied': m.get('primary_rule_applied'),
+            'metric_A': m.get('metric_A') if family == 'A' else None,
+            'comfort_standard': m.get('comfort_standard') if family == 'A' else None,
+            'threshold_definition': m.get('threshold_definition') if family == 'A' else None,
+            'temp_metric': m.get('temp_metric') if family == 'B' else None,
+            'statistic': m.get('statistic') if family == 'B' else None,
+            **evidence_columns(m.get('evidence')),
+        })
+
+    deltas = delta_u_by_component(data, conditions)
+    for c in data.get('conditions', []):
+        condition = {
+            'condition_id': c.get('condition_id'),
+            'condition_role': c.get('condition_role'),
+            'package_label': c.get('package_label'),
+        }
+        for component in c.get('envelope_components', []):
+            rows['envelope_components'].append({
+                **ids,
+                **condition,
+                'component_type': component.get('component_type'),
+                'u_value_W_m2K': component.get('u_value_W_m2K'),
+                'shgc_or_g_value': component.get('shgc_or_g_value'),
+                'wwr': component.get('wwr'),
+                'notes': component.get('notes'),
+                **evidence_columns(component.get('evidence')),
+                'delta_u_W_m2K': deltas.get((c.get('condition_id'), component.get('component_type'))),
+            })
+        profile = c.get('operation_profile')
+        if profile:
+            rows['operation_profiles'].append({
+                **ids,
+                **condition,
+                **{name: profile.get(name) for name, _ in OPERATION_PROFILE},
+                **evidence_columns(profile.get('evidence')),
+            })
+
+    index_row = index_row or {}
+    reference = reference or {}
+    rows['references'].append({
+        'project_id': ids['project_id'],
+        'reference_id': ids['reference_id'],
+        'doc_id': doc_id,
+        'title': reference.get('title'),
+        'year': reference.get('year'),
+        'doi': reference.get('doi'),
+        'doc_type': reference.get('doc_type'),
+        'source_db': reference.get('source_db'),
+        'pdf_path': index_row.get('pdf_path'),
+        'match_confidence': index_row.get('match_confidence'),
+        'needs_manual_match': index_row.get('needs_manual_match'),
+    })
+    return rows
+
+def doc_tables(doc_id, data, index_row=None, reference=None):
+    """flatten_doc as typed Arrow tables; raises if a value doesn't fit its column type"""
+    rows = flatten_doc(doc_id, data, index_row, reference)
+    return {name: pa.Table.from_pylist(rows[name], schema=schema) for name, schema in TABLES.items()}
@@ -1,7 +1,22 @@
 import os
+import json
+import random
+import argparse
 import pandas as pd
 from fpdf import FPDF
 
+# Vocabulary for synthetic papers. Keyword terms are the ones 04_triage.py
+# and the rag.query_templates look for; filler sentences match neither.
+INTERVENTION_TERMS = ['retrofit', 'refurbishment', 'passive cooling', 'shading', 'cool roof',
+                      'green roof', 'insulation', 'natural ventilation', 'PCM']
+OUTCOME_TERMS = ['overheating hours', 'operative temperature', 'indoor temperature',
+                 'degree-hours', 'TM52', 'ASHRAE 55', 'EN 16798']
+FILLER_WORDS = ['the', 'building', 'model', 'case', 'study', 'analysis', 'data', 'period', 'results',
+                'were', 'measured', 'calibrated', 'during', 'occupants', 'zone', 'simulation', 'weather',
+                'file', 'climate', 'urban', 'dwelling', 'sample', 'values', 'observed', 'compared', 'with']
+TABLE_COLUMNS = ['Condition', 'U-value (W/m2K)', 'Overheating (h)', 'Tmax (C)']
+JOURNALS = ['Energy & Buildings', 'Building and Environment', 'Renewable Energy', 'Applied Energy']
+
 def create_mock_manifest():
     data = {
         'DT': ['ARTICLE', 'ARTICLE', 'REVIEW'],
@@ -24,6 +39,100 @@ def create_mock_pdf(filename, content):
     pdf.output(os.path.join('pdfs', filename))
     print(f"Created pdfs/{filename}")
 
+class CorpusPDF(FPDF):
+    """Running header and footer on every page, like a journal article"""
+
+    def __init__(self, journal):
+        super().__init__()
+        self.journal = journal
+
+    def header(self):
+        self.set_font("Arial", size=8)
+        self.cell(0, 6, f"{self.journal} - Accepted manuscript", ln=1)
+
+    def footer(self):
+        self.set_y(-12)
+        self.set_font("Arial", size=8)
+        self.cell(0, 6, f"Page {self.page_no()}", align='C')
+
+def sample_page_count(rng, pages_min, pages_max, distribution):
+    if distribution == 'uniform':
+        return rng.randint(pages_min, pages_max)
+    # Skewed: most papers short, a long tail of long reports
+    median = pages_min + (pages_max - pages_min) / 4
+    return int(min(pages_max, max(pages_min, round(rng.lognormvariate(0, 0.6) * median))))
+
+def sentence(rng, keyword_density):
+    words = rng.sample(FILLER_WORDS, rng.randint(8, 14))
+    if rng.random() < keyword_density:
+        terms = INTERVENTION_TERMS if rng.random() < 0.5 else OUTCOME_TERMS
+        words.insert(rng.randrange(len(words)), rng.choice(terms))
+    return " ".join(words).capitalize() + "."
+
+def add_table(pdf, rng):
+    pdf.set_font("Arial", size=9)
+    width = 190 / len(TABLE_COLUMNS)
+    for column in TABLE_COLUMNS:
+        pdf.cell(width, 7, column, border=1)
+    pdf.ln()
+    for i in range(rng.randint(3, 6)):
+        row = ['Baseline' if i == 0 else f'Retrofit {i}',
+               f"{rng.uniform(0.2, 2.5):.2f}", str(rng.randint(20, 600)), f"{rng.uniform(24, 38):.1f}"]
+        for value in row:
+            pdf.cell(width, 7, value, border=1)
+        pdf.ln()
+    pdf.ln(4)
+    pdf.set_font("Arial", size=11)
+
+def create_corpus_pdf(path, rng, title, num_pages, tables_per_page, keyword_density):
+    pdf = CorpusPDF(rng.choice(JOURNALS))
+    pdf.set_auto_page_break(False)
+    for page in range(num_pages):
+        pdf.add_page()
+        pdf.set_font("Arial", size=11)
+        if page == 0:
+            pdf.multi_cell(0, 7, title)
+        # Tables per page: Poisson-like count with the given mean
+        num_tables = sum(1 for _ in range(4) if rng.random() < tables_per_page / 4)
+        for _ in range(num_tables):
+            add_table(pdf, rng)
+        paragraph = " ".join(sentence(rng, keyword_density) for _ in range(rng.randint(4, 8)))
+        while pdf.get_y() + 40 < pdf.h - 15:
+            pdf.multi_cell(0, 6, paragraph)
+            paragraph = " ".join(sentence(rng, keyword_density) for _ in range(rng.randint(4, 8)))
+    pdf.output(path)
+
+def generate_corpus(out_dir='pdfs', docs=100, pages_min=4, pages_max=40, page_distribution='skewed',
+                    tables_per_page=0.3, keyword_density=0.05, seed=0, manifest_path=None):
+    """Writes docs synthetic PDFs to out_dir; returns the corpus description.
+
+    keyword_density is the chance that a sentence carries an intervention or
+    outcome term, so low values leave some docs with nothing for triage.
+    The same seed always produces the same corpus.
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    titles = []
+    total_pages = 0
+    for i in range(docs):
+        title = f"Synthetic study {i:05d}: " + " ".join(rng.sample(FILLER_WORDS, 5))
+        num_pages = sample_page_count(rng, pages_min, pages_max, page_distribution)
+        create_corpus_pdf(os.path.join(out_dir, f"synthetic_{i:05d}.pdf"), rng, title,
+                          num_pages, tables_per_page, keyword_density)
+        titles.append(title)
+        total_pages += num_pages
+    if manifest_path:
+        pd.DataFrame({
+            'DT': ['ARTICLE'] * docs, 'TI': titles, 'AU': ['Synthetic, A.'] * docs,
+            'PY': [2020 + i % 5 for i in range(docs)], 'SO': ['Synthetic'] * docs,
+            'DI': [f'10.0000/synthetic.{i:05d}' for i in range(docs)]
+        }).to_excel(manifest_path, index=False)
+    return {
+        'docs': docs, 'pages_min': pages_min, 'pages_max': pages_max, 'page_distribution': page_distribution,
+        'tables_per_page': tables_per_page, 'keyword_density': keyword_density, 'seed': seed,
+        'total_pages': total_pages
+    }
+
 def main():
     create_mock_manifest()
     
@@ -58,4 +167,24 @@ def main():
     create_mock_pdf("Brown_2022.pdf", content3)
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Mock manifest and PDFs; with --docs, a synthetic corpus of any size")
+    parser.add_argument('--docs', type=int, help="Generate this many synthetic PDFs instead of the three samples")
+    parser.add_argument('--out-dir', default='pdfs')
+    parser.add_argument('--pages', default='4-40', help="Page count range MIN-MAX")
+    parser.add_argument('--page-dist', choices=['skewed', 'uniform'], default='skewed',
+                        help="skewed: mostly short docs with a long tail (default)")
+    parser.add_argument('--tables-per-page', type=float, default=0.3, help="Mean number of tables per page")
+    parser.add_argument('--keyword-density', type=float, default=0.05,
+                        help="Chance that a sentence has an intervention/outcome term")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.docs is None:
+        main()
+    else:
+        pages_min, pages_max = (int(x) for x in args.pages.split('-'))
+        corpus = generate_corpus(args.out_dir, args.docs, pages_min, pages_max, args.page_dist,
+                                 args.tables_per_page, args.keyword_density, args.seed,
+                                 manifest_path='manifest.xlsx')
+        print(f"Created {corpus['docs']} PDFs ({corpus['total_pages']} pages) in {args.out_dir}/")
+        print(json.dumps(corpus))
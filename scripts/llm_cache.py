@@ -0,0 +1,165 @@
+"""Disk-backed, content-addressed cache of model responses.
+
+Entries live in llm_cache/{key[:2]}/{key}.json where key hashes the model
+name, the prompt bytes and the schema. Writes are atomic renames and a
+per-key lock file (O_EXCL) makes concurrent threads or worker processes
+that ask for the same key wait for the first caller instead of sending a
+second request.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+
+def sha256_text(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def schema_hash(schema):
+    if schema is None:
+        return ''
+    return sha256_text(json.dumps(schema, sort_keys=True, separators=(',', ':')))
+
+def make_key(model_name, prompt, schema=None):
+    return sha256_text(f"{model_name}\n{sha256_text(prompt)}\n{schema_hash(schema)}")
+
+class ResponseCache:
+    def __init__(self, cache_dir='llm_cache', max_size_mb=500, max_age_days=30,
+                 bypass=False, lock_timeout_seconds=600):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.max_age_seconds = max_age_days * 86400
+        self.bypass = bypass
+        self.lock_timeout = lock_timeout_seconds
+
+    @classmethod
+    def from_config(cls, config, bypass=False):
+        cache_config = config.get('llm_cache', {})
+        if not cache_config.get('enabled', True):
+            return None
+        return cls(
+            cache_dir=cache_config.get('dir', 'llm_cache'),
+            max_size_mb=cache_config.get('max_size_mb', 500),
+            max_age_days=cache_config.get('max_age_days', 30),
+            bypass=bypass
+        )
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        path = self._entry_path(key)
+        try:
+            age = time.time() - os.path.getmtime(path)
+            if age > self.max_age_seconds:
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        # Hits refresh mtime, so age and size eviction are least-recently-used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another process after we read it; the response is still good
+            pass
+        return entry['response']
+
+    def put(self, key, response, model_name=None):
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'model': model_name, 'created_at': time.time(), 'response': response}, f)
+        os.replace(tmp_path, path)
+
+    def _try_lock(self, key):
+        lock_path = self._entry_path(key) + '.lock'
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.close(fd)
+            return True
+        except FileExistsError:
+            try:
+                # The owner died without releasing; take the lock over
+                if time.time() - os.path.getmtime(lock_path) > self.lock_timeout:
+                    os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+            return False
+
+    def _unlock(self, key):
+        try:
+            os.remove(self._entry_path(key) + '.lock')
+        except FileNotFoundError:
+            pass
+
+    def get_or_generate(self, key, generate, model_name=None, accept=None):
+        """Returns the cached response for key, calling generate() at most once per key.
+
+        Responses rejected by accept(response) are returned but not stored.
+        """
+        if self.bypass:
+            response = generate()
+            if accept is None or accept(response):
+                self.put(key, response, model_name)
+            return response
+
+        while True:
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+            if self._try_lock(key):
+                break
+            time.sleep(0.2)
+
+        try:
+            # Another holder may have finished between our miss and our lock
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+            response = generate()
+            if accept is None or accept(response):
+                self.put(key, response, model_name)
+            return response
+        finally:
+            self._unlock(key)
+
+    def evict(self):
+        """Drops expired entries, then least-recently-used ones above max size"""
+        if not os.path.exists(self.cache_dir):
+            return 0
+        now = time.time()
+        entries = []
+        removed = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if now - st.st_mtime > self.max_age_seconds:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        # Another process evicted it first
+                        continue
+                    removed += 1
+                else:
+                    entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
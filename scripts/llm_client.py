@@ -0,0 +1,138 @@
+"""Rate-limited, retrying wrapper around the Gemini SDK.
+
+Pipeline scripts talk to the model only through GeminiClient.generate, so
+throttling (rate_limits.requests_per_minute_soft), the cap on requests in
+flight (rate_limits.max_concurrent_requests) and backoff on 429/5xx are
+shared by every thread that extracts concurrently, including the nested
+measurement threads of staged extraction. Each process builds one client. When a ResponseCache is
+attached, identical (model, prompt, schema) requests are answered from disk.
+api_endpoint points the client at another server speaking the REST API,
+such as scripts/mock_gemini_server.py.
+"""
+import re
+import time
+import random
+import threading
+from llm_cache import make_key
+import telemetry
+
+try:
+    import google.generativeai as genai
+except ImportError:
+    genai = None
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+FENCE_RE = re.compile(r"^```[A-Za-z]*\s*(.*?)\s*```$", re.DOTALL)
+
+def strip_fences(text):
+    """Models often wrap JSON in a ``` or ```json fence despite the prompt"""
+    text = text.strip()
+    fenced = FENCE_RE.match(text)
+    return fenced.group(1) if fenced else text
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at rate_per_minute"""
+
+    def __init__(self, rate_per_minute, capacity=1):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def error_status(exc):
+    """HTTP status of an SDK error (google.api_core exceptions carry .code)"""
+    code = getattr(exc, 'code', None)
+    if isinstance(code, int):
+        return code
+    return None
+
+def is_retryable(exc):
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    return error_status(exc) in RETRYABLE_STATUS
+
+class GeminiClient:
+    def __init__(self, model_name, api_key, rate_limits, cache=None, api_endpoint=None):
+        if genai is None:
+            raise RuntimeError("google-generativeai is not installed")
+        if api_endpoint:
+            genai.configure(api_key=api_key, transport='rest', client_options={'api_endpoint': api_endpoint})
+        else:
+            genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+        self.bucket = TokenBucket(
+            rate_limits.get('requests_per_minute_soft', 30),
+            capacity=rate_limits.get('max_concurrent_requests', 2)
+        )
+        # The bucket only spaces out request starts; this bounds how many run at once
+        self.in_flight = threading.BoundedSemaphore(max(1, rate_limits.get('max_concurrent_requests', 2)))
+        self.max_retries = rate_limits.get('max_retries', 3)
+        self.backoff_base = rate_limits.get('backoff_base_seconds', 2)
+        self.backoff_max = rate_limits.get('backoff_max_seconds', 60)
+        self.cache = cache
+
+    def backoff_delay(self, attempt):
+        # Full jitter keeps concurrent workers from retrying in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def generate(self, prompt, schema=None, accept=None):
+        """Returns the response text, from the cache when the same request was already answered.
+
+        accept(text) decides whether a fresh response is worth caching
+        (e.g. only responses that parse as JSON).
+        """
+        if self.cache is None:
+            return self._generate_uncached(prompt)
+        key = make_key(self.model_name, prompt, schema)
+        called = []
+
+        def generate():
+            called.append(True)
+            return self._generate_uncached(prompt)
+
+        text = self.cache.get_or_generate(key, generate, self.model_name, accept=accept)
+        if not called:
+            telemetry.add(cache_hits=1)
+        return text
+
+    def _generate_uncached(self, prompt):
+        """Calls the model, retrying throttled or transient failures"""
+        for attempt in range(self.max_retries + 1):
+            # Set once the request is sent; a failure before that is no model call
+            started = None
+            try:
+                with self.in_flight:
+                    self.bucket.acquire()
+                    started = time.perf_counter()
+                    response = self.model.generate_content(prompt)
+                    text = response.text
+            except Exception as e:
+                if started is not None:
+                    telemetry.add(llm_calls=1, llm_latency_s=time.perf_counter() - started)
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                telemetry.add(retries=1)
+                delay = self.backoff_delay(attempt)
+                print(f"  Retryable error ({error_status(e) or type(e).__name__}), "
+                      f"retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            usage = getattr(response, 'usage_metadata', None)
+            telemetry.add(llm_calls=1, llm_latency_s=time.perf_counter() - started,
+                          prompt_tokens=getattr(usage, 'prompt_token_count', None),
+                          response_tokens=getattr(usage, 'candidates_token_count', None))
+            return text
@@ -0,0 +1,250 @@
+"""Local stand-in for the Gemini generateContent REST endpoint.
+
+Speaks the subset of the API the extractor uses:
+POST /v1beta/models/{model}:generateContent with a prompt in
+contents[].parts[].text. It answers with a mock extraction as
+candidates[0].content.parts[0].text, plus usageMetadata token counts.
+Behaviour is set in run_config.yaml (mock_server) or on the command line:
+- latency: fixed:S, uniform:MIN,MAX or lognormal:MEDIAN,SIGMA (seconds)
+- error_rate_429 / error_rate_5xx: injected RESOURCE_EXHAUSTED and 500/503
+- fenced_rate / truncated_rate: responses wrapped in ```json fences, or cut
+  short so they no longer parse
+- requests_per_minute: hard ceiling; requests over it get a 429, as a real
+  quota would
+
+Prompts starting with a MODE: line get an answer of that shape instead
+(repair_patch: an empty JSON Patch; skeleton: the mock extraction without
+measurements; measurements: one mock measurement per id on the
+COMPARISON_IDS line). Point the extractor at it with
+`05_extract.py --mock-server`. GET /stats returns the counters, which are
+also printed on exit.
+
+    python scripts/mock_gemini_server.py --latency lognormal:2,0.5 --rpm 60
+"""
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import importlib
+import threading
+from collections import Counter, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import yaml
+
+GENERATE_RE = re.compile(r"^/v1beta/models/([^/:]+):generateContent")
+MODE_RE = re.compile(r"^\s*MODE: (\w+)")
+COMPARISON_IDS_RE = re.compile(r"^COMPARISON_IDS: (.*)$", re.MULTILINE)
+ERRORS = {
+    429: ('RESOURCE_EXHAUSTED', 'Resource has been exhausted (e.g. check quota).'),
+    500: ('INTERNAL', 'An internal error has occurred.'),
+    503: ('UNAVAILABLE', 'The model is overloaded. Please try again later.'),
+}
+
+def load_config():
+    with open('run_config.yaml', 'r') as f:
+        return yaml.safe_load(f)
+
+def parse_latency(spec):
+    """'fixed:1.5', 'uniform:0.5,2' or 'lognormal:1.5,0.4' -> function(rng) -> seconds"""
+    kind, _, args = spec.partition(':')
+    values = [float(x) for x in args.split(',')] if args else []
+    if kind == 'fixed' and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == 'uniform' and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'lognormal' and len(values) == 2:
+        return lambda rng: values[0] * rng.lognormvariate(0, values[1])
+    raise ValueError(f"Bad latency spec '{spec}' (fixed:S, uniform:MIN,MAX or lognormal:MEDIAN,SIGMA)")
+
+class MockGemini:
+    def __init__(self, latency='fixed:1.0', error_rate_429=0.0, error_rate_5xx=0.0,
+                 fenced_rate=0.0, truncated_rate=0.0, requests_per_minute=None, seed=0):
+        self.latency = parse_latency(latency)
+        self.error_rate_429 = error_rate_429
+        self.error_rate_5xx = error_rate_5xx
+        self.fenced_rate = fenced_rate
+        self.truncated_rate = truncated_rate
+        self.requests_per_minute = requests_per_minute
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.window = deque()
+        self.stats = Counter()
+        self.latency_total = 0.0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        extract = importlib.import_module('05_extract')
+        self.mock_extraction = extract.get_mock_extraction
+
+    def admit(self):
+        """Sliding one-minute window of accepted requests"""
+        if not self.requests_per_minute:
+            return True
+        now = time.monotonic()
+        while self.window and now - self.window[0] >= 60:
+            self.window.popleft()
+        if len(self.window) >= self.requests_per_minute:
+            return False
+        self.window.append(now)
+        return True
+
+    def generate(self, model, request):
+        """Returns (http_status, payload, delay_seconds)"""
+        prompt = "".join(part.get('text', '') for content in request.get('contents', [])
+                         for part in content.get('parts', []))
+        with self.lock:
+            self.stats['requests'] += 1
+            delay = self.latency(self.rng)
+            roll = self.rng.random()
+            shape = self.rng.random()
+            cut = self.rng.uniform(0.2, 0.9)
+            # Injected failures are decided before admission, so they don't use up the RPM quota
+            if roll < self.error_rate_429:
+                self.stats['429_injected'] += 1
+                return 429, None, 0.0
+            if roll < self.error_rate_429 + self.error_rate_5xx:
+                self.stats['5xx'] += 1
+                # The server did some work before failing
+                return self.rng.choice([500, 503]), None, delay / 2
+            if not self.admit():
+                self.stats['429_rate_limit'] += 1
+                return 429, None, 0.0
+
+        text = self.answer(prompt)
+        kind = 'ok'
+        if shape < self.truncated_rate:
+            text = text[:int(len(text) * cut)]
+            kind = 'truncated'
+        elif shape < self.truncated_rate + self.fenced_rate:
+            text = f"```json\n{text}\n```"
+            kind = 'fenced'
+        payload = {
+            'candidates': [{
+                'content': {'parts': [{'text': text}], 'role': 'model'},
+                'finishReason': 'MAX_TOKENS' if kind == 'truncated' else 'STOP',
+                'index': 0
+            }],
+            'usageMetadata': {
+                'promptTokenCount': len(prompt) // 4,
+                'candidatesTokenCount': len(text) // 4,
+                'totalTokenCount': (len(prompt) + len(text)) // 4
+            },
+            'modelVersion': model
+        }
+        with self.lock:
+            self.stats[kind] += 1
+        return 200, payload, delay
+
+    def answer(self, prompt):
+        mode = MODE_RE.match(prompt)
+        mode = mode.group(1) if mode else None
+        if mode == 'repair_patch':
+            return "[]"
+        doc_id = f"mock-{hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]}"
+        extraction = self.mock_extraction(doc_id)
+        if mode == 'skeleton':
+            extraction.pop('measurements')
+        elif mode == 'measurements':
+            ids = COMPARISON_IDS_RE.search(prompt)
+            ids = [i.strip() for i in ids.group(1).split(',') if i.strip()] if ids else []
+            measurement = extraction['measurements'][0]
+            extraction = {'measurements': [dict(measurement, comparison_id=i) for i in ids]}
+        return json.dumps(extraction, indent=2)
+
+    def record(self, status, delay):
+        with self.lock:
+            if status == 200:
+                self.latency_total += delay
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            answered = stats.get('ok', 0) + stats.get('fenced', 0) + stats.get('truncated', 0)
+            stats['max_in_flight'] = self.max_in_flight
+            stats['mean_latency_s'] = round(self.latency_total / answered, 3) if answered else None
+        return stats
+
+def make_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=UTF-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.startswith('/stats'):
+                self.send_json(200, mock.snapshot())
+            else:
+                self.send_json(404, {'error': {'code': 404, 'message': 'Not found', 'status': 'NOT_FOUND'}})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            raw = self.rfile.read(length)
+            match = GENERATE_RE.match(self.path)
+            if not match:
+                self.send_json(404, {'error': {'code': 404, 'message': f'Unknown method {self.path}', 'status': 'NOT_FOUND'}})
+                return
+            try:
+                request = json.loads(raw or b'{}')
+            except ValueError:
+                self.send_json(400, {'error': {'code': 400, 'message': 'Invalid JSON payload', 'status': 'INVALID_ARGUMENT'}})
+                return
+
+            with mock.lock:
+                mock.in_flight += 1
+                mock.max_in_flight = max(mock.max_in_flight, mock.in_flight)
+            try:
+                status, payload, delay = mock.generate(match.group(1), request)
+                time.sleep(delay)
+                mock.record(status, delay)
+            finally:
+                with mock.lock:
+                    mock.in_flight -= 1
+
+            if status != 200:
+                code, message = ERRORS[status]
+                payload = {'error': {'code': status, 'message': message, 'status': code}}
+            self.send_json(status, payload)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+def serve(host, port, mock):
+    server = ThreadingHTTPServer((host, port), make_handler(mock))
+    server.daemon_threads = True
+    print(f"Mock Gemini listening on http://{host}:{port} (GET /stats for counters)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(mock.snapshot(), indent=2))
+
+if __name__ == "__main__":
+    server_config = load_config().get('mock_server', {})
+    parser = argparse.ArgumentParser(description="Local stand-in for the Gemini generateContent API")
+    parser.add_argument('--host', default=server_config.get('host', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=server_config.get('port', 8765))
+    parser.add_argument('--latency', default=server_config.get('latency', 'fixed:1.0'),
+                        help="fixed:S, uniform:MIN,MAX or lognormal:MEDIAN,SIGMA")
+    parser.add_argument('--error-rate-429', type=float, default=server_config.get('error_rate_429', 0.0))
+    parser.add_argument('--error-rate-5xx', type=float, default=server_config.get('error_rate_5xx', 0.0))
+    parser.add_argument('--fenced-rate', type=float, default=server_config.get('fenced_rate', 0.0))
+    parser.add_argument('--truncated-rate', type=float, default=server_config.get('truncated_rate', 0.0))
+    parser.add_argument('--rpm', type=int, default=server_config.get('requests_per_minute'),
+                        help="Requests per minute before answering 429")
+    parser.add_argument('--seed', type=int, default=server_config.get('seed', 0))
+    args = parser.parse_args()
+
+    mock = MockGemini(args.latency, args.error_rate_429, args.error_rate_5xx,
+                      args.fenced_rate, args.truncated_rate, args.rpm, args.seed)
+    serve(args.host, args.port, mock)
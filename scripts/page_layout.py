@@ -0,0 +1,97 @@
+"""Per-page layout cache, written by 03_pages_text.py in the same parse as the text.
+
+pages_text/{doc_id}/layout.jsonl holds one JSON line per page:
+{"page", "width", "height", "words": [[text, x0, top, x1, bottom], ...],
+"lines", "rects", "table_score"}. Coordinates are PDF points from the top
+left, rounded to 0.1. Like pages.idx, the file is append-only under the
+store lock and a later line for a page wins, so a page re-done after an
+interrupted run simply appends again (after the torn tail is cut off).
+Lines that don't decode are skipped.
+
+Anything needing words, boxes or table signals (image triggers, the review
+UI, table extraction) reads this instead of reopening the PDF. Docs paged
+before the cache existed have no layout.jsonl; readers get {}.
+"""
+import os
+import json
+import re
+from page_store import doc_dir_for, store_lock, truncate_torn_tail
+
+LAYOUT_FILE = 'layout.jsonl'
+NUMBER_PATTERN = re.compile(r"^[-+(]?\d[\d.,]*%?\)?$")
+# Points between words in one row that read as a column break
+COLUMN_GAP = 12
+
+def page_layout(page):
+    """Layout record for one pdfplumber page"""
+    words = [[w['text'], round(float(w['x0']), 1), round(float(w['top']), 1),
+              round(float(w['x1']), 1), round(float(w['bottom']), 1)] for w in page.extract_words()]
+    lines = len(page.lines)
+    rects = len(page.rects)
+    return {
+        'page': page.page_number - 1,
+        'width': round(float(page.width), 1),
+        'height': round(float(page.height), 1),
+        'words': words,
+        'lines': lines,
+        'rects': rects,
+        'table_score': table_score(words, lines, rects),
+    }
+
+def table_score(words, lines, rects):
+    """0-1 likelihood that a page holds a table.
+
+    Combines ruling (lines and cell rectangles), rows split into columns by
+    wide gaps (prose rows have single spaces) and the share of numeric words.
+    """
+    if not words:
+        return 0.0
+    ruling = min(1.0, (lines + rects) / 20)
+    rows = [row for row in word_rows({'words': words}) if len(row) > 1]
+    gapped = sum(1 for row in rows
+                 if sum(1 for a, b in zip(row, row[1:]) if b[1] - a[3] >= COLUMN_GAP) >= 2)
+    columns = min(1.0, 4 * gapped / len(rows)) if rows else 0.0
+    numeric = sum(1 for w in words if NUMBER_PATTERN.match(w[0])) / len(words)
+    return round(0.4 * ruling + 0.3 * columns + 0.3 * min(1.0, numeric * 3), 3)
+
+def append_layout(doc_dir, layout):
+    line = json.dumps(layout, separators=(',', ':')) + '\n'
+    path = os.path.join(doc_dir, LAYOUT_FILE)
+    with store_lock(doc_dir):
+        # A torn line left by a crash would end up mid-file
+        truncate_torn_tail(path)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+def load_layout(doc_id):
+    """Returns {page: layout}; {} if the doc has no layout cache"""
+    path = os.path.join(doc_dir_for(doc_id), LAYOUT_FILE)
+    if not os.path.exists(path):
+        return {}
+    layouts = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            # Torn last line from an interrupted run
+            if not line.endswith('\n'):
+                continue
+            try:
+                layout = json.loads(line)
+                layouts[layout['page']] = layout
+            except (ValueError, KeyError, TypeError):
+                # Damaged line (written before appends cut torn tails): that page has no layout
+                continue
+    return layouts
+
+def table_pages(doc_id, threshold):
+    """Pages whose table_score reaches threshold, in page order"""
+    return sorted(page for page, layout in load_layout(doc_id).items() if layout['table_score'] >= threshold)
+
+def word_rows(layout, tolerance=3.0):
+    """Words grouped into visual rows (top within tolerance points), each sorted left to right"""
+    rows = []
+    for word in sorted(layout['words'], key=lambda w: (w[2], w[1])):
+        if rows and abs(rows[-1][0][2] - word[2]) <= tolerance:
+            rows[-1].append(word)
+        else:
+            rows.append([word])
+    return [sorted(row, key=lambda w: w[1]) for row in rows]
@@ -0,0 +1,207 @@
+"""Packed per-document page store.
+
+Each doc keeps all its page text in pages_text/{doc_id}/pages.bin (UTF-8,
+concatenated) plus pages.idx, an append-only list of "page offset length"
+lines. Readers memory-map pages.bin and slice single pages or ranges without
+globbing the directory. The idx file doubles as the paging checkpoint: a page
+is done once its line is in the index. Before each append a writer cuts
+both files back to the last complete record, so a run resumed after a crash
+never builds on a torn write.
+"""
+import os
+import glob
+import mmap
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+PAGES_TEXT_DIR = 'pages_text'
+BIN_FILE = 'pages.bin'
+IDX_FILE = 'pages.idx'
+LOCK_FILE = 'pages.lock'
+STORE_FORMAT = 'packed-v1'
+
+def doc_dir_for(doc_id):
+    return os.path.join(PAGES_TEXT_DIR, doc_id)
+
+@contextmanager
+def store_lock(doc_dir):
+    """Exclusive cross-process lock held while appending to a doc store"""
+    with open(os.path.join(doc_dir, LOCK_FILE), 'a+') as f_lock:
+        if fcntl:
+            fcntl.flock(f_lock.fileno(), fcntl.LOCK_EX)
+        else:
+            f_lock.seek(0)
+            msvcrt.locking(f_lock.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f_lock.fileno(), fcntl.LOCK_UN)
+            else:
+                f_lock.seek(0)
+                msvcrt.locking(f_lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+def read_index(doc_dir):
+    """Returns {page: (offset, length)}; later entries for a page win"""
+    path = os.path.join(doc_dir, IDX_FILE)
+    if not os.path.exists(path):
+        return {}
+    index = {}
+    with open(path, 'r') as f:
+        for line in f:
+            # A line without newline is a torn write from an interrupted run
+            if not line.endswith('\n'):
+                continue
+            parts = line.split()
+            if len(parts) != 3:
+                continue
+            page, offset, length = (int(x) for x in parts)
+            index[page] = (offset, length)
+    return index
+
+def truncate_torn_tail(path):
+    """Cuts a line file back to its last newline; returns the last complete line (or None).
+
+    A run killed mid-write leaves a partial last line. Appending after it
+    would glue the next line on ("3" + "4 40 10" reads back as page 34),
+    so writers call this under the store lock before appending.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r+b') as f:
+        size = f.seek(0, os.SEEK_END)
+        pos, tail = size, b''
+        while pos > 0 and tail.count(b'\n') < 2:
+            step = min(4096, pos)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+        cut = tail.rfind(b'\n')
+        keep = pos + cut + 1
+        if keep < size:
+            f.truncate(keep)
+    if cut < 0:
+        return None
+    return tail[tail.rfind(b'\n', 0, cut) + 1:cut].decode('utf-8', errors='replace')
+
+def _record_end(line):
+    """End of the pages.bin bytes an index line points at; None if it can't be read"""
+    if line is None:
+        return 0
+    parts = line.split()
+    if len(parts) != 3 or not all(x.isdigit() for x in parts):
+        return None
+    return int(parts[1]) + int(parts[2])
+
+def append_page(doc_dir, page, text):
+    """Appends one page to the store; safe with several writers on one doc"""
+    data = text.encode('utf-8')
+    with store_lock(doc_dir):
+        # Appends are sequential, so the last complete index line marks
+        # the end of the referenced bytes; anything after it is left over
+        # from an interrupted run
+        end = _record_end(truncate_torn_tail(os.path.join(doc_dir, IDX_FILE)))
+        with open(os.path.join(doc_dir, BIN_FILE), 'ab') as f_bin:
+            offset = f_bin.seek(0, os.SEEK_END)
+            if end is not None and offset > end:
+                f_bin.truncate(end)
+                offset = end
+            f_bin.write(data)
+        # Bytes are on disk before the index points at them, so a crash in
+        # between only leaves unreferenced bytes at the end of pages.bin
+        with open(os.path.join(doc_dir, IDX_FILE), 'a') as f_idx:
+            f_idx.write(f"{page} {offset} {len(data)}\n")
+
+def migrate_legacy(doc_dir):
+    """Packs a legacy page_XXX.txt tree into pages.bin/pages.idx"""
+    files = glob.glob(os.path.join(doc_dir, 'page_*.txt'))
+    if not files or os.path.exists(os.path.join(doc_dir, IDX_FILE)):
+        return False
+
+    pages = {}
+    for f in files:
+        try:
+            page_num = int(os.path.basename(f).replace('page_', '').replace('.txt', ''))
+        except ValueError:
+            continue
+        pages[page_num] = f
+
+    suffix = f".tmp{os.getpid()}"
+    bin_tmp = os.path.join(doc_dir, BIN_FILE + suffix)
+    idx_tmp = os.path.join(doc_dir, IDX_FILE + suffix)
+    offset = 0
+    with open(bin_tmp, 'wb') as f_bin, open(idx_tmp, 'w') as f_idx:
+        for page_num in sorted(pages):
+            with open(pages[page_num], 'rb') as f_text:
+                data = f_text.read()
+            f_bin.write(data)
+            f_idx.write(f"{page_num} {offset} {len(data)}\n")
+            offset += len(data)
+
+    os.replace(bin_tmp, os.path.join(doc_dir, BIN_FILE))
+    os.replace(idx_tmp, os.path.join(doc_dir, IDX_FILE))
+
+    for f in files:
+        try:
+            os.remove(f)
+        except FileNotFoundError:
+            pass
+    return True
+
+class PageStore:
+    """Read-only, memory-mapped view of one doc's pages"""
+
+    def __init__(self, doc_id):
+        self.doc_dir = doc_dir_for(doc_id)
+        migrate_legacy(self.doc_dir)
+        self.index = read_index(self.doc_dir)
+        self._file = None
+        self._map = None
+        bin_path = os.path.join(self.doc_dir, BIN_FILE)
+        if self.index and os.path.getsize(bin_path) > 0:
+            self._file = open(bin_path, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = None
+
+    def pages(self):
+        return sorted(self.index)
+
+    def read_page(self, page):
+        offset, length = self.index[page]
+        if length == 0:
+            return ""
+        return self._map[offset:offset + length].decode('utf-8')
+
+    def read_range(self, start=None, end=None):
+        """Returns [{'page', 'text'}] for start <= page < end, in page order"""
+        return [
+            {'page': p, 'text': self.read_page(p)}
+            for p in self.pages()
+            if (start is None or p >= start) and (end is None or p < end)
+        ]
+
+def load_pages(doc_id, start=None, end=None):
+    with PageStore(doc_id) as store:
+        return store.read_range(start, end)
+
+def load_page(doc_id, page):
+    with PageStore(doc_id) as store:
+        if page not in store.index:
+            return None
+        return store.read_page(page)
@@ -0,0 +1,383 @@
+"""Targeted repair of extractions that fail validation (PRD C.8).
+
+Instead of re-extracting the whole doc, the model gets the BLOCKER errors,
+only the sub-objects they point at (as JSON Pointers), the IDs those
+objects may reference, the schema of the failing sections and only the
+pages the failing objects cite. It answers with a JSON Patch; the patch is
+applied (operations outside the failing objects are dropped) and the
+result validated again, up to extraction.max_retries_fix times.
+
+05_extract.py --validate and 07_worker.py repair right after validation;
+this script repairs docs already in needs_review:
+
+    python scripts/repair.py [--doc DOC_ID] [--mock-server [URL]]
+"""
+import os
+import re
+import copy
+import json
+import time
+import yaml
+import argparse
+import importlib
+from db import get_connection
+from page_store import load_page
+from retriever import retrieve_pages
+from context_packer import pack_context, estimate_tokens
+from llm_client import GeminiClient, strip_fences
+from telemetry import stage_timer
+
+validator = importlib.import_module('06_validate')
+
+PATH_TOKEN_RE = re.compile(r"([^.\[\]]+)|\[(\d+)\]")
+LIST_SECTIONS = set(validator.ENTITIES)
+# Comparison fields pointing at other entities, for KNOWN_IDS and cited pages
+REFERENCE_FIELDS = {'unit_id': 'units', 'scenario_id': 'scenarios',
+                    'baseline_condition_id': 'conditions', 'retrofit_condition_id': 'conditions',
+                    'comparison_id': 'comparisons'}
+
+def load_config():
+    with open('run_config.yaml', 'r') as f:
+        return yaml.safe_load(f)
+
+def parse_error(error):
+    """'BLOCKER | CODE | measurements[0].unit | message' -> (severity, code, path tokens, message)"""
+    parts = [part.strip() for part in error.split('|', 3)]
+    if len(parts) < 4:
+        return None
+    severity, code, path, message = parts
+    tokens = [] if path == '$' else [int(index) if index else name for name, index in PATH_TOKEN_RE.findall(path)]
+    return severity, code, tokens, message
+
+def to_pointer(tokens):
+    return "".join("/" + str(t).replace('~', '~0').replace('/', '~1') for t in tokens)
+
+def from_pointer(pointer):
+    if pointer == "":
+        return []
+    if not pointer.startswith('/'):
+        raise ValueError(f"Not a JSON Pointer: {pointer}")
+    return [t.replace('~1', '/').replace('~0', '~') for t in pointer[1:].split('/')]
+
+def failing_object_tokens(tokens):
+    """The object an error belongs to: an entity (measurements/0), a section (study) or the root"""
+    if not tokens:
+        return []
+    if tokens[0] in LIST_SECTIONS and len(tokens) > 1 and isinstance(tokens[1], int):
+        return tokens[:2]
+    return tokens[:1]
+
+def resolve(data, tokens):
+    node = data
+    for t in tokens:
+        node = node[t]
+    return node
+
+def failing_objects(data, blockers):
+    """{pointer: current value} of every object a BLOCKER error points into"""
+    objects = {}
+    for error in blockers:
+        parsed = parse_error(error)
+        if parsed is None:
+            continue
+        tokens = failing_object_tokens(parsed[2])
+        pointer = to_pointer(tokens)
+        if pointer in objects:
+            continue
+        try:
+            # The root itself is never sent; its errors name missing top-level keys
+            objects[pointer] = resolve(data, tokens) if tokens else None
+        except (KeyError, IndexError, TypeError):
+            objects[pointer] = None
+    return objects
+
+def evidence_pages(node):
+    """Every evidence.page inside a (sub-)object"""
+    pages = []
+    if isinstance(node, dict):
+        evidence = node.get('evidence')
+        if isinstance(evidence, dict) and isinstance(evidence.get('page'), int):
+            pages.append(evidence['page'])
+        for key, value in node.items():
+            if key != 'evidence':
+                pages += evidence_pages(value)
+    elif isinstance(node, list):
+        for item in node:
+            pages += evidence_pages(item)
+    return pages
+
+def known_ids(data):
+    """IDs per entity, so a broken reference can be pointed at something that exists"""
+    ids = {}
+    for entity in ('units', 'scenarios', 'conditions', 'comparisons'):
+        items = data.get(entity) if isinstance(data, dict) else None
+        if isinstance(items, list):
+            ids[entity] = [item.get(f"{entity[:-1]}_id") for item in items if isinstance(item, dict)]
+    return ids
+
+def referenced_pages(data, obj):
+    """Pages cited by the entities a failing object references (a comparison has no evidence of its own)"""
+    pages = []
+    if not isinstance(obj, dict):
+        return pages
+    for field, entity in REFERENCE_FIELDS.items():
+        target_id = obj.get(field)
+        for item in (data.get(entity) or []) if isinstance(data, dict) else []:
+            if isinstance(item, dict) and item.get(f"{entity[:-1]}_id") == target_id:
+                pages += evidence_pages(item)
+    return pages
+
+def schema_excerpt(sections):
+    """The core schema's properties for the failing sections, plus the definitions they use"""
+    core = validator.load_schema('core_extraction.schema.json')
+    excerpt = {}
+    for section in sections:
+        if section not in core['properties']:
+            continue
+        if section == 'measurements':
+            excerpt[section] = {
+                'type': 'array',
+                'items': {'oneOf': [
+                    {k: v for k, v in validator.load_schema(name).items() if k not in ('$schema', '$id')}
+                    for name in ('outcomeA_measurement.schema.json', 'outcomeB_measurement.schema.json')
+                ]}
+            }
+        else:
+            excerpt[section] = core['properties'][section]
+    if not excerpt and sections:
+        # Root-level errors (a missing section): only the top-level shape
+        excerpt = {'required': core.get('required', []), 'properties': sorted(core['properties'])}
+    text = json.dumps(excerpt)
+    names = set(re.findall(r"#/definitions/(\w+)", text))
+    if names:
+        excerpt['definitions'] = {name: core['definitions'][name] for name in sorted(names) if name in core['definitions']}
+    return excerpt
+
+def build_repair_prompt(blockers, objects, ids, excerpt, context_text):
+    shown = {pointer: value for pointer, value in objects.items() if pointer}
+    return f"""MODE: repair_patch
+ROLE: You are a strict JSON repair assistant.
+TASK: Fix the extraction so the VALIDATION_ERRORS go away. Answer with a JSON Patch (RFC 6902).
+CONSTRAINTS:
+1) Do NOT add new information beyond what is present in the provided PAGES.
+2) If a required numeric value lacks evidence, set it to null.
+3) Only change the objects in FAILING_OBJECTS (keys are JSON Pointers from the document root). References must use KNOWN_IDS.
+4) Output ONLY a JSON array of operations like {{"op": "replace", "path": "/measurements/0/unit", "value": "h"}} (op: add, replace or remove).
+
+VALIDATION_ERRORS:
+{chr(10).join(blockers)}
+
+FAILING_OBJECTS:
+{json.dumps(shown, indent=1)}
+
+KNOWN_IDS:
+{json.dumps(ids)}
+
+SCHEMA (failing sections only):
+{json.dumps(excerpt)}
+
+PAGES:
+{context_text or '(none cited)'}
+"""
+
+def repair_context(doc_id, data, objects, config):
+    """Packed text of the pages the failing objects (or what they reference) cite"""
+    extraction_config = config.get('extraction', {})
+    max_pages = extraction_config.get('repair_max_pages', 3)
+    pages = []
+    for pointer, obj in objects.items():
+        pages += evidence_pages(obj) + referenced_pages(data, obj)
+    scored = []
+    for page in dict.fromkeys(pages):
+        text = load_page(doc_id, page)
+        if text is not None:
+            scored.append({'page': page, 'text': text, 'score': 1.0})
+    if not scored:
+        # Nothing cited (e.g. missing evidence): the best retrieval hits
+        scored = retrieve_pages(doc_id, config)
+    repair_config = dict(config, extraction=dict(extraction_config,
+                                                 context_token_budget=extraction_config.get('repair_token_budget', 3000),
+                                                 max_input_pages=max_pages))
+    return pack_context(doc_id, scored[:max_pages], repair_config)
+
+def parse_patch(text):
+    ops = json.loads(strip_fences(text))
+    if isinstance(ops, dict):
+        ops = ops.get('patch', [ops])
+    if not isinstance(ops, list):
+        raise ValueError("Patch is not a list of operations")
+    return ops
+
+def is_parseable_patch(text):
+    try:
+        parse_patch(text)
+        return True
+    except ValueError:
+        return False
+
+def apply_patch(data, ops, allowed):
+    """Applies add/replace/remove ops whose path lies inside an allowed pointer; returns (data, skipped ops)"""
+    data = copy.deepcopy(data)
+    skipped = []
+    for op in ops:
+        try:
+            kind, pointer = op['op'], op['path']
+            tokens = from_pointer(pointer)
+            # '' (a root-level error such as a missing section) allows any path
+            if not tokens or not any(prefix == '' or pointer == prefix or pointer.startswith(prefix + '/')
+                                     for prefix in allowed):
+                raise ValueError("outside the failing objects")
+            parent = data
+            for t in tokens[:-1]:
+                parent = parent[int(t)] if isinstance(parent, list) else parent[t]
+            key = tokens[-1]
+            if isinstance(parent, list):
+                index = len(parent) if key == '-' else int(key)
+                if kind == 'add':
+                    parent.insert(index, op['value'])
+                elif kind == 'replace':
+                    parent[index] = op['value']
+                elif kind == 'remove':
+                    del parent[index]
+                else:
+                    raise ValueError(f"unsupported op {kind}")
+            elif isinstance(parent, dict):
+                if kind in ('add', 'replace'):
+                    parent[key] = op['value']
+                elif kind == 'remove':
+                    del parent[key]
+                else:
+                    raise ValueError(f"unsupported op {kind}")
+            else:
+                raise ValueError("parent is not an object or array")
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            skipped.append(f"{op}: {e}")
+    return data, skipped
+
+def repair_doc(doc_id, data, errors, config, client):
+    """Patches a failing extraction with up to extraction.max_retries_fix model calls.
+
+    Returns (data, valid, errors); data is the best attempt, with the
+    repair history in snippets/{doc_id}/repair_stats.json.
+    """
+    max_attempts = config.get('extraction', {}).get('max_retries_fix', 1)
+    valid = not errors
+    attempts = []
+    with stage_timer('repair', doc_id) as metrics:
+        for attempt in range(max_attempts):
+            blockers = [e for e in errors if e.startswith('BLOCKER')]
+            if valid or not blockers or not isinstance(data, dict):
+                break
+            objects = failing_objects(data, blockers)
+            sections = sorted({from_pointer(pointer)[0] for pointer in objects if pointer})
+            context_text, context_stats = repair_context(doc_id, data, objects, config)
+            prompt = build_repair_prompt(blockers, objects, known_ids(data), schema_excerpt(sections), context_text)
+            metrics.add(pages=len(context_stats['pages_packed']))
+            print(f"  [REPAIR] {doc_id[:8]}... attempt {attempt + 1}/{max_attempts}: {len(blockers)} errors, "
+                  f"{len(objects)} objects, pages {context_stats['pages_packed']}, ~{estimate_tokens(prompt)} tokens")
+            started = time.perf_counter()
+            try:
+                ops = parse_patch(client.generate(prompt, accept=is_parseable_patch))
+            except ValueError as e:
+                attempts.append({'errors_before': len(blockers), 'prompt_tokens_est': estimate_tokens(prompt),
+                                 'error': f"unparseable patch: {e}"})
+                continue
+            except Exception as e:
+                # Out of retries or a client error: keep what was extracted,
+                # the doc goes to needs_review instead of being extracted again
+                attempts.append({'errors_before': len(blockers), 'prompt_tokens_est': estimate_tokens(prompt),
+                                 'error': f"model call failed: {type(e).__name__}: {e}"[:500]})
+                print(f"  [REPAIR] {doc_id[:8]}... model call failed: {e}")
+                break
+            patched, skipped = apply_patch(data, ops, list(objects))
+            patched_valid, patched_errors = validator.validate_data(patched)
+            attempts.append({
+                'errors_before': len(blockers), 'errors_after': len(patched_errors),
+                'objects': sorted(objects), 'pages': context_stats['pages_packed'],
+                'prompt_tokens_est': estimate_tokens(prompt), 'ops': len(ops), 'ops_skipped': skipped,
+                'seconds': round(time.perf_counter() - started, 3)
+            })
+            # Only keep a patch that doesn't make things worse
+            if len(patched_errors) <= len(errors):
+                data, valid, errors = patched, patched_valid, patched_errors
+    if attempts:
+        save_repair_stats(doc_id, attempts, valid)
+    return data, valid, errors
+
+def save_repair_stats(doc_id, attempts, valid):
+    snippets_dir = os.path.join('snippets', doc_id)
+    os.makedirs(snippets_dir, exist_ok=True)
+    full_tokens = None
+    try:
+        with open(os.path.join(snippets_dir, 'prompt_stats.json'), 'r') as f:
+            full_tokens = json.load(f).get('prompt_tokens_est')
+    except (FileNotFoundError, ValueError):
+        pass
+    with open(os.path.join(snippets_dir, 'repair_stats.json'), 'w') as f:
+        json.dump({'doc_id': doc_id, 'valid': valid, 'attempts': attempts,
+                   'extraction_prompt_tokens_est': full_tokens, 'timestamp': time.time()}, f, indent=2)
+
+def load_report_errors(doc_id):
+    path = os.path.join('validation_reports', f'{doc_id}.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f).get('errors', [])
+
+def run_repair(doc_ids=None, mock_server=None):
+    config = load_config()
+    if config.get('extraction', {}).get('max_retries_fix', 1) < 1:
+        print("Repair disabled (extraction.max_retries_fix is 0).")
+        return
+    extract = importlib.import_module('05_extract')
+    api_key = 'mock-server' if mock_server else extract.load_api_key()
+    if not api_key:
+        print("GEMINI_API_KEY not found; nothing to repair with.")
+        return
+    client = GeminiClient(config['extraction']['model'], api_key, config.get('rate_limits', {}), api_endpoint=mock_server)
+
+    conn = get_connection()
+    c = conn.cursor()
+    if doc_ids:
+        c.execute(f"SELECT doc_id FROM docs WHERE status = 'needs_review' AND doc_id IN ({','.join('?' * len(doc_ids))})", doc_ids)
+    else:
+        c.execute("SELECT doc_id FROM docs WHERE status = 'needs_review'")
+    docs = [doc_id for (doc_id,) in c.fetchall()]
+    print(f"Found {len(docs)} docs to repair.")
+
+    for doc_id in docs:
+        raw_path = os.path.join('extractions_raw', f'{doc_id}.json')
+        errors = load_report_errors(doc_id)
+        if errors is None or not os.path.exists(raw_path):
+            print(f"  {doc_id[:8]}...: no validation report or raw extraction, skipping")
+            continue
+        try:
+            with open(raw_path, 'r') as f:
+                data = json.load(f)
+        except ValueError:
+            print(f"  {doc_id[:8]}...: raw extraction is not JSON; re-extract it")
+            continue
+        try:
+            data, valid, errors = repair_doc(doc_id, data, errors, config, client)
+        except Exception as e:
+            print(f"  Error repairing {doc_id}: {e}")
+            continue
+        extract.save_raw_extraction(doc_id, data)
+        new_status = validator.store_validation_result(doc_id, valid, errors)
+        c.execute("UPDATE docs SET status = ? WHERE doc_id = ?", (new_status, doc_id))
+        conn.commit()
+        print(f"  {doc_id[:8]}... -> {new_status} ({len(errors)} errors left)")
+    conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Patch needs_review extractions from their validation errors")
+    parser.add_argument('--doc', action='append', help="Only this doc_id (repeatable)")
+    parser.add_argument('--mock-server', nargs='?', const='', metavar='URL',
+                        help="Send requests to scripts/mock_gemini_server.py (default URL from mock_server in run_config.yaml)")
+    args = parser.parse_args()
+
+    mock_server = None
+    if args.mock_server is not None:
+        extract = importlib.import_module('05_extract')
+        mock_server = args.mock_server or extract.mock_server_url(load_config())
+    run_repair(doc_ids=args.doc, mock_server=mock_server)
@@ -1,56 +1,39 @@
 import os
-import glob
 import yaml
 import json
 import time
-from rank_bm25 import BM25Okapi
+import argparse
+import numpy as np
+from page_store import load_pages
+import search_index
+import bm25_engine
 
 def load_pages_text(doc_id):
     """Loads all pages for a doc and returns list of (page_num, text)"""
-    files = glob.glob(os.path.join('pages_text', doc_id, 'page_*.txt'))
-    pages = []
-    for f in files:
-        # Extract page number from filename page_001.txt
-        try:
-            basename = os.path.basename(f)
-            page_num = int(basename.replace('page_', '').replace('.txt', ''))
-            with open(f, 'r', encoding='utf-8') as tf:
-                text = tf.read()
-            pages.append({'page': page_num, 'text': text})
-        except:
-            continue
-    return sorted(pages, key=lambda x: x['page'])
+    return load_pages(doc_id)
 
 def retrieve_pages(doc_id, config):
     pages = load_pages_text(doc_id)
     if not pages:
         return []
     
-    corpus = [p['text'] for p in pages]
-    tokenized_corpus = [doc.split(" ") for doc in corpus]
+    # Scores come from the persistent corpus index (corpus-wide IDF)
+    search_index.update_index([doc_id])
     
-    bm25 = BM25Okapi(tokenized_corpus)
+    rag_config = config.get('rag', {})
+    queries = rag_config.get('query_templates', [])
+    top_k = rag_config.get('bm25_top_k_pages', 15)
+    phrase_weight = rag_config.get('phrase_weight', 1.0)
     
-    queries = config.get('rag', {}).get('query_templates', [])
-    top_k = config.get('rag', {}).get('bm25_top_k_pages', 15)
+    # Every template scored against every page in one matrix product;
+    # a page's score is its best template score
+    conn = search_index.get_connection()
+    scores = bm25_engine.score_queries(conn, doc_id, [p['page'] for p in pages], queries, phrase_weight)
+    conn.close()
+    best_scores = scores.max(axis=1) if queries else np.zeros(len(pages))
     
-    all_scores = {} # page_idx -> max_score
-    
-    for query in queries:
-        tokenized_query = query.split(" ")
-        doc_scores = bm25.get_scores(tokenized_query)
-        
-        for i, score in enumerate(doc_scores):
-            if i not in all_scores:
-                all_scores[i] = 0
-            if score > all_scores[i]:
-                all_scores[i] = score
-                
-    # Sort pages by score
-    sorted_indices = sorted(all_scores, key=all_scores.get, reverse=True)
-    
-    selected_indices = sorted_indices[:top_k]
-    selected_pages = [pages[i] for i in selected_indices if i < len(pages)]
+    selected_indices = bm25_engine.top_k_indices(best_scores, top_k)
+    selected_pages = [dict(pages[i], score=float(best_scores[i])) for i in selected_indices]
     
     # Save retrieval metadata
     snippets_dir = os.path.join('snippets', doc_id)
@@ -58,7 +41,9 @@ def retrieve_pages(doc_id, config):
     
     meta = {
         'doc_id': doc_id,
+        'queries': queries,
         'selected_pages': [p['page'] for p in selected_pages],
+        'scores': [p['score'] for p in selected_pages],
         'timestamp': time.time()
     }
     
@@ -66,3 +51,45 @@ def retrieve_pages(doc_id, config):
         json.dump(meta, f, indent=2)
         
     return selected_pages
+
+def verify_equivalence(doc_id, config, rel_tol=1e-9):
+    """Compares the vectorized scores against the per-query scalar loop.
+
+    Returns the max relative score difference and whether the selected
+    pages agree (phrase bonus disabled, see bm25_engine).
+    """
+    pages = load_pages_text(doc_id)
+    search_index.update_index([doc_id])
+    queries = config.get('rag', {}).get('query_templates', [])
+    top_k = config.get('rag', {}).get('bm25_top_k_pages', 15)
+    page_numbers = [p['page'] for p in pages]
+
+    conn = search_index.get_connection()
+    vectorized = bm25_engine.score_queries(conn, doc_id, page_numbers, queries, phrase_weight=0)
+    scalar = np.zeros_like(vectorized)
+    for q, query in enumerate(queries):
+        doc_scores = search_index.score_pages(doc_id, query, conn=conn)
+        for i, page in enumerate(page_numbers):
+            scalar[i, q] = doc_scores.get(page, 0.0)
+    conn.close()
+
+    max_rel_diff = float(np.max(np.abs(vectorized - scalar) / np.maximum(np.abs(scalar), 1e-12))) if scalar.size else 0.0
+    best_vec = vectorized.max(axis=1) if queries else np.zeros(len(pages))
+    best_ref = scalar.max(axis=1) if queries else np.zeros(len(pages))
+    reference_order = sorted(range(len(pages)), key=lambda i: best_ref[i], reverse=True)[:top_k]
+    same_selection = list(bm25_engine.top_k_indices(best_vec, top_k)) == reference_order
+    return max_rel_diff, same_selection and max_rel_diff <= rel_tol
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--verify', nargs='*', metavar='DOC_ID',
+                        help="Check vectorized scoring against the scalar loop (all indexed docs if none given)")
+    args = parser.parse_args()
+
+    if args.verify is not None:
+        with open('run_config.yaml', 'r') as f:
+            config = yaml.safe_load(f)
+        doc_ids = args.verify or sorted(os.listdir('pages_text'))
+        for doc_id in doc_ids:
+            max_rel_diff, ok = verify_equivalence(doc_id, config)
+            print(f"{'OK  ' if ok else 'DIFF'} {doc_id}  max rel diff {max_rel_diff:.2e}")
@@ -0,0 +1,274 @@
+"""Persistent corpus-wide inverted index over pages_text/.
+
+Postings (term -> doc_id, page, tf), page lengths, per-term page frequency
+and corpus totals live in search_index.sqlite and are updated per doc when
+its page store changes, so BM25 uses corpus-wide IDF and lookups never
+touch the page text.
+"""
+import os
+import re
+import math
+import sqlite3
+import argparse
+import time
+from collections import Counter
+import page_store
+
+INDEX_PATH = 'search_index.sqlite'
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Bump when tokenization changes; the index is cleared and rebuilt
+ANALYZER_VERSION = '2'
+
+TOKEN_RE = re.compile(r"[^\W_]+")
+
+def tokenize(text):
+    """Case-folded alphanumeric tokens; punctuation and hyphens split terms"""
+    return TOKEN_RE.findall(text.lower())
+
+def bigrams(tokens):
+    """Adjacent token pairs, indexed so phrases like "EN 16798" match exactly"""
+    return [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+def analyze(text):
+    tokens = tokenize(text)
+    return tokens, tokens + bigrams(tokens)
+
+def get_connection():
+    conn = sqlite3.connect(INDEX_PATH, timeout=30)
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS indexed_docs (
+            doc_id TEXT PRIMARY KEY,
+            signature TEXT,
+            n_pages INTEGER,
+            indexed_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS pages (
+            doc_id TEXT,
+            page INTEGER,
+            length INTEGER,
+            PRIMARY KEY (doc_id, page)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS postings (
+            term TEXT,
+            doc_id TEXT,
+            page INTEGER,
+            tf INTEGER,
+            PRIMARY KEY (term, doc_id, page)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);
+        CREATE TABLE IF NOT EXISTS terms (
+            term TEXT PRIMARY KEY,
+            df INTEGER
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS corpus_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            n_pages INTEGER,
+            total_length INTEGER
+        );
+        INSERT OR IGNORE INTO corpus_stats VALUES (1, 0, 0);
+    ''')
+    row = conn.execute("SELECT value FROM meta WHERE key = 'analyzer_version'").fetchone()
+    if row is None or row[0] != ANALYZER_VERSION:
+        with conn:
+            for table in ('indexed_docs', 'pages', 'postings', 'terms'):
+                conn.execute(f"DELETE FROM {table}")
+            conn.execute("UPDATE corpus_stats SET n_pages = 0, total_length = 0 WHERE id = 1")
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('analyzer_version', ?)", (ANALYZER_VERSION,))
+    return conn
+
+def store_signature(doc_id):
+    """Changes whenever the doc's page store or completion marker changes"""
+    doc_dir = page_store.doc_dir_for(doc_id)
+    meta_path = os.path.join(doc_dir, 'pages_meta.json')
+    idx_path = os.path.join(doc_dir, page_store.IDX_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    page_store.migrate_legacy(doc_dir)
+    parts = []
+    for path in (meta_path, idx_path):
+        if os.path.exists(path):
+            st = os.stat(path)
+            parts.append(f"{st.st_size}:{st.st_mtime_ns}")
+    return "|".join(parts)
+
+def _remove_doc(c, doc_id):
+    c.execute('''
+        UPDATE terms SET df = df - (
+            SELECT COUNT(*) FROM postings p WHERE p.doc_id = ? AND p.term = terms.term
+        ) WHERE term IN (SELECT term FROM postings WHERE doc_id = ?)
+    ''', (doc_id, doc_id))
+    c.execute("DELETE FROM terms WHERE df <= 0")
+    c.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM pages WHERE doc_id = ?", (doc_id,))
+    n_pages, total_length = c.fetchone()
+    c.execute("UPDATE corpus_stats SET n_pages = n_pages - ?, total_length = total_length - ? WHERE id = 1",
+              (n_pages, total_length))
+    c.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+    c.execute("DELETE FROM pages WHERE doc_id = ?", (doc_id,))
+    c.execute("DELETE FROM indexed_docs WHERE doc_id = ?", (doc_id,))
+
+def _add_doc(c, doc_id, signature):
+    pages = page_store.load_pages(doc_id)
+    page_rows = []
+    posting_rows = []
+    doc_df = Counter()
+    for p in pages:
+        tokens, terms = analyze(p['text'])
+        counts = Counter(terms)
+        # Page length (BM25 dl) counts words only, not the bigram terms
+        length = len(tokens)
+        page_rows.append((doc_id, p['page'], length))
+        posting_rows.extend((term, doc_id, p['page'], tf) for term, tf in counts.items())
+        doc_df.update(counts.keys())
+
+    c.executemany("INSERT INTO pages VALUES (?, ?, ?)", page_rows)
+    c.executemany("INSERT INTO postings VALUES (?, ?, ?, ?)", posting_rows)
+    c.executemany('''
+        INSERT INTO terms VALUES (?, ?)
+        ON CONFLICT (term) DO UPDATE SET df = df + excluded.df
+    ''', doc_df.items())
+    c.execute("UPDATE corpus_stats SET n_pages = n_pages + ?, total_length = total_length + ? WHERE id = 1",
+              (len(page_rows), sum(r[2] for r in page_rows)))
+    c.execute("INSERT INTO indexed_docs VALUES (?, ?, ?, ?)", (doc_id, signature, len(page_rows), time.time()))
+    return len(page_rows)
+
+def update_index(doc_ids=None):
+    """Indexes new or changed docs; with doc_ids=None also drops vanished ones"""
+    if doc_ids is None:
+        if not os.path.exists(page_store.PAGES_TEXT_DIR):
+            return 0
+        doc_ids = sorted(os.listdir(page_store.PAGES_TEXT_DIR))
+        full_scan = True
+    else:
+        full_scan = False
+
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT doc_id, signature FROM indexed_docs")
+    indexed = dict(c.fetchall())
+
+    updated = 0
+    for doc_id in doc_ids:
+        signature = store_signature(doc_id)
+        if signature is None or indexed.get(doc_id) == signature:
+            continue
+        # One transaction per doc keeps postings and stats consistent
+        with conn:
+            if doc_id in indexed:
+                _remove_doc(c, doc_id)
+            _add_doc(c, doc_id, signature)
+        updated += 1
+
+    if full_scan:
+        for doc_id in set(indexed) - set(doc_ids):
+            with conn:
+                _remove_doc(c, doc_id)
+            updated += 1
+
+    conn.close()
+    return updated
+
+def corpus_stats(c):
+    c.execute("SELECT n_pages, total_length FROM corpus_stats WHERE id = 1")
+    n_pages, total_length = c.fetchone()
+    return n_pages, (total_length / n_pages) if n_pages else 0.0
+
+def idf(n_pages, df):
+    # Non-negative BM25 idf, so very common terms never subtract score
+    return math.log(1 + (n_pages - df + 0.5) / (df + 0.5))
+
+def _term_weights(c, terms):
+    """{term: idf} for the distinct query terms present in the corpus"""
+    n_pages, _ = corpus_stats(c)
+    weights = {}
+    for term in set(terms):
+        c.execute("SELECT df FROM terms WHERE term = ?", (term,))
+        row = c.fetchone()
+        if row:
+            weights[term] = idf(n_pages, row[0])
+    return weights
+
+def _bm25(tf, length, avgdl, term_idf):
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avgdl) if avgdl else BM25_K1
+    return term_idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+def score_pages(doc_id, query, conn=None):
+    """BM25 score of every indexed page of doc_id for query, with corpus statistics.
+
+    Scalar, one query at a time over unigrams; bm25_engine scores all
+    templates at once and is checked against this.
+    """
+    own_conn = conn is None
+    conn = conn or get_connection()
+    c = conn.cursor()
+    _, avgdl = corpus_stats(c)
+
+    c.execute("SELECT page, length FROM pages WHERE doc_id = ?", (doc_id,))
+    lengths = dict(c.fetchall())
+    scores = {page: 0.0 for page in lengths}
+    for term, term_idf in _term_weights(c, tokenize(query)).items():
+        c.execute("SELECT page, tf FROM postings WHERE term = ? AND doc_id = ?", (term, doc_id))
+        for page, tf in c.fetchall():
+            scores[page] += _bm25(tf, lengths[page], avgdl, term_idf)
+
+    if own_conn:
+        conn.close()
+    return scores
+
+def search(query, limit=50, match_all=True):
+    """Returns [(doc_id, page, score)] across the corpus, best first.
+
+    With match_all, multi-word queries match as phrases (all their bigrams).
+    """
+    _, terms = analyze(query)
+    if not terms:
+        return []
+    conn = get_connection()
+    c = conn.cursor()
+    _, avgdl = corpus_stats(c)
+    weights = _term_weights(c, terms)
+    if match_all and len(weights) < len(set(terms)):
+        conn.close()
+        return []
+
+    scores = Counter()
+    matched_terms = Counter()
+    for term, term_idf in weights.items():
+        c.execute('''
+            SELECT p.doc_id, p.page, p.tf, pg.length
+            FROM postings p JOIN pages pg ON pg.doc_id = p.doc_id AND pg.page = p.page
+            WHERE p.term = ?
+        ''', (term,))
+        for doc_id, page, tf, length in c.fetchall():
+            scores[(doc_id, page)] += _bm25(tf, length, avgdl, term_idf)
+            matched_terms[(doc_id, page)] += 1
+    conn.close()
+
+    if match_all:
+        scores = Counter({k: v for k, v in scores.items() if matched_terms[k] == len(weights)})
+    return [(doc_id, page, score) for (doc_id, page), score in scores.most_common(limit)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain and query the corpus page index")
+    parser.add_argument('--rebuild', action='store_true', help="Drop the index and rebuild it from pages_text/")
+    parser.add_argument('--query', help="Search the corpus instead of updating the index")
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.query:
+        started = time.perf_counter()
+        hits = search(args.query, limit=args.limit)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        for doc_id, page, score in hits:
+            print(f"{score:8.3f}  {doc_id}  page {page}")
+        print(f"{len(hits)} hits in {elapsed_ms:.1f} ms")
+    else:
+        if args.rebuild and os.path.exists(INDEX_PATH):
+            os.remove(INDEX_PATH)
+        updated = update_index()
+        print(f"Index updated: {updated} docs changed.")
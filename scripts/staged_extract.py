@@ -0,0 +1,285 @@
+"""Staged extraction for long, multi-unit papers.
+
+One request for the whole document is slow on papers with dozens of
+comparisons, gets truncated, and has to be redone entirely when it fails.
+In staged mode 05_extract.py instead asks for:
+1. the skeleton: everything but measurements (units, scenarios, conditions,
+   comparisons), from the usual retrieved pages;
+2. the measurements, one request per group of comparisons (same unit
+   first, at most extraction.staged_group_size per request), run in
+   parallel. Each request sees only its comparisons, the entities they
+   reference and the pages those cite or mention them by label.
+
+The groups are merged with ID checks: a measurement must point at a
+comparison of its own group (a group of one fills in a missing
+comparison_id), anything else is dropped and listed in
+snippets/{doc_id}/staged_stats.json together with per-group pages, tokens
+and timings. A doc's latency is then its skeleton plus its slowest group.
+With the response cache on, a re-run after a failed group only asks for
+that group again.
+
+extraction.staged: auto uses it for docs of at least staged_min_pages
+pages; always / never force it (05_extract.py --staged).
+"""
+import os
+import re
+import copy
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from page_store import PageStore
+from context_packer import pack_context, estimate_tokens
+from llm_client import strip_fences
+from repair import evidence_pages, referenced_pages, schema_excerpt
+from telemetry import stage_timer
+
+STAGED_MODES = ('auto', 'always', 'never')
+# Entity fields worth looking for in page text when picking a group's pages
+LABEL_FIELDS = {'units': 'unit_label', 'scenarios': 'scenario_label', 'conditions': 'package_label'}
+REFERENCES = {'unit_id': 'units', 'scenario_id': 'scenarios',
+              'baseline_condition_id': 'conditions', 'retrofit_condition_id': 'conditions'}
+
+def use_staged(doc_id, config):
+    extraction_config = config.get('extraction', {})
+    mode = extraction_config.get('staged', 'auto')
+    if mode == 'always':
+        return True
+    if mode != 'auto':
+        return False
+    with PageStore(doc_id) as store:
+        return len(store.index) >= extraction_config.get('staged_min_pages', 20)
+
+def skeleton_schema(schema):
+    """The extraction schema without the measurements section"""
+    skeleton = copy.deepcopy(schema)
+    skeleton.get('properties', {}).pop('measurements', None)
+    skeleton['required'] = [name for name in skeleton.get('required', []) if name != 'measurements']
+    return skeleton
+
+def build_skeleton_prompt(context_text, schema):
+    return f"""MODE: skeleton
+ROLE: You are a scientific data extractor.
+TASK: Extract the study, building, units, scenarios, conditions and comparisons from the TEXT, following the SCHEMA.
+Measurements are extracted separately: do NOT include them.
+CONSTRAINTS:
+1) Every comparison MUST link to valid unit_id, scenario_id, baseline_condition_id and retrofit_condition_id.
+2) All IDs (unit_id, scenario_id, condition_id, comparison_id) MUST be unique.
+3) Baseline conditions have role='baseline' and retrofit conditions role='retrofit'.
+4) Every entity MUST have page number evidence.
+
+TEXT:
+{context_text}
+
+SCHEMA:
+{json.dumps(skeleton_schema(schema))}
+
+Return ONLY valid JSON.
+"""
+
+def parse_skeleton(text):
+    skeleton = json.loads(strip_fences(text))
+    if not isinstance(skeleton, dict):
+        raise ValueError("Skeleton is not a JSON object")
+    return skeleton
+
+def is_parseable_skeleton(text):
+    try:
+        parse_skeleton(text)
+        return True
+    except ValueError:
+        return False
+
+def parse_measurements(text):
+    measurements = json.loads(strip_fences(text))
+    if isinstance(measurements, dict):
+        measurements = measurements.get('measurements', [])
+    if not isinstance(measurements, list):
+        raise ValueError("Measurements are not a JSON array")
+    return measurements
+
+def is_parseable_measurements(text):
+    try:
+        parse_measurements(text)
+        return True
+    except ValueError:
+        return False
+
+def entity(skeleton, section, entity_id):
+    for item in skeleton.get(section) or []:
+        if isinstance(item, dict) and item.get(f"{section[:-1]}_id") == entity_id:
+            return item
+    return None
+
+def group_comparisons(comparisons, group_size):
+    """Comparisons of the same unit together (they share pages), at most group_size per group"""
+    by_unit = {}
+    for comparison in comparisons:
+        if isinstance(comparison, dict) and comparison.get('comparison_id'):
+            by_unit.setdefault(comparison.get('unit_id'), []).append(comparison)
+    groups = []
+    for unit_comparisons in by_unit.values():
+        for i in range(0, len(unit_comparisons), max(1, group_size)):
+            groups.append(unit_comparisons[i:i + max(1, group_size)])
+    return groups
+
+def group_entities(skeleton, group):
+    """The units, scenarios and conditions a group of comparisons references"""
+    entities = {section: [] for section in LABEL_FIELDS}
+    for comparison in group:
+        for field, section in REFERENCES.items():
+            item = entity(skeleton, section, comparison.get(field))
+            if item is not None and item not in entities[section]:
+                entities[section].append(item)
+    return entities
+
+def group_pages(skeleton, group, entities, scored_pages):
+    """Pages cited by the group's entities first, then retrieved pages naming them, best match first"""
+    cited = []
+    for comparison in group:
+        cited += evidence_pages(comparison) + referenced_pages(skeleton, comparison)
+    labels = [item[field].lower() for section, field in LABEL_FIELDS.items()
+              for item in entities[section] if isinstance(item.get(field), str) and len(item[field]) > 2]
+    ids = [comparison['comparison_id'] for comparison in group]
+    ranked = []
+    for page in scored_pages:
+        text = page['text'].lower()
+        hits = sum(text.count(label) for label in labels)
+        hits += sum(1 for comparison_id in ids if re.search(rf"\b{re.escape(comparison_id.lower())}\b", text))
+        if hits:
+            ranked.append((hits, page.get('score', 0.0), page))
+    ranked.sort(key=lambda r: (-r[0], -r[1]))
+    # Cited pages outrank any label match; scores only keep this order through the packer
+    order = list(dict.fromkeys(cited + [page['page'] for _, _, page in ranked]))
+    return [{'page': page, 'score': float(len(order) - i)} for i, page in enumerate(order)]
+
+def build_measurements_prompt(group, entities, excerpt, context_text):
+    ids = [comparison['comparison_id'] for comparison in group]
+    return f"""MODE: measurements
+ROLE: You are a scientific data extractor.
+TASK: Extract the measurements of the COMPARISONS below from the PAGES, following the SCHEMA.
+COMPARISON_IDS: {', '.join(ids)}
+CONSTRAINTS:
+1) Every measurement MUST use one of the COMPARISON_IDS as comparison_id.
+2) Do NOT invent numerical values. If a value is missing, do not extract the measurement.
+3) Every measurement MUST have page number evidence.
+4) Output ONLY a JSON object {{"measurements": [...]}}.
+
+COMPARISONS:
+{json.dumps(group, indent=1)}
+
+REFERENCED_ENTITIES:
+{json.dumps(entities, indent=1)}
+
+SCHEMA (measurements):
+{json.dumps(excerpt)}
+
+PAGES:
+{context_text or '(none found)'}
+"""
+
+def extract_group(doc_id, index, group, entities, pages, excerpt, config, client):
+    """One measurements request; runs on its own thread"""
+    extraction_config = config.get('extraction', {})
+    max_pages = extraction_config.get('staged_max_pages', 6)
+    group_config = dict(config, extraction=dict(extraction_config,
+                                                context_token_budget=extraction_config.get('staged_token_budget', 4000),
+                                                max_input_pages=max_pages))
+    with stage_timer('extract_chunk', doc_id) as metrics:
+        started = time.perf_counter()
+        with PageStore(doc_id) as store:
+            scored = [dict(page, text=store.read_page(page['page'])) for page in pages[:max_pages]
+                      if page['page'] in store.index]
+        context_text, context_stats = pack_context(doc_id, scored, group_config)
+        prompt = build_measurements_prompt(group, entities, excerpt, context_text)
+        metrics.add(pages=len(context_stats['pages_packed']), bytes_read=context_stats['raw_chars'])
+        measurements = parse_measurements(client.generate(prompt, accept=is_parseable_measurements))
+    return measurements, {
+        'group': index,
+        'comparisons': [comparison['comparison_id'] for comparison in group],
+        'pages': context_stats['pages_packed'],
+        'prompt_tokens_est': estimate_tokens(prompt),
+        'measurements': len(measurements),
+        'seconds': round(time.perf_counter() - started, 3)
+    }
+
+def merge_measurements(group, measurements):
+    """Keeps the measurements that belong to this group; returns (kept, dropped reasons)"""
+    ids = {comparison['comparison_id'] for comparison in group}
+    kept, dropped = [], []
+    for measurement in measurements:
+        if not isinstance(measurement, dict):
+            dropped.append(f"not an object: {measurement!r}"[:200])
+            continue
+        comparison_id = measurement.get('comparison_id')
+        if comparison_id is None and len(ids) == 1:
+            measurement = dict(measurement, comparison_id=next(iter(ids)))
+        elif comparison_id not in ids:
+            dropped.append(f"comparison_id {comparison_id!r} is not one of {sorted(ids)}")
+            continue
+        kept.append(measurement)
+    return kept, dropped
+
+def extract_staged(doc_id, skeleton, scored_pages, config, client):
+    """Measurements for a skeleton, one request per comparison group in parallel; returns the merged extraction"""
+    extraction_config = config.get('extraction', {})
+    comparisons = skeleton.get('comparisons') or []
+    groups = group_comparisons(comparisons, extraction_config.get('staged_group_size', 3))
+    excerpt = schema_excerpt(['measurements'])
+    tasks = []
+    for index, group in enumerate(groups):
+        entities = group_entities(skeleton, group)
+        tasks.append((index, group, entities, group_pages(skeleton, group, entities, scored_pages)))
+    print(f"  [STAGED] {doc_id[:8]}...: {len(comparisons)} comparisons in {len(groups)} measurement requests")
+
+    results = {}
+    failed = {}
+    workers = max(1, min(len(tasks), extraction_config.get('staged_workers', 4)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(extract_group, doc_id, index, group, entities, pages, excerpt, config, client): index
+                   for index, group, entities, pages in tasks}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                failed[index] = str(e)
+
+    merged = []
+    group_stats = []
+    for index, group, _, _ in tasks:
+        if index not in results:
+            group_stats.append({'group': index, 'comparisons': [c['comparison_id'] for c in group],
+                                'error': failed.get(index)})
+            continue
+        measurements, stats = results[index]
+        kept, dropped = merge_measurements(group, measurements)
+        merged += kept
+        group_stats.append(dict(stats, kept=len(kept), dropped=dropped))
+
+    # Back in skeleton order, whichever group answered first
+    order = {c.get('comparison_id'): i for i, c in enumerate(comparisons) if isinstance(c, dict)}
+    merged.sort(key=lambda m: order.get(m['comparison_id'], len(order)))
+    covered = {measurement['comparison_id'] for measurement in merged}
+    save_staged_stats(doc_id, group_stats, [c['comparison_id'] for c in comparisons
+                                            if isinstance(c, dict) and c.get('comparison_id') not in covered])
+    if failed:
+        # Answered groups stay in the response cache; a re-run only asks for these again
+        raise RuntimeError(f"{len(failed)}/{len(tasks)} measurement requests failed: "
+                           + "; ".join(f"group {index}: {error}" for index, error in sorted(failed.items())))
+    result = dict(skeleton)
+    result['measurements'] = merged
+    return result
+
+def save_staged_stats(doc_id, groups, without_measurements):
+    snippets_dir = os.path.join('snippets', doc_id)
+    os.makedirs(snippets_dir, exist_ok=True)
+    timed = [group['seconds'] for group in groups if 'seconds' in group]
+    with open(os.path.join(snippets_dir, 'staged_stats.json'), 'w') as f:
+        json.dump({
+            'doc_id': doc_id,
+            'groups': groups,
+            'slowest_group_s': max(timed) if timed else None,
+            'sum_group_s': round(sum(timed), 3),
+            'comparisons_without_measurements': without_measurements,
+            'timestamp': time.time()
+        }, f, indent=2)
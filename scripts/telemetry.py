@@ -0,0 +1,299 @@
+"""Per-document, per-stage metrics stored in state.sqlite (stage_metrics).
+
+Stages wrap the work they do for one doc in stage_timer(stage, doc_id). The
+timer records wall and CPU time, and whether the block raised. Code running
+inside the block adds counters with add(): pages, bytes_read, and for model
+calls llm_calls, llm_latency_s, prompt_tokens, response_tokens, retries and
+cache_hits. A nested timer for the same stage folds into the outer one, so
+validate_doc -> validate_data is one row.
+
+Every process started from one command shares a run_id (PIPELINE_RUN_ID is
+inherited by pool and worker processes). Summarise with:
+
+    python scripts/telemetry.py report [--run RUN_ID | --last] [--stage STAGE]
+    python scripts/telemetry.py runs
+"""
+import os
+import time
+import sqlite3
+import argparse
+import atexit
+import threading
+import multiprocessing.util
+from contextlib import contextmanager
+import pandas as pd
+import yaml
+from db import DB_PATH
+
+COUNTERS = ('bytes_read', 'pages', 'llm_calls', 'llm_latency_s', 'prompt_tokens',
+            'response_tokens', 'retries', 'cache_hits')
+INT_COUNTERS = [name for name in COUNTERS if name != 'llm_latency_s']
+
+RUN_ID = os.environ.setdefault('PIPELINE_RUN_ID', f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+
+# Short: a stage may itself hold the write lock (an open transaction on its
+# own connection), and waiting on it would stall that stage
+BUSY_TIMEOUT = 0.5
+
+_local = threading.local()
+_enabled = None
+# Rows that found the database locked; written with the next row or at exit.
+# Owned by one process: a forked child must not write its parent's rows again
+_pending = []
+_pending_lock = threading.Lock()
+_pending_pid = os.getpid()
+_fork_lock = threading.Lock()
+
+def is_enabled():
+    global _enabled
+    if _enabled is None:
+        try:
+            with open('run_config.yaml', 'r') as f:
+                config = yaml.safe_load(f) or {}
+        except FileNotFoundError:
+            config = {}
+        _enabled = config.get('telemetry', {}).get('enabled', True)
+    return _enabled
+
+def ensure_table(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS stage_metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id TEXT,
+            stage TEXT,
+            doc_id TEXT,
+            started_at REAL,
+            wall_s REAL,
+            cpu_s REAL,
+            bytes_read INTEGER,
+            pages INTEGER,
+            llm_calls INTEGER,
+            llm_latency_s REAL,
+            prompt_tokens INTEGER,
+            response_tokens INTEGER,
+            retries INTEGER,
+            cache_hits INTEGER,
+            ok INTEGER,
+            error TEXT
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_stage_metrics_run ON stage_metrics(run_id, stage)")
+
+def _connection():
+    """One connection per thread and process (a forked child must not reuse its parent's)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT)
+        # Losing the last rows on power loss is fine for metrics; skipping
+        # the fsync per commit keeps a row well under a millisecond
+        conn.execute("PRAGMA synchronous=NORMAL")
+        ensure_table(conn.cursor())
+        conn.commit()
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+def _stack():
+    if getattr(_local, 'stack', None) is None:
+        _local.stack = []
+    return _local.stack
+
+class StageRecord:
+    def __init__(self, stage, doc_id):
+        self.stage = stage
+        self.doc_id = doc_id
+        self.counters = {}
+
+    def add(self, **counters):
+        for name, value in counters.items():
+            if value is not None:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+def add(**counters):
+    """Adds counters to the innermost active stage_timer of this thread, if any"""
+    stack = _stack()
+    if stack:
+        stack[-1].add(**counters)
+
+def _queue():
+    """(rows, lock) of this process; a forked child starts with an empty queue"""
+    global _pending, _pending_lock, _pending_pid
+    if _pending_pid != os.getpid():
+        # Only ever taken in a child, so never inherited in a held state
+        with _fork_lock:
+            if _pending_pid != os.getpid():
+                _pending, _pending_lock, _pending_pid = [], threading.Lock(), os.getpid()
+                # Pool and worker children leave through os._exit, which skips atexit
+                multiprocessing.util.Finalize(None, _flush_at_exit, exitpriority=10)
+    return _pending, _pending_lock
+
+def flush(timeout=None):
+    """Writes queued rows; returns False if the database is still locked"""
+    pending, pending_lock = _queue()
+    with pending_lock:
+        rows = list(pending)
+        pending.clear()
+    if not rows:
+        return True
+    try:
+        conn = _connection()
+        if timeout is not None:
+            conn.execute(f"PRAGMA busy_timeout = {int(timeout * 1000)}")
+        conn.executemany(f'''
+            INSERT INTO stage_metrics (run_id, stage, doc_id, started_at, wall_s, cpu_s, {', '.join(COUNTERS)}, ok, error)
+            VALUES (?, ?, ?, ?, ?, ?, {', '.join('?' * len(COUNTERS))}, ?, ?)
+        ''', rows)
+        conn.commit()
+        return True
+    except sqlite3.OperationalError as e:
+        if 'locked' not in str(e):
+            # Metrics must never fail a stage
+            print(f"  telemetry: dropped {len(rows)} rows: {e}")
+            return True
+        with pending_lock:
+            pending[:0] = rows
+        return False
+    finally:
+        if timeout is not None and getattr(_local, 'conn', None) is not None:
+            _local.conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT * 1000)}")
+
+def write_record(record, started_at, wall_s, cpu_s, error):
+    values = [record.counters.get(name) for name in COUNTERS]
+    pending, pending_lock = _queue()
+    with pending_lock:
+        pending.append((RUN_ID, record.stage, record.doc_id, started_at, wall_s, cpu_s, *values,
+                         int(error is None), None if error is None else str(error)[:200]))
+    flush()
+
+@atexit.register
+def _flush_at_exit():
+    pending, _ = _queue()
+    if pending and not flush(timeout=30):
+        print(f"  telemetry: database locked, dropped {len(pending)} rows")
+
+@contextmanager
+def stage_timer(stage, doc_id=None):
+    """Times one doc's work in a stage; yields the record so the block can add counters"""
+    stack = _stack()
+    if not is_enabled() or (stack and stack[-1].stage == stage):
+        yield stack[-1] if stack else StageRecord(stage, doc_id)
+        return
+
+    record = StageRecord(stage, doc_id)
+    stack.append(record)
+    started_at = time.time()
+    wall_start = time.perf_counter()
+    # Thread CPU time: extraction runs several docs at once on threads
+    cpu_start = time.thread_time()
+    error = None
+    try:
+        yield record
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        stack.pop()
+        write_record(record, started_at, time.perf_counter() - wall_start, time.thread_time() - cpu_start, error)
+
+def load_metrics(run_id=None, stage=None, since_hours=None):
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    ensure_table(conn.cursor())
+    filters, params = [], []
+    if run_id:
+        filters.append("run_id = ?")
+        params.append(run_id)
+    if stage:
+        filters.append("stage = ?")
+        params.append(stage)
+    if since_hours:
+        filters.append("started_at >= ?")
+        params.append(time.time() - since_hours * 3600)
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    df = pd.read_sql_query(f"SELECT * FROM stage_metrics {where}", conn, params=params)
+    conn.close()
+    return df
+
+def per_doc(df):
+    """One row per (run, stage, doc): chunked paging and retried stages are summed"""
+    df = df.assign(ended_at=df['started_at'] + df['wall_s'], doc_id=df['doc_id'].fillna(''))
+    sums = {name: 'sum' for name in ('wall_s', 'cpu_s') + COUNTERS}
+    docs = df.groupby(['run_id', 'stage', 'doc_id'], as_index=False).agg(
+        started_at=('started_at', 'min'), ended_at=('ended_at', 'max'), ok=('ok', 'min'),
+        **{name: (name, how) for name, how in sums.items()}
+    )
+    return docs.astype({name: int for name in INT_COUNTERS})
+
+def stage_summary(docs):
+    rows = []
+    for stage, group in docs.groupby('stage', sort=False):
+        # Busy time per run, so idle time between runs doesn't dilute throughput
+        spans = group.groupby('run_id').apply(lambda g: g['ended_at'].max() - g['started_at'].min(), include_groups=False)
+        busy = spans.sum()
+        llm = group[group['llm_calls'] > 0]
+        rows.append({
+            'stage': stage,
+            'docs': len(group),
+            'failed': int((group['ok'] == 0).sum()),
+            'docs/s': len(group) / busy if busy > 0 else float('nan'),
+            'p50_s': group['wall_s'].quantile(0.5),
+            'p95_s': group['wall_s'].quantile(0.95),
+            'cpu_s': group['cpu_s'].sum(),
+            'pages': group['pages'].sum(),
+            'MB_read': group['bytes_read'].sum() / 1e6,
+            'llm_calls': group['llm_calls'].sum(),
+            'llm_p50_s': llm['llm_latency_s'].quantile(0.5) if len(llm) else float('nan'),
+            'llm_p95_s': llm['llm_latency_s'].quantile(0.95) if len(llm) else float('nan'),
+            'tokens_in': group['prompt_tokens'].sum(),
+            'tokens_out': group['response_tokens'].sum(),
+            'retries': group['retries'].sum(),
+            'cache_hits': group['cache_hits'].sum(),
+        })
+    return pd.DataFrame(rows)
+
+def report(run_id=None, last=False, stage=None, since_hours=None, top=10):
+    if last:
+        runs = list_runs()
+        if runs.empty:
+            print("No metrics recorded yet.")
+            return
+        run_id = runs.iloc[0]['run_id']
+    df = load_metrics(run_id, stage, since_hours)
+    if df.empty:
+        print("No metrics recorded for this selection.")
+        return
+    docs = per_doc(df.fillna({name: 0 for name in COUNTERS}))
+
+    print(f"Run: {run_id or 'all'}{f' (last {since_hours}h)' if since_hours else ''}")
+    print(stage_summary(docs).to_string(index=False, float_format=lambda v: f"{v:.3f}", na_rep='-'))
+
+    slowest = docs.nlargest(top, 'wall_s')[['stage', 'doc_id', 'wall_s', 'cpu_s', 'pages', 'llm_latency_s', 'ok']]
+    print(f"\nSlowest {len(slowest)} docs:")
+    print(slowest.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+
+def list_runs():
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    ensure_table(conn.cursor())
+    runs = pd.read_sql_query('''
+        SELECT run_id, GROUP_CONCAT(DISTINCT stage) AS stages, COUNT(*) AS records,
+               datetime(MIN(started_at), 'unixepoch', 'localtime') AS started
+        FROM stage_metrics GROUP BY run_id ORDER BY MIN(started_at) DESC
+    ''', conn)
+    conn.close()
+    return runs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage pipeline metrics")
+    sub = parser.add_subparsers(dest='command', required=True)
+    report_parser = sub.add_parser('report', help="Throughput, p50/p95 latency and slowest docs per stage")
+    report_parser.add_argument('--run', help="Only this run_id (see 'runs')")
+    report_parser.add_argument('--last', action='store_true', help="Only the most recent run")
+    report_parser.add_argument('--stage', help="Only this stage (index, pages, triage, extract, extract_chunk, repair, validate, images, export)")
+    report_parser.add_argument('--since', type=float, help="Only the last N hours")
+    report_parser.add_argument('--top', type=int, default=10, help="Slowest docs to list")
+    sub.add_parser('runs', help="List recorded runs, newest first")
+    args = parser.parse_args()
+
+    if args.command == 'runs':
+        print(list_runs().to_string(index=False))
+    else:
+        report(run_id=args.run, last=args.last, stage=args.stage, since_hours=args.since, top=args.top)
@@ -0,0 +1,163 @@
+"""Page text backends for 03_pages_text.py.
+
+- pdfium: fast. Text, word boxes and path counts come straight from
+  pypdfium2 (already installed with pdfplumber), about 5x faster per page.
+- pdfplumber: slower, better at reading order and spacing in tables.
+- tiered (default): pdfium for every page; a page goes through pdfplumber
+  only when its pdfium layout looks like a table (table_score at least
+  paging.plumber_table_score) or its text looks broken.
+
+Every backend returns (text, layout) with the page_layout record format;
+layout['backend'] says which one produced the page, plus the reason when
+tiered sent it to pdfplumber.
+"""
+import ctypes
+import pdfplumber
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_raw
+import page_layout
+
+BACKENDS = ('tiered', 'pdfium', 'pdfplumber')
+# Same split rule as pdfplumber's extract_words (x_tolerance)
+WORD_GAP = 3
+# Thinner than this (points) a path is a ruling line, else a rectangle
+LINE_THICKNESS = 2
+
+def tool_versions():
+    return {'pdfplumber': pdfplumber.__version__, 'pypdfium2': str(pdfium.PYPDFIUM_INFO)}
+
+def page_count(pdf_path):
+    doc = pdfium.PdfDocument(pdf_path)
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+class PdfSource:
+    """One PDF opened lazily in each backend, so pdfplumber is only paid for when used"""
+
+    def __init__(self, pdf_path):
+        self.pdf_path = pdf_path
+        self._pdfium = None
+        self._plumber = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def pdfium(self):
+        if self._pdfium is None:
+            self._pdfium = pdfium.PdfDocument(self.pdf_path)
+        return self._pdfium
+
+    def plumber(self):
+        if self._plumber is None:
+            self._plumber = pdfplumber.open(self.pdf_path)
+        return self._plumber
+
+    def close(self):
+        if self._pdfium is not None:
+            self._pdfium.close()
+            self._pdfium = None
+        if self._plumber is not None:
+            self._plumber.close()
+            self._plumber = None
+
+def pdfium_words(textpage, page_height):
+    """[[text, x0, top, x1, bottom]] split on whitespace and on gaps wider than WORD_GAP"""
+    words = []
+    chars, x0, top, x1, bottom = [], 0.0, 0.0, 0.0, 0.0
+    left, right, low, high = (ctypes.c_double() for _ in range(4))
+    for k in range(textpage.count_chars()):
+        ch = chr(pdfium_raw.FPDFText_GetUnicode(textpage.raw, k))
+        boxed = not ch.isspace() and pdfium_raw.FPDFText_GetCharBox(
+            textpage.raw, k, ctypes.byref(left), ctypes.byref(right), ctypes.byref(low), ctypes.byref(high))
+        if chars and (not boxed or left.value - x1 > WORD_GAP):
+            words.append(["".join(chars), round(x0, 1), round(top, 1), round(x1, 1), round(bottom, 1)])
+            chars = []
+        if not boxed:
+            continue
+        char_top, char_bottom = page_height - high.value, page_height - low.value
+        if chars:
+            x1, top, bottom = max(x1, right.value), min(top, char_top), max(bottom, char_bottom)
+        else:
+            x0, x1, top, bottom = left.value, right.value, char_top, char_bottom
+        chars.append(ch)
+    if chars:
+        words.append(["".join(chars), round(x0, 1), round(top, 1), round(x1, 1), round(bottom, 1)])
+    return words
+
+def pdfium_page(doc, i):
+    page = doc[i]
+    textpage = page.get_textpage()
+    try:
+        text = textpage.get_text_range().replace('\r\n', '\n').replace('\r', '\n')
+        width, height = page.get_size()
+        words = pdfium_words(textpage, height)
+        lines = rects = text_objects = 0
+        for obj in page.get_objects(filter=[pdfium_raw.FPDF_PAGEOBJ_PATH, pdfium_raw.FPDF_PAGEOBJ_TEXT], max_depth=2):
+            if obj.type == pdfium_raw.FPDF_PAGEOBJ_TEXT:
+                text_objects += 1
+                continue
+            obj_left, obj_bottom, obj_right, obj_top = obj.get_bounds()
+            if min(obj_right - obj_left, obj_top - obj_bottom) < LINE_THICKNESS:
+                lines += 1
+            else:
+                rects += 1
+    finally:
+        textpage.close()
+        page.close()
+    layout = {
+        'page': i,
+        'width': round(width, 1),
+        'height': round(height, 1),
+        'words': words,
+        'lines': lines,
+        'rects': rects,
+        'table_score': page_layout.table_score(words, lines, rects),
+        'backend': 'pdfium',
+    }
+    return text, layout, text_objects
+
+def plumber_page(pdf, i):
+    page = pdf.pages[i]
+    text = page.extract_text() or ""
+    layout = page_layout.page_layout(page)
+    layout['backend'] = 'pdfplumber'
+    # Parsed objects stay cached on the page otherwise
+    page.close()
+    return text, layout
+
+def broken_reason(text, words, text_objects):
+    """Why fast output can't be trusted, or None"""
+    stripped = "".join(text.split())
+    if text_objects and not stripped:
+        return 'no_text'
+    if not stripped:
+        return None
+    bad = sum(1 for ch in stripped if ch == '\ufffd' or ord(ch) < 32)
+    if bad / len(stripped) > 0.05:
+        return 'garbled'
+    if len(stripped) >= 200 and sum(ch.isalnum() for ch in stripped) / len(stripped) < 0.5:
+        return 'garbled'
+    if words and len(stripped) >= 100 and len(stripped) / len(words) > 20:
+        return 'no_spaces'
+    return None
+
+def extract_page(source, i, backend='tiered', table_threshold=0.4):
+    """Returns (text, layout) for page i of a PdfSource"""
+    if backend == 'pdfplumber':
+        return plumber_page(source.plumber(), i)
+    text, layout, text_objects = pdfium_page(source.pdfium(), i)
+    if backend == 'pdfium':
+        return text, layout
+    reason = broken_reason(text, layout['words'], text_objects)
+    if reason is None and layout['table_score'] >= table_threshold:
+        reason = 'table'
+    if reason is None:
+        return text, layout
+    text, layout = plumber_page(source.plumber(), i)
+    layout['reason'] = reason
+    return text, layout
@@ -0,0 +1,217 @@
+"""Watches pdf_dir and ingests each new PDF as soon as it is fully written.
+
+A new or replaced file is hashed and added to pdf_index.csv, inserted into
+state.sqlite, paged into the page store and search index, and triaged -
+for that file only, without rescanning the directory. On Linux the
+directory is watched with inotify (close-after-write and moved-in
+events); elsewhere, or if inotify is unavailable, it is polled.
+
+A file counts as fully written once its size and mtime have not changed
+for watch.settle_seconds. The doc is leased like in 07_worker.py, so the
+watcher can run next to workers; with --index-only it stops after
+state.sqlite and leaves paging and triage to them.
+"""
+import os
+import time
+import errno
+import struct
+import select
+import socket
+import argparse
+import ctypes
+import ctypes.util
+import importlib
+import yaml
+import search_index
+from db import init_db, get_connection, sync_doc, claim_next_doc, complete_lease
+
+index = importlib.import_module('02_index_pdfs')
+pages_text = importlib.import_module('03_pages_text')
+triage = importlib.import_module('04_triage')
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+EVENT_HEADER = struct.Struct('iIII')
+
+def load_config():
+    with open('run_config.yaml', 'r') as f:
+        return yaml.safe_load(f)
+
+def is_pdf(name):
+    return name.lower().endswith('.pdf')
+
+class InotifyWatch:
+    """Minimal ctypes binding: yields names closed-after-write or moved into a dir"""
+
+    def __init__(self, directory):
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise OSError("libc not found")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify not available")
+        self.fd = libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+
+    def read(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        names = []
+        offset = 0
+        while offset < len(buf):
+            _, _, _, name_len = EVENT_HEADER.unpack_from(buf, offset)
+            offset += EVENT_HEADER.size
+            name = buf[offset:offset + name_len].rstrip(b'\0')
+            offset += name_len
+            if name:
+                names.append(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+class PollWatch:
+    """Fallback: reports names whose (size, mtime) changed since the last scan"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.seen = self.scan()
+
+    def scan(self):
+        return {os.path.basename(path): st for path, st in index.scan_pdf_dir(self.directory).items()}
+
+    def read(self, timeout):
+        time.sleep(timeout)
+        current = self.scan()
+        names = [name for name, st in current.items() if self.seen.get(name) != st]
+        self.seen = current
+        return names
+
+    def close(self):
+        pass
+
+def open_watch(directory, use_inotify):
+    if use_inotify:
+        try:
+            watch = InotifyWatch(directory)
+            print(f"Watching {directory}/ with inotify")
+            return watch
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable ({e}); polling instead")
+    print(f"Polling {directory}/")
+    return PollWatch(directory)
+
+def unindexed_pdfs(pdf_dir):
+    """PDFs whose path, size or mtime differ from the hash cache (catch-up on start)"""
+    cache = index.load_hash_cache()
+    pending = []
+    for path, (size, mtime_ns) in index.scan_pdf_dir(pdf_dir).items():
+        entry = cache.get(path)
+        if not entry or entry['size'] != size or entry['mtime_ns'] != mtime_ns:
+            pending.append(path)
+    return pending
+
+def ingest_pdf(path, owner, lease_seconds, index_only=False):
+    """Indexes, pages and triages one settled PDF"""
+    started = time.perf_counter()
+    try:
+        doc_id, change = index.index_pdf(path)
+    except OSError as e:
+        # Deleted, renamed or made unreadable after it settled; a later
+        # event for the path queues it again
+        print(f"  Skipping {path}: {e}")
+        return
+
+    conn = get_connection()
+    c = conn.cursor()
+    status = sync_doc(c, doc_id, path)
+    conn.commit()
+    conn.close()
+
+    if change:
+        print(f"  {change}: {path} -> {doc_id[:8]}...")
+    if index_only or status not in ('indexed', 'paged'):
+        return
+
+    # Skip docs a worker is already processing
+    if claim_next_doc(owner, ('indexed', 'paged'), lease_seconds, doc_id=doc_id) is None:
+        return
+    try:
+        num_pages = pages_text.extract_doc_pages(doc_id, path)
+        search_index.update_index([doc_id])
+        result = triage.triage_doc(doc_id)
+    except Exception as e:
+        complete_lease(doc_id, owner, notes=f"watch: {e}")
+        print(f"  Error ingesting {doc_id}: {e}")
+        return
+
+    if result is None:
+        complete_lease(doc_id, owner, status='paged')
+        return
+    label, new_status = result
+    complete_lease(doc_id, owner, status=new_status, triage_label=label)
+    print(f"  {doc_id[:8]}... {num_pages} pages -> {label} (ingested in {time.perf_counter() - started:.1f}s)")
+
+def watch(index_only=False, once=False):
+    config = load_config()
+    pdf_dir = config.get('pdf_dir', 'pdfs')
+    watch_config = config.get('watch', {})
+    settle_seconds = watch_config.get('settle_seconds', 1.0)
+    poll_interval = watch_config.get('poll_interval', 2.0)
+    lease_seconds = config.get('worker', {}).get('lease_seconds', 300)
+    owner = f"{socket.gethostname()}:{os.getpid()}:watch"
+
+    os.makedirs(pdf_dir, exist_ok=True)
+    init_db()
+
+    watcher = open_watch(pdf_dir, watch_config.get('use_inotify', True))
+    # path -> ((size, mtime_ns), time that state was first seen)
+    pending = {path: (None, time.monotonic()) for path in unindexed_pdfs(pdf_dir)}
+    try:
+        while True:
+            timeout = settle_seconds if pending else poll_interval
+            for name in watcher.read(timeout):
+                if is_pdf(name):
+                    pending[os.path.join(pdf_dir, name)] = (None, time.monotonic())
+
+            now = time.monotonic()
+            for path, (last_state, since) in list(pending.items()):
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    del pending[path]
+                    continue
+                state = (st.st_size, st.st_mtime_ns)
+                if state != last_state:
+                    pending[path] = (state, now)
+                elif st.st_size > 0 and now - since >= settle_seconds:
+                    del pending[path]
+                    ingest_pdf(path, owner, lease_seconds, index_only)
+
+            if once and not pending:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest PDFs dropped into pdf_dir as they arrive")
+    parser.add_argument('--index-only', action='store_true', help="Only index and register new PDFs; leave paging and triage to 07_worker.py")
+    parser.add_argument('--once', action='store_true', help="Ingest PDFs not yet indexed, then exit")
+    args = parser.parse_args()
+
+    watch(index_only=args.index_only, once=args.once)
@@ -0,0 +1,30 @@
+"""Shared fixtures: scripts/ on sys.path and a throwaway workspace.
+
+Pipeline scripts use paths relative to the working directory (state.sqlite,
+pages_text/, schemas/, run_config.yaml), so each test runs from its own
+tmp_path holding a copy of schemas/ and run_config.yaml.
+"""
+import os
+import sys
+import shutil
+import importlib
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO, 'scripts'))
+
+def load_script(name):
+    """Digit-prefixed scripts (05_extract, 06_validate...) can't be imported by name"""
+    return importlib.import_module(name)
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    shutil.copytree(os.path.join(REPO, 'schemas'), tmp_path / 'schemas')
+    shutil.copy(os.path.join(REPO, 'run_config.yaml'), tmp_path / 'run_config.yaml')
+    monkeypatch.chdir(tmp_path)
+    # Telemetry keeps a connection per thread, opened in whichever workspace came first
+    telemetry = sys.modules.get('telemetry')
+    if telemetry is not None and getattr(telemetry._local, 'conn', None) is not None:
+        telemetry._local.conn.close()
+        telemetry._local.conn = None
+    return tmp_path
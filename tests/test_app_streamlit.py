@@ -0,0 +1,48 @@
+import os
+from streamlit.testing.v1 import AppTest
+from db import init_db, get_connection
+from page_store import append_page, doc_dir_for
+from conftest import REPO
+
+APP = os.path.join(REPO, 'app_streamlit.py')
+
+def test_each_session_gets_its_own_connection(workspace):
+    first = AppTest.from_file(APP, default_timeout=30).run()
+    second = AppTest.from_file(APP, default_timeout=30).run()
+    assert not first.exception and not second.exception
+    assert first.session_state['db'] is not second.session_state['db']
+    # Reruns of one session keep theirs
+    db = first.session_state['db']
+    first.run()
+    assert first.session_state['db'] is db
+
+def open_page_files():
+    fd_dir = f"/proc/{os.getpid()}/fd"
+    paths = []
+    for fd in os.listdir(fd_dir):
+        try:
+            paths.append(os.readlink(os.path.join(fd_dir, fd)))
+        except OSError:
+            pass
+    return [path for path in paths if path.endswith('pages.bin')]
+
+def test_page_text_follows_reextraction_without_open_stores(workspace):
+    init_db()
+    conn = get_connection()
+    conn.execute("INSERT INTO docs (doc_id, pdf_path, status) VALUES ('doc', 'pdfs/doc.pdf', 'needs_review')")
+    conn.commit()
+    conn.close()
+    doc_dir = doc_dir_for('doc')
+    os.makedirs(doc_dir)
+    append_page(doc_dir, 1, "first version")
+    append_page(doc_dir, 2, "second page")
+
+    app = AppTest.from_file(APP, default_timeout=30).run()
+    assert not app.exception
+    assert app.text_area[0].value == "first version"
+    if os.path.isdir('/proc/self/fd'):
+        assert open_page_files() == []
+
+    append_page(doc_dir, 1, "re-extracted")
+    app.run()
+    assert app.text_area[0].value == "re-extracted"
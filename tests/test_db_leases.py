@@ -0,0 +1,77 @@
+from db import init_db, get_connection, claim_next_doc, renew_lease, complete_lease, fail_lease
+
+def add_doc(doc_id, status='indexed'):
+    conn = get_connection()
+    conn.execute("INSERT INTO docs (doc_id, pdf_path, status) VALUES (?, ?, ?)",
+                 (doc_id, f"pdfs/{doc_id}.pdf", status))
+    conn.commit()
+    conn.close()
+
+def doc_row(doc_id):
+    conn = get_connection()
+    row = conn.execute("SELECT status, lock_owner, attempts, notes FROM docs WHERE doc_id = ?",
+                       (doc_id,)).fetchone()
+    conn.close()
+    return row
+
+def age_lease(doc_id, seconds):
+    conn = get_connection()
+    conn.execute("UPDATE docs SET lock_ts = datetime('now', ?) WHERE doc_id = ?", (f"-{seconds} seconds", doc_id))
+    conn.commit()
+    conn.close()
+
+def test_claim_leases_each_doc_once(workspace):
+    init_db()
+    add_doc('a')
+    add_doc('b')
+    add_doc('c', status='extracted_raw')
+    first = claim_next_doc('w1', ['indexed'], 600)
+    second = claim_next_doc('w2', ['indexed'], 600)
+    assert {first[0], second[0]} == {'a', 'b'}
+    assert claim_next_doc('w3', ['indexed'], 600) is None
+    assert doc_row(first[0])[1] == 'w1'
+    assert claim_next_doc('w3', ['indexed'], 600, doc_id='c') is None
+
+def test_expired_lease_is_claimable_again(workspace):
+    init_db()
+    add_doc('a')
+    assert claim_next_doc('w1', ['indexed'], 600)[0] == 'a'
+    age_lease('a', 1200)
+    assert claim_next_doc('w2', ['indexed'], 600)[0] == 'a'
+    # The first worker lost its lease and can no longer act on the doc
+    assert not renew_lease('a', 'w1')
+    assert not complete_lease('a', 'w1', status='triaged_extractable')
+    assert doc_row('a')[:2] == ('indexed', 'w2')
+
+def test_complete_lease_releases_and_resets_attempts(workspace):
+    init_db()
+    add_doc('a')
+    claim_next_doc('w1', ['indexed'], 600)
+    fail_lease('a', 'w1', "boom", max_attempts=3)
+    assert complete_lease('a', 'w1', status='triaged_extractable', notes="ok", triage_label='extractable')
+    assert doc_row('a') == ('triaged_extractable', None, 0, "ok")
+    conn = get_connection()
+    assert conn.execute("SELECT triage_label FROM docs WHERE doc_id = 'a'").fetchone()[0] == 'extractable'
+    conn.close()
+
+def test_fail_lease_keeps_lease_until_max_attempts(workspace):
+    init_db()
+    add_doc('a')
+    claim_next_doc('w1', ['indexed'], 600)
+    assert not fail_lease('a', 'w1', "first", max_attempts=2)
+    # Still leased: not retried before the lease expires
+    assert doc_row('a') == ('indexed', 'w1', 1, "first")
+    assert claim_next_doc('w2', ['indexed'], 600) is None
+
+    age_lease('a', 1200)
+    assert claim_next_doc('w2', ['indexed'], 600)[0] == 'a'
+    assert fail_lease('a', 'w2', "second", max_attempts=2)
+    assert doc_row('a') == ('failed', None, 2, "second")
+    assert claim_next_doc('w3', ['indexed'], 0) is None
+
+def test_fail_lease_ignores_other_owners(workspace):
+    init_db()
+    add_doc('a')
+    claim_next_doc('w1', ['indexed'], 600)
+    assert not fail_lease('a', 'w2', "not mine", max_attempts=1)
+    assert doc_row('a') == ('indexed', 'w1', 0, None)
@@ -0,0 +1,76 @@
+import os
+import json
+import shutil
+import pyarrow as pa
+from db import init_db, get_connection
+from export_tables import TABLES
+from conftest import load_script
+
+export = load_script('08_export')
+extract = load_script('05_extract')
+
+def write_doc(doc_id, retrofit_value=100, measurements=1):
+    data = extract.get_mock_extraction(doc_id)
+    data['measurements'] = [dict(data['measurements'][0], retrofit_value=retrofit_value + k)
+                            for k in range(measurements)]
+    os.makedirs('extractions_valid', exist_ok=True)
+    with open(os.path.join('extractions_valid', f'{doc_id}.json'), 'w') as f:
+        json.dump(data, f)
+    conn = get_connection()
+    conn.execute("INSERT OR REPLACE INTO docs (doc_id, status) VALUES (?, 'validated_ok')", (doc_id,))
+    conn.commit()
+    conn.close()
+
+def remove_doc(doc_id):
+    conn = get_connection()
+    conn.execute("UPDATE docs SET status = 'rejected' WHERE doc_id = ?", (doc_id,))
+    conn.commit()
+    conn.close()
+
+def read_outputs():
+    tables = {}
+    for name in TABLES:
+        with pa.memory_map(os.path.join(export.EXPORT_DIR, f'{name}.arrow'), 'r') as source:
+            tables[name] = pa.ipc.open_file(source).read_all()
+    return tables
+
+def test_incremental_matches_full_rebuild(workspace):
+    init_db()
+    for i in range(0, 12, 2):
+        write_doc(f'd{i:02d}', measurements=1 + i % 3)
+    # Small batches: new docs land inside cached record batches, not just between them
+    export.run_export(formats=['arrow', 'csv'], batch_docs=2, full=True)
+
+    write_doc('d04', retrofit_value=42)          # changed
+    remove_doc('d06')                            # removed
+    write_doc('d01', measurements=2)             # new, before the first cached doc
+    write_doc('d07')                             # new, inside a cached batch
+    write_doc('d99', measurements=3)             # new, after the last one
+    counts = export.run_export(formats=['arrow', 'csv'], batch_docs=2)
+    incremental = read_outputs()
+
+    shutil.rmtree(export.EXPORT_DIR)
+    assert export.run_export(formats=['arrow', 'csv'], batch_docs=2, full=True) == counts
+    full = read_outputs()
+    for name in TABLES:
+        assert incremental[name].equals(full[name]), name
+    doc_ids = full['unified_outcomes']['doc_id'].to_pylist()
+    assert doc_ids == sorted(doc_ids) and 'd06' not in doc_ids
+    assert sum(1 for d in doc_ids if d == 'd99') == 3
+
+def test_nothing_changed(workspace):
+    init_db()
+    write_doc('d00')
+    export.run_export(formats=['arrow'], full=True)
+    assert export.run_export(formats=['arrow']) is None
+
+def test_cache_does_not_fragment(workspace):
+    init_db()
+    for i in range(6):
+        write_doc(f'd{i:02d}')
+    export.run_export(formats=['arrow'], batch_docs=3, full=True)
+    for run in range(3):
+        write_doc(f'd{run:02d}', retrofit_value=run)
+        export.run_export(formats=['arrow'], batch_docs=3)
+    with pa.memory_map(export.cache_path('unified_outcomes'), 'r') as source:
+        assert pa.ipc.open_file(source).num_record_batches == 2
@@ -0,0 +1,53 @@
+import os
+from conftest import load_script
+
+index = load_script('02_index_pdfs')
+
+def row(path, doc_hash, **extra):
+    return dict(index.new_index_row(path, doc_hash, 10), **extra)
+
+def stats_for(hashes):
+    return {path: (10, 0) for path in hashes}
+
+def test_unchanged_rows_keep_manual_columns():
+    old = [row('pdfs/a.pdf', 'h1', extracted_title="Matched by hand", needs_manual_match=False)]
+    rows, report = index.merge_index(old, {'pdfs/a.pdf': 'h1'}, stats_for(['pdfs/a.pdf']))
+    assert rows == old
+    assert report == {'added': [], 'removed': [], 'moved': [], 'changed': []}
+
+def test_moved_file_keeps_its_row():
+    old = [row('pdfs/a.pdf', 'h1', extracted_title="Matched by hand")]
+    hashes = {'pdfs/sub/a.pdf': 'h1'}
+    rows, report = index.merge_index(old, hashes, stats_for(hashes))
+    assert report['moved'] == [('pdfs/a.pdf', 'pdfs/sub/a.pdf')]
+    assert report['removed'] == [] and report['added'] == []
+    assert rows == [dict(old[0], pdf_path='pdfs/sub/a.pdf')]
+
+def test_added_removed_and_changed():
+    old = [row('pdfs/a.pdf', 'h1'), row('pdfs/b.pdf', 'h2')]
+    hashes = {'pdfs/a.pdf': 'h1-edited', 'pdfs/c.pdf': 'h3'}
+    rows, report = index.merge_index(old, hashes, stats_for(hashes))
+    assert report['changed'] == ['pdfs/a.pdf']
+    assert report['added'] == ['pdfs/c.pdf']
+    assert report['removed'] == ['pdfs/b.pdf']
+    assert {r['pdf_path']: r['doc_id'] for r in rows} == {'pdfs/a.pdf': 'h1-edited', 'pdfs/c.pdf': 'h3'}
+
+def test_copy_is_added_not_moved():
+    # Same bytes at a second path while the original is still there
+    old = [row('pdfs/a.pdf', 'h1')]
+    hashes = {'pdfs/a.pdf': 'h1', 'pdfs/copy.pdf': 'h1'}
+    rows, report = index.merge_index(old, hashes, stats_for(hashes))
+    assert report['added'] == ['pdfs/copy.pdf'] and report['moved'] == []
+    assert len(rows) == 2
+
+def test_index_pdf_detects_a_move(workspace):
+    os.makedirs('pdfs/sub')
+    with open('pdfs/a.pdf', 'wb') as f:
+        f.write(b"%PDF-1.4 test bytes")
+    doc_id, change = index.index_pdf('pdfs/a.pdf')
+    assert change == 'added'
+    assert index.index_pdf('pdfs/a.pdf') == (doc_id, None)
+
+    os.rename('pdfs/a.pdf', 'pdfs/sub/a.pdf')
+    assert index.index_pdf('pdfs/sub/a.pdf') == (doc_id, 'moved')
+    assert [r['pdf_path'] for r in index.load_index_rows()] == ['pdfs/sub/a.pdf']
@@ -0,0 +1,33 @@
+import os
+import time
+from llm_cache import ResponseCache, make_key
+
+def evicted_by_other_process(real):
+    """os.remove/os.utime as seen when another process deleted the entry just before"""
+    def call(path, *args, **kwargs):
+        if path.endswith('.json') and os.path.exists(path):
+            os.unlink(path)
+            raise FileNotFoundError(path)
+        return real(path, *args, **kwargs)
+    return call
+
+def test_hit_survives_concurrent_evict(workspace, monkeypatch):
+    cache = ResponseCache()
+    key = make_key('model', 'prompt')
+    cache.put(key, 'answer')
+    monkeypatch.setattr(os, 'utime', evicted_by_other_process(os.utime))
+    assert cache.get(key) == 'answer'
+    monkeypatch.undo()
+    assert cache.get(key) is None
+
+def test_evict_skips_entries_removed_concurrently(workspace, monkeypatch):
+    cache = ResponseCache(max_age_days=1)
+    keys = [make_key('model', f'prompt {i}') for i in range(3)]
+    for key in keys:
+        cache.put(key, 'answer')
+        old = time.time() - 2 * 86400
+        os.utime(cache._entry_path(key), (old, old))
+    monkeypatch.setattr(os, 'remove', evicted_by_other_process(os.remove))
+    assert cache.evict() == 0
+    monkeypatch.undo()
+    assert all(cache.get(key) is None for key in keys)
@@ -0,0 +1,16 @@
+import pytest
+import telemetry
+from llm_client import GeminiClient
+
+class BrokenBucket:
+    def acquire(self):
+        raise RuntimeError("bucket broke")
+
+def test_error_before_request_is_not_hidden(workspace):
+    client = GeminiClient('fake-model', 'test-key', {'max_retries': 0})
+    client.bucket = BrokenBucket()
+    with telemetry.stage_timer('extract', 'doc') as metrics:
+        with pytest.raises(RuntimeError, match="bucket broke"):
+            client.generate("prompt")
+    # Nothing was sent, so no model call is counted
+    assert 'llm_calls' not in metrics.counters
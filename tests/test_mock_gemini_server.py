@@ -0,0 +1,23 @@
+import json
+from mock_gemini_server import MockGemini
+
+def request(text="extract this"):
+    return {'contents': [{'parts': [{'text': text}]}]}
+
+def test_injected_errors_do_not_use_up_quota(workspace):
+    mock = MockGemini(latency='fixed:0', error_rate_5xx=0.5, requests_per_minute=10, seed=1)
+    statuses = [mock.generate('m', request())[0] for _ in range(60)]
+    stats = mock.snapshot()
+    assert statuses.count(200) == 10
+    assert stats['5xx'] > 10
+    assert len(mock.window) == 10
+    assert stats['429_rate_limit'] == 60 - 10 - stats['5xx']
+
+def test_modes(workspace):
+    mock = MockGemini(latency='fixed:0')
+    skeleton = json.loads(mock.answer("MODE: skeleton\n..."))
+    assert 'measurements' not in skeleton and skeleton['comparisons']
+    measurements = json.loads(mock.answer("MODE: measurements\nCOMPARISON_IDS: K1, K2\n"))
+    assert [m['comparison_id'] for m in measurements['measurements']] == ['K1', 'K2']
+    assert mock.answer("MODE: repair_patch\n") == "[]"
+    assert 'measurements' in json.loads(mock.answer("no mode"))
@@ -0,0 +1,40 @@
+import os
+import page_layout
+from page_store import doc_dir_for
+
+def layout(page, score=0.0):
+    return {'page': page, 'width': 612.0, 'height': 792.0, 'words': [["w", 1.0, 2.0, 3.0, 4.0]],
+            'lines': 0, 'rects': 0, 'table_score': score}
+
+def test_append_and_load(workspace):
+    doc_dir = doc_dir_for('doc')
+    os.makedirs(doc_dir)
+    page_layout.append_layout(doc_dir, layout(0))
+    page_layout.append_layout(doc_dir, layout(1, 0.6))
+    page_layout.append_layout(doc_dir, layout(0, 0.5))
+    layouts = page_layout.load_layout('doc')
+    assert sorted(layouts) == [0, 1]
+    assert layouts[0]['table_score'] == 0.5
+    assert page_layout.table_pages('doc', 0.4) == [0, 1]
+
+def test_resume_after_torn_line(workspace):
+    doc_dir = doc_dir_for('doc')
+    os.makedirs(doc_dir)
+    page_layout.append_layout(doc_dir, layout(0))
+    with open(os.path.join(doc_dir, page_layout.LAYOUT_FILE), 'a') as f:
+        f.write('{"page":1,"wid')
+    assert sorted(page_layout.load_layout('doc')) == [0]
+    page_layout.append_layout(doc_dir, layout(1))
+    page_layout.append_layout(doc_dir, layout(2))
+    assert sorted(page_layout.load_layout('doc')) == [0, 1, 2]
+
+def test_damaged_line_mid_file_is_skipped(workspace):
+    doc_dir = doc_dir_for('doc')
+    os.makedirs(doc_dir)
+    with open(os.path.join(doc_dir, page_layout.LAYOUT_FILE), 'w') as f:
+        f.write('{"page":0,"wid{"page":1}\n[]\n')
+    page_layout.append_layout(doc_dir, layout(2))
+    assert sorted(page_layout.load_layout('doc')) == [2]
+
+def test_no_cache(workspace):
+    assert page_layout.load_layout('missing') == {}
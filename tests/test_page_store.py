@@ -0,0 +1,89 @@
+import os
+import page_store
+from page_store import PageStore, append_page, read_index, doc_dir_for
+
+def make_store(pages):
+    doc_dir = doc_dir_for('doc')
+    os.makedirs(doc_dir, exist_ok=True)
+    for page, text in pages.items():
+        append_page(doc_dir, page, text)
+    return doc_dir
+
+def test_round_trip(workspace):
+    make_store({0: "first", 1: "", 2: "dritte Seite – ü"})
+    with PageStore('doc') as store:
+        assert store.pages() == [0, 1, 2]
+        assert store.read_range() == [{'page': 0, 'text': "first"}, {'page': 1, 'text': ""},
+                                      {'page': 2, 'text': "dritte Seite – ü"}]
+        assert store.read_range(1, 2) == [{'page': 1, 'text': ""}]
+
+def test_later_entry_for_a_page_wins(workspace):
+    doc_dir = make_store({0: "old"})
+    append_page(doc_dir, 0, "new")
+    assert page_store.load_page('doc', 0) == "new"
+
+def test_torn_index_line_is_not_a_checkpoint(workspace):
+    doc_dir = make_store({0: "aaaa", 1: "bbbb"})
+    with open(os.path.join(doc_dir, page_store.IDX_FILE), 'a') as f:
+        f.write("2 8")
+    assert sorted(read_index(doc_dir)) == [0, 1]
+
+def test_resume_after_torn_write(workspace):
+    doc_dir = make_store({0: "aaaa", 1: "bbbb", 2: "cccc"})
+    # Killed mid-page: bytes of page 3 half written, index line cut short
+    with open(os.path.join(doc_dir, page_store.BIN_FILE), 'ab') as f:
+        f.write(b"dd")
+    with open(os.path.join(doc_dir, page_store.IDX_FILE), 'a') as f:
+        f.write("3")
+    append_page(doc_dir, 4, "eeee")
+    append_page(doc_dir, 3, "dddd")
+
+    index = read_index(doc_dir)
+    assert sorted(index) == [0, 1, 2, 3, 4]
+    assert 34 not in index
+    with PageStore('doc') as store:
+        assert [p['text'] for p in store.read_range()] == ["aaaa", "bbbb", "cccc", "dddd", "eeee"]
+    assert os.path.getsize(os.path.join(doc_dir, page_store.BIN_FILE)) == 20
+    with open(os.path.join(doc_dir, page_store.IDX_FILE)) as f:
+        assert f.read().endswith("4 12 4\n3 16 4\n")
+
+def test_unreferenced_bytes_are_dropped(workspace):
+    # Crash after the bytes were written but before the index line
+    doc_dir = make_store({0: "aaaa"})
+    with open(os.path.join(doc_dir, page_store.BIN_FILE), 'ab') as f:
+        f.write(b"orphan")
+    append_page(doc_dir, 1, "bbbb")
+    assert read_index(doc_dir)[1] == (4, 4)
+    assert page_store.load_page('doc', 1) == "bbbb"
+
+def test_torn_first_line(workspace):
+    doc_dir = doc_dir_for('doc')
+    os.makedirs(doc_dir)
+    with open(os.path.join(doc_dir, page_store.IDX_FILE), 'w') as f:
+        f.write("0 0")
+    with open(os.path.join(doc_dir, page_store.BIN_FILE), 'wb') as f:
+        f.write(b"xx")
+    append_page(doc_dir, 0, "text")
+    assert read_index(doc_dir) == {0: (0, 4)}
+    assert page_store.load_page('doc', 0) == "text"
+
+def test_truncate_torn_tail_long_lines(workspace):
+    path = 'lines.jsonl'
+    long_line = "x" * 10000
+    with open(path, 'w') as f:
+        f.write(f"a\n{long_line}\nyzz")
+    assert page_store.truncate_torn_tail(path) == long_line
+    with open(path) as f:
+        assert f.read() == f"a\n{long_line}\n"
+    assert page_store.truncate_torn_tail('missing') is None
+
+def test_legacy_tree_migrates(workspace):
+    doc_dir = doc_dir_for('doc')
+    os.makedirs(doc_dir)
+    for page in (0, 1, 10):
+        with open(os.path.join(doc_dir, f'page_{page:03d}.txt'), 'w') as f:
+            f.write(f"page {page}")
+    with PageStore('doc') as store:
+        assert store.read_range() == [{'page': 0, 'text': "page 0"}, {'page': 1, 'text': "page 1"},
+                                      {'page': 10, 'text': "page 10"}]
+    assert not os.path.exists(os.path.join(doc_dir, 'page_000.txt'))
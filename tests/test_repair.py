@@ -0,0 +1,112 @@
+import os
+import json
+import repair
+from repair import apply_patch, parse_error, to_pointer, from_pointer
+from page_store import append_page, doc_dir_for
+from conftest import load_script
+
+extract = load_script('05_extract')
+
+DATA = {
+    'study': {'study_type': 'simulation'},
+    'measurements': [{'comparison_id': 'K1', 'unit': 'h'}, {'comparison_id': 'K9', 'unit': None}],
+    'comparisons': [{'comparison_id': 'K1'}],
+}
+
+def test_ops_inside_allowed_pointer_apply():
+    data, skipped = apply_patch(DATA, [
+        {'op': 'replace', 'path': '/measurements/1/comparison_id', 'value': 'K1'},
+        {'op': 'add', 'path': '/measurements/1/unit', 'value': 'h'},
+    ], ['/measurements/1'])
+    assert skipped == []
+    assert data['measurements'][1] == {'comparison_id': 'K1', 'unit': 'h'}
+    # The input is left untouched
+    assert DATA['measurements'][1]['comparison_id'] == 'K9'
+
+def test_ops_outside_allowed_pointers_are_skipped():
+    data, skipped = apply_patch(DATA, [
+        {'op': 'replace', 'path': '/measurements/0/unit', 'value': 'kWh'},
+        {'op': 'remove', 'path': '/comparisons/0'},
+        {'op': 'replace', 'path': '/study/study_type', 'value': 'field'},
+        # A sibling index sharing the prefix string is not inside /measurements/1
+        {'op': 'replace', 'path': '/measurements/10', 'value': {}},
+        {'op': 'replace', 'path': '', 'value': {}},
+    ], ['/measurements/1'])
+    assert data == DATA
+    assert len(skipped) == 5
+    assert all("outside the failing objects" in reason for reason in skipped)
+
+def test_whole_failing_object_can_be_replaced_or_removed():
+    data, skipped = apply_patch(DATA, [{'op': 'remove', 'path': '/measurements/1'}], ['/measurements/1'])
+    assert skipped == []
+    assert data['measurements'] == [DATA['measurements'][0]]
+
+def test_root_error_allows_any_path():
+    data, skipped = apply_patch(DATA, [{'op': 'add', 'path': '/building', 'value': {'building_type': 'office'}}], [''])
+    assert skipped == []
+    assert data['building'] == {'building_type': 'office'}
+
+def test_bad_ops_are_skipped_not_raised():
+    data, skipped = apply_patch(DATA, [
+        {'op': 'move', 'path': '/measurements/1/unit', 'from': '/measurements/0/unit'},
+        {'op': 'replace', 'path': '/measurements/1/missing/deeper', 'value': 1},
+        {'op': 'replace', 'path': 'measurements/1'},
+        {'path': '/measurements/1/unit'},
+    ], ['/measurements/1'])
+    assert data == DATA
+    assert len(skipped) == 4
+
+def test_error_paths_map_to_pointers():
+    _, _, tokens, _ = parse_error("BLOCKER | REF | measurements[1].comparison_id | unknown comparison")
+    assert tokens == ['measurements', 1, 'comparison_id']
+    assert to_pointer(repair.failing_object_tokens(tokens)) == '/measurements/1'
+    assert repair.failing_object_tokens(parse_error("BLOCKER | SCHEMA | $ | missing units")[2]) == []
+    assert from_pointer(to_pointer(['a/b', 'c~d', 0])) == ['a/b', 'c~d', '0']
+
+class FailingClient:
+    """Every model call fails, as a 429 would once retries run out"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate(self, prompt, **kwargs):
+        self.calls += 1
+        raise RuntimeError("429 Resource exhausted")
+
+def broken_extraction(doc_id):
+    data = extract.get_mock_extraction(doc_id)
+    data['measurements'][0]['comparison_id'] = 'K9'
+    return data
+
+def make_pages(doc_id):
+    doc_dir = doc_dir_for(doc_id)
+    os.makedirs(doc_dir, exist_ok=True)
+    for page in range(1, 4):
+        append_page(doc_dir, page, f"page {page}: hours reduced from 500 to 100")
+
+def test_failed_repair_call_keeps_extraction(workspace):
+    make_pages('doc')
+    data = broken_extraction('doc')
+    valid, errors = repair.validator.validate_data(data)
+    assert not valid
+    client = FailingClient()
+    config = {'extraction': {'max_retries_fix': 3}}
+
+    result, result_valid, result_errors = repair.repair_doc('doc', data, errors, config, client)
+    assert result == data
+    assert not result_valid and result_errors == errors
+    # A failed call is not retried on top of the client's own retries
+    assert client.calls == 1
+    with open(os.path.join('snippets', 'doc', 'repair_stats.json')) as f:
+        stats = json.load(f)
+    assert not stats['valid']
+    assert "429 Resource exhausted" in stats['attempts'][0]['error']
+
+def test_extract_and_validate_survives_failed_repair(workspace, monkeypatch):
+    make_pages('doc')
+    monkeypatch.setattr(extract, 'extract_doc', lambda doc_id, config, client, schema: broken_extraction(doc_id))
+    config = extract.load_config()
+    result, valid, errors = extract.extract_and_validate('doc', config, FailingClient(), None)
+    assert result == broken_extraction('doc')
+    assert not valid and errors
+    assert extract.validator.store_validation_result('doc', valid, errors) == 'needs_review'
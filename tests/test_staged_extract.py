@@ -0,0 +1,110 @@
+import os
+import re
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import yaml
+import pytest
+import staged_extract
+from llm_client import GeminiClient
+from page_store import append_page, doc_dir_for
+from conftest import load_script
+
+extract = load_script('05_extract')
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+class FakeModel:
+    """Answers measurements prompts after a delay, counting requests in flight"""
+
+    def __init__(self, delay=0.05, extra_ids=()):
+        self.delay = delay
+        self.extra_ids = list(extra_ids)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+
+    def generate_content(self, prompt):
+        with self.lock:
+            self.in_flight += 1
+            self.calls += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            ids = re.search(r"^COMPARISON_IDS: (.*)$", prompt, re.MULTILINE).group(1).split(', ')
+            measurement = extract.get_mock_extraction('doc')['measurements'][0]
+            return FakeResponse(json.dumps({'measurements': [dict(measurement, comparison_id=i)
+                                                             for i in ids + self.extra_ids]}))
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+def make_client(model, max_concurrent):
+    client = GeminiClient('fake-model', 'test-key', {'max_concurrent_requests': max_concurrent,
+                                                     'requests_per_minute_soft': 100000})
+    client.model = model
+    return client
+
+def skeleton(n_comparisons, n_units=3):
+    data = extract.get_mock_extraction('doc')
+    data.pop('measurements')
+    data['units'] = [dict(data['units'][0], unit_id=f'U{u}', unit_label=f'House {u}') for u in range(n_units)]
+    data['comparisons'] = [dict(data['comparisons'][0], comparison_id=f'K{k}', unit_id=f'U{k % n_units}')
+                           for k in range(n_comparisons)]
+    return data
+
+@pytest.fixture
+def config(workspace):
+    doc_dir = doc_dir_for('doc')
+    os.makedirs(doc_dir)
+    for page in range(4):
+        append_page(doc_dir, page, f"Page {page} about House {page % 3} and overheating hours")
+    with open('run_config.yaml') as f:
+        return yaml.safe_load(f)
+
+def test_groups_keep_units_together():
+    groups = staged_extract.group_comparisons(skeleton(8)['comparisons'], 2)
+    assert [[c['comparison_id'] for c in g] for g in groups] == [['K0', 'K3'], ['K6'], ['K1', 'K4'], ['K7'],
+                                                                 ['K2', 'K5']]
+
+def test_merge_drops_foreign_ids():
+    group = [{'comparison_id': 'K1'}]
+    kept, dropped = staged_extract.merge_measurements(group, [{'comparison_id': 'K2'}, {}, 'x'])
+    assert kept == [{'comparison_id': 'K1'}]
+    assert len(dropped) == 2
+
+def test_staged_merge_in_skeleton_order(config):
+    model = FakeModel(extra_ids=['K99'])
+    result = staged_extract.extract_staged('doc', skeleton(7), [], config, make_client(model, 4))
+    assert [m['comparison_id'] for m in result['measurements']] == [f'K{k}' for k in range(7)]
+    with open('snippets/doc/staged_stats.json') as f:
+        stats = json.load(f)
+    assert stats['comparisons_without_measurements'] == []
+    assert all(any('K99' in d for d in group['dropped']) for group in stats['groups'])
+
+def test_nested_pools_respect_max_concurrent_requests(config):
+    config['extraction']['staged_workers'] = 4
+    config['extraction']['staged_group_size'] = 1
+    model = FakeModel()
+    client = make_client(model, 2)
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        results = list(pool.map(lambda _: staged_extract.extract_staged('doc', skeleton(6), [], config, client),
+                                range(3)))
+    assert all(len(r['measurements']) == 6 for r in results)
+    assert model.calls == 18
+    assert model.max_in_flight <= 2
+
+def test_failed_group_fails_the_doc(config):
+    class Failing(FakeModel):
+        def generate_content(self, prompt):
+            if 'COMPARISON_IDS: K1' in prompt:
+                raise ValueError("bad request")
+            return super().generate_content(prompt)
+    config['extraction']['staged_group_size'] = 1
+    with pytest.raises(RuntimeError, match="1/3 measurement requests failed"):
+        staged_extract.extract_staged('doc', skeleton(3), [], config, make_client(Failing(), 2))
@@ -0,0 +1,46 @@
+import sqlite3
+import multiprocessing
+import telemetry
+from db import DB_PATH
+
+def queued_row(doc_id):
+    return (telemetry.RUN_ID, 'test', doc_id, 0.0, 0.1, 0.1) + (None,) * len(telemetry.COUNTERS) + (1, None)
+
+def rows_for(doc_id):
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM stage_metrics WHERE doc_id = ?", (doc_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+def child_records():
+    with telemetry.stage_timer('test', 'child'):
+        pass
+
+def child_queues_only():
+    # As if the database had been locked: only the exit flush writes it
+    pending, lock = telemetry._queue()
+    with lock:
+        pending.append(queued_row('child-exit'))
+
+def run_forked(target):
+    process = multiprocessing.get_context('fork').Process(target=target)
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+
+def test_forked_child_does_not_rewrite_parent_rows(workspace):
+    pending, lock = telemetry._queue()
+    with lock:
+        pending.append(queued_row('parent'))
+    try:
+        run_forked(child_records)
+        assert telemetry.flush()
+    finally:
+        pending.clear()
+    assert rows_for('child') == 1
+    assert rows_for('parent') == 1
+
+def test_child_rows_flush_when_the_child_exits(workspace):
+    run_forked(child_queues_only)
+    assert rows_for('child-exit') == 1
@@ -0,0 +1,47 @@
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+from conftest import load_script
+
+validator = load_script('06_validate')
+extract = load_script('05_extract')
+
+def write_raw(doc_id, data):
+    os.makedirs('extractions_raw', exist_ok=True)
+    with open(os.path.join('extractions_raw', f'{doc_id}.json'), 'w') as f:
+        f.write(data if isinstance(data, str) else json.dumps(data))
+
+def test_mock_extraction_is_valid(workspace):
+    assert validator.validate_data(extract.get_mock_extraction('d1')) == (True, [])
+
+def test_non_object_root_is_a_blocker(workspace):
+    for data in ([1, 2], "text", 3, None):
+        valid, errors = validator.validate_data(data)
+        assert not valid
+        assert errors == ["BLOCKER | SCHEMA_TYPE | $ | root must be an object"]
+
+def test_missing_reference_is_reported(workspace):
+    data = extract.get_mock_extraction('d1')
+    data['comparisons'][0]['unit_id'] = 'U9'
+    valid, errors = validator.validate_data(data)
+    assert not valid
+    assert "BLOCKER | MISSING_REF | comparisons[0].unit_id | U9 not found in units" in errors
+
+def test_one_bad_doc_does_not_stop_the_pool(workspace):
+    write_raw('good', extract.get_mock_extraction('good'))
+    write_raw('list', [1, 2])
+    write_raw('broken', '{"units": [')
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        results = dict(zip(['good', 'list', 'broken'], pool.map(validator.validate_doc, ['good', 'list', 'broken'])))
+    assert results['good'] == (True, [])
+    assert results['list'][1] == ["BLOCKER | SCHEMA_TYPE | $ | root must be an object"]
+    assert results['broken'][1][0].startswith("BLOCKER | INVALID_JSON")
+
+def test_unexpected_error_becomes_a_doc_error(workspace, monkeypatch):
+    def explode(data):
+        raise RuntimeError("boom")
+    write_raw('d1', extract.get_mock_extraction('d1'))
+    monkeypatch.setattr(validator, 'validate_data', explode)
+    valid, errors = validator.validate_doc('d1')
+    assert not valid
+    assert errors == ["BLOCKER | VALIDATION_ERROR | $ | RuntimeError: boom"]
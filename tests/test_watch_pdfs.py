@@ -0,0 +1,20 @@
+import os
+from conftest import load_script
+
+watch_pdfs = load_script('watch_pdfs')
+
+def test_vanished_file_is_skipped(workspace, capsys):
+    watch_pdfs.ingest_pdf(os.path.join('pdfs', 'gone.pdf'), 'test-owner', 60)
+    assert "Skipping pdfs/gone.pdf" in capsys.readouterr().out
+
+def test_unreadable_file_is_skipped(workspace, monkeypatch, capsys):
+    os.makedirs('pdfs')
+    path = os.path.join('pdfs', 'locked.pdf')
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4")
+
+    def denied(p):
+        raise PermissionError(13, "Permission denied", p)
+    monkeypatch.setattr(watch_pdfs.index, 'hash_pdf', denied)
+    watch_pdfs.ingest_pdf(path, 'test-owner', 60)
+    assert "Permission denied" in capsys.readouterr().out
@@ -0,0 +1,19 @@
+import pytest
+from conftest import load_script
+
+worker = load_script('07_worker')
+
+@pytest.mark.parametrize('llm_workers, expected', [(1, 4), (2, 2), (3, 1), (8, 1)])
+def test_llm_workers_share_in_flight_cap(workspace, monkeypatch, llm_workers, expected):
+    limits = []
+
+    def fake_client(model_name, api_key, rate_limits, cache=None):
+        limits.append(rate_limits)
+
+    monkeypatch.setattr(worker, 'GeminiClient', fake_client)
+    monkeypatch.setattr(worker.extract, 'load_api_key', lambda: 'test-key')
+    config = worker.load_config()
+    config['rate_limits'].update(requests_per_minute_soft=60, max_concurrent_requests=4)
+    worker.ExtractionStage(config, False, llm_workers)
+    assert limits[0]['max_concurrent_requests'] == expected
+    assert limits[0]['requests_per_minute_soft'] == 60 / llm_workers